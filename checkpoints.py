@@ -0,0 +1,213 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+from __future__ import division
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+
+from mo_files import File
+from mo_json import value2json, json2value
+from mo_logs import Log
+
+from operators import RunMap, compose, compose_changesets, operator_to_json, json_to_operator
+
+DEFAULT_CACHE_SIZE = 100000  # DECODED OPERATORS (AND BLOCK INDEXES) KEPT IN MEMORY
+
+
+class CheckpointTree(object):
+    """
+    PRE-COMPOSED CHANGESET OPERATORS FOR ONE BRANCH, PERSISTED TO DISK
+
+    THE BRANCH IS A SEQUENCE OF CHANGESETS; CHANGESET i TAKES THE REVISION
+    BEFORE IT TO THE REVISION IT CREATES. LEVEL k HOLDS THE COMPOSITION OF EACH
+    ALIGNED BLOCK OF 2^k CONSECUTIVE CHANGESETS, SO ANY RANGE OF CHANGESETS IS
+    COVERED BY O(log n) BLOCKS.
+
+    directory/
+        changesets.txt      - ONE CHANGESET ID PER LINE, IN BRANCH ORDER
+        <k>/<i>.json        - BLOCK i OF LEVEL k, ONE {"path": path, "runs": ..., "tail": ...} PER LINE
+        <k>/<i>.paths.json  - {path: [start, end]} BYTE RANGE OF EACH path IN THE BLOCK
+
+    A RANGE QUERY READS ONLY THE BLOCK INDEXES, AND THE ONE LINE OF EACH BLOCK
+    FOR THE path ASKED FOR.  BLOCKS NEVER CHANGE ONCE WRITTEN, SO BOTH ARE CACHED.
+    """
+
+    def __init__(self, directory, branch, cache_size=DEFAULT_CACHE_SIZE):
+        self.directory = File.new_instance(directory, branch.name)
+        self.changesets = []
+        self.index = {}  # MAP FROM changeset_id TO POSITION
+        self.block_paths = _Cache(cache_size)  # MAP FROM (level, block) TO {path: (start, end)}
+        self.operators = _Cache(cache_size)  # MAP FROM (level, block, path) TO RunMap
+
+        manifest = self._manifest()
+        if manifest.exists:
+            for changeset_id in manifest.read().split("\n"):
+                if changeset_id:
+                    self._add_id(changeset_id)
+
+    def append(self, changeset_id, operators):
+        """
+        ADD NEXT CHANGESET OF THE BRANCH
+        :param changeset_id: THE CHANGESET
+        :param operators: MAP FROM PATH TO RunMap, FOR THE FILES THE CHANGESET TOUCHES
+        """
+        if changeset_id in self.index:
+            Log.error("changeset {{changeset|left(12)}} already in checkpoint tree", changeset=changeset_id)
+        position = len(self.changesets)
+        self._write_block(0, position, operators)
+
+        # COMPLETE THE BLOCKS THIS CHANGESET FINISHES
+        level, block = 0, position
+        while block % 2 == 1:
+            operators = compose_changesets(self._read_block(level, block - 1), operators)
+            level, block = level + 1, block // 2
+            self._write_block(level, block, operators)
+
+        self._manifest().append(changeset_id)
+        self._add_id(changeset_id)
+
+    def operator(self, path, from_changeset, to_changeset):
+        """
+        :param path: FULL PATH OF THE FILE
+        :param from_changeset: REVISION THE VECTOR IS ON
+        :param to_changeset: REVISION TO PROJECT TO (MAY BE BEFORE from_changeset)
+        :return: RunMap FROM from_changeset's REVISION TO to_changeset's REVISION
+        """
+        start = self._position(from_changeset)
+        end = self._position(to_changeset)
+        if start <= end:
+            return self._range(path, start + 1, end + 1)
+        else:
+            return self._range(path, end + 1, start + 1).transpose()
+
+    def project(self, path, coverage, from_changeset, to_changeset):
+        """
+        :return: coverage, AS SEEN ON to_changeset's REVISION
+        """
+        start = self._position(from_changeset)
+        end = self._position(to_changeset)
+        if start <= end:
+            return self._range(path, start + 1, end + 1).apply(coverage)
+        else:
+            return self._range(path, end + 1, start + 1).apply(coverage, backward=True)
+
+    def _range(self, path, start, end):
+        """
+        :return: COMPOSITION OF CHANGESETS start .. end-1
+        """
+        output = RunMap.identity()
+        for level, block in _blocks(start, end):
+            operator = self._read_operator(level, block, path)
+            if operator is not None:
+                output = compose(output, operator)
+        return output
+
+    def _position(self, changeset_id):
+        position = self.index.get(changeset_id[:12])
+        if position is None:
+            Log.error("changeset {{changeset|left(12)}} not in checkpoint tree", changeset=changeset_id)
+        return position
+
+    def _add_id(self, changeset_id):
+        self.index[changeset_id[:12]] = len(self.changesets)
+        self.changesets.append(changeset_id)
+
+    def _manifest(self):
+        return File.new_instance(self.directory, "changesets.txt")
+
+    def _block_file(self, level, block):
+        return File.new_instance(self.directory, str(level), str(block) + ".json")
+
+    def _paths_file(self, level, block):
+        return File.new_instance(self.directory, str(level), str(block) + ".paths.json")
+
+    def _write_block(self, level, block, operators):
+        content = []
+        paths = {}
+        end = 0
+        for path in sorted(operators.keys()):
+            line = (value2json(dict(path=path, **operator_to_json(operators[path]))) + "\n").encode("utf8")
+            paths[path] = (end, end + len(line))
+            end += len(line)
+            content.append(line)
+        self._block_file(level, block).write_bytes(b"".join(content))
+        self._paths_file(level, block).write(value2json(paths))
+        self.block_paths.set((level, block), paths)
+
+    def _read_block(self, level, block):
+        """
+        :return: MAP FROM PATH TO RunMap, FOR THE WHOLE BLOCK
+        """
+        return {
+            record["path"]: json_to_operator(record)
+            for line in self._block_file(level, block).read_bytes().decode("utf8").split("\n")
+            if line
+            for record in [json2value(line, leaves=False)]
+        }
+
+    def _read_operator(self, level, block, path):
+        """
+        :return: RunMap OF path IN THE BLOCK, OR None IF THE BLOCK DOES NOT TOUCH path
+        """
+        key = (level, block, path)
+        operator = self.operators.get(key)
+        if operator is not None:
+            return operator
+
+        paths = self.block_paths.get((level, block))
+        if paths is None:
+            paths = {p: tuple(r) for p, r in json2value(self._paths_file(level, block).read(), leaves=False).items()}
+            self.block_paths.set((level, block), paths)
+        span = paths.get(path)
+        if span is None:
+            return None
+
+        start, end = span
+        with open(self._block_file(level, block).os_path, "rb") as f:
+            f.seek(start)
+            line = f.read(end - start)
+        operator = json_to_operator(json2value(line.decode("utf8"), leaves=False))
+        self.operators.set(key, operator)
+        return operator
+
+
+class _Cache(object):
+    """
+    LEAST-RECENTLY-USED VALUES, BOUNDED BY COUNT
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.values = OrderedDict()
+
+    def get(self, key):
+        value = self.values.pop(key, None)
+        if value is not None:
+            self.values[key] = value
+        return value
+
+    def set(self, key, value):
+        self.values.pop(key, None)
+        self.values[key] = value
+        while len(self.values) > self.max_size:
+            self.values.popitem(last=False)
+
+
+def _blocks(start, end):
+    """
+    :return: THE (level, block) PAIRS, IN ORDER, THAT EXACTLY COVER start .. end-1
+    """
+    output = []
+    while start < end:
+        level = 0
+        while start % (2 << level) == 0 and start + (2 << level) <= end:
+            level += 1
+        output.append((level, start >> level))
+        start += 1 << level
+    return output
@@ -0,0 +1,298 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+from __future__ import division
+from __future__ import unicode_literals
+
+import numpy as np
+from mo_logs import Log
+
+from operators import RunBuilder
+
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+class CoverageVector(object):
+    """
+    COVERAGE OF ONE FILE, ONE BIT PER LINE
+    """
+
+    __slots__ = ["bits", "length"]
+
+    def __init__(self, bits, length):
+        self.bits = bits
+        self.length = length
+
+    @classmethod
+    def from_bools(cls, covered):
+        covered = np.asarray(covered, dtype=bool).ravel()
+        return CoverageVector(np.packbits(covered), len(covered))
+
+    @classmethod
+    def from_lines(cls, lines, length):
+        """
+        :param lines: ZERO-BASED LINE NUMBERS THAT ARE COVERED
+        :param length: NUMBER OF LINES IN FILE
+        """
+        covered = np.zeros(length, dtype=bool)
+        covered[np.asarray(lines, dtype=int)] = True
+        return CoverageVector.from_bools(covered)
+
+    def to_bools(self):
+        return np.unpackbits(self.bits)[:self.length].astype(bool)
+
+    def lines(self):
+        """
+        :return: ZERO-BASED LINE NUMBERS THAT ARE COVERED
+        """
+        return np.flatnonzero(self.to_bools())
+
+    def count(self):
+        return int(POPCOUNT[self.bits].sum())
+
+    def apply(self, operator):
+        """
+        :param operator: RunMap (OR LineMap) FROM THIS FILE'S REVISION
+        :return: CoverageVector ON THE OPERATOR'S new REVISION
+        """
+        return CoverageVector.from_bools(operator.apply(self.to_bools()))
+
+    def __len__(self):
+        return self.length
+
+    def __or__(self, other):
+        _same_length(self, other)
+        return CoverageVector(self.bits | other.bits, self.length)
+
+    def __and__(self, other):
+        _same_length(self, other)
+        return CoverageVector(self.bits & other.bits, self.length)
+
+    def __eq__(self, other):
+        if not isinstance(other, CoverageVector):
+            return False
+        return self.length == other.length and np.array_equal(self.bits, other.bits)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+
+class Layout(object):
+    """
+    WHERE EACH FILE OF A REVISION IS, IN ONE VECTOR OF ALL THE REVISION'S LINES
+    FILE i IS LINES offsets[i] .. offsets[i+1]-1
+    """
+
+    __slots__ = ["paths", "index", "offsets"]
+
+    def __init__(self, paths, offsets):
+        self.paths = paths
+        self.index = {p: i for i, p in enumerate(paths)}
+        self.offsets = offsets
+
+    @classmethod
+    def from_lengths(cls, paths, lengths):
+        return Layout(list(paths), np.concatenate(([0], np.cumsum(lengths, dtype=np.int64))))
+
+    @property
+    def length(self):
+        return int(self.offsets[-1])
+
+    def span(self, path):
+        """
+        :return: (start, end) OF path IN THE REVISION VECTOR, OR None
+        """
+        i = self.index.get(path)
+        if i is None:
+            return None
+        return int(self.offsets[i]), int(self.offsets[i + 1])
+
+    def same_layout(self, other):
+        return self.paths == other.paths and np.array_equal(self.offsets, other.offsets)
+
+    def changeset_operator(self, operators, old_lengths=None, backward=False):
+        """
+        ONE RunMap FOR A WHOLE CHANGESET, OVER THE REVISION VECTOR
+        THE PER-FILE OPERATORS ARE SHIFTED TO THEIR FILE'S OFFSET, AND THE
+        UNTOUCHED FILES BETWEEN THEM BECOME SINGLE RUNS, SO IT HAS ABOUT AS
+        MANY RUNS AS THE CHANGESET HAS HUNKS.
+
+        A CHANGESET OFTEN TOUCHES FILES THIS LAYOUT DOES NOT HAVE (eg FILES
+        WITH NO COVERAGE).  FILES THE CHANGESET ADDS ARE APPENDED, AS NET-NEW
+        LINES; SO ARE FILES WITH A KNOWN old_length.  THE REST ARE IGNORED.
+
+        :param operators: MAP FROM PATH TO RunMap (FILES NOT MENTIONED ARE UNCHANGED)
+        :param old_lengths: OPTIONAL MAP FROM PATH TO LENGTH ON THE old REVISION, FOR FILES NOT IN THIS LAYOUT
+        :param backward: True IF THIS LAYOUT IS THE new REVISION OF THE operators, AND WE GO TO THEIR old REVISION
+        :return: (RunMap, Layout OF THE CHANGESET'S new REVISION (old REVISION IF backward))
+        """
+        old_offsets = self.offsets.tolist()
+        lengths = np.diff(self.offsets)
+        new_lengths = lengths.copy()
+        touched = []
+        added = []
+        for path, operator in operators.items():
+            i = self.index.get(path)
+            if i is not None:
+                touched.append((i, operator))
+                new_lengths[i] = _output_length(operator, int(lengths[i]), backward)
+            elif adds_file(operator, backward):
+                added.append((path, _output_length(operator, 0, backward)))
+            elif old_lengths and path in old_lengths:
+                added.append((path, _output_length(operator, old_lengths[path], backward)))
+        touched.sort(key=lambda t: t[0])
+        added.sort()
+        new_starts = np.concatenate(([0], np.cumsum(new_lengths, dtype=np.int64))).tolist()
+
+        runs = RunBuilder()
+        untouched = 0  # FIRST FILE NOT YET COPIED
+        for i, operator in touched:
+            runs.add(new_starts[untouched], old_offsets[untouched], old_offsets[i] - old_offsets[untouched])
+            new_start, old_start = new_starts[i], old_offsets[i]
+            to_start, from_start, length, to_tail, from_tail = operator.directed(backward)
+            for n, o, l in zip(to_start.tolist(), from_start.tolist(), length.tolist()):
+                runs.add(new_start + n, old_start + o, l)
+            runs.add(new_start + to_tail, old_start + from_tail, old_offsets[i + 1] - old_start - from_tail)
+            untouched = i + 1
+        num_files = len(self.paths)
+        runs.add(new_starts[untouched], old_offsets[untouched], old_offsets[num_files] - old_offsets[untouched])
+
+        new_layout = Layout.from_lengths(
+            self.paths + [p for p, _ in added],
+            np.concatenate((new_lengths, [length for _, length in added])).astype(np.int64)
+        )
+        return runs.build(new_layout.length, old_offsets[num_files]), new_layout
+
+
+class RevisionCoverage(Layout):
+    """
+    COVERAGE OF EVERY FILE IN A REVISION, AS ONE PACKED VECTOR
+    """
+
+    __slots__ = ["bits"]
+
+    def __init__(self, paths, offsets, bits):
+        Layout.__init__(self, paths, offsets)
+        self.bits = bits
+
+    @classmethod
+    def from_files(cls, files):
+        """
+        :param files: MAP FROM PATH TO CoverageVector (OR BOOLEAN VECTOR)
+        """
+        paths = sorted(files.keys())
+        vectors = [_to_bools(files[p]) for p in paths]
+        covered = np.concatenate(vectors) if vectors else np.zeros(0, dtype=bool)
+        layout = Layout.from_lengths(paths, [len(v) for v in vectors])
+        return RevisionCoverage(layout.paths, layout.offsets, np.packbits(covered))
+
+    def to_bools(self):
+        return np.unpackbits(self.bits)[:self.length].astype(bool)
+
+    def __getitem__(self, path):
+        """
+        :return: CoverageVector FOR ONE FILE
+        """
+        span = self.span(path)
+        if span is None:
+            return None
+        start, end = span
+        first_byte = start // 8
+        covered = np.unpackbits(self.bits[first_byte:(end + 7) // 8])[start - first_byte * 8:end - first_byte * 8]
+        return CoverageVector.from_bools(covered)
+
+    def files(self):
+        """
+        :return: MAP FROM PATH TO CoverageVector
+        """
+        return {p: self[p] for p in self.paths}
+
+    def count(self):
+        return int(POPCOUNT[self.bits].sum())
+
+    def project(self, operators, backward=False):
+        """
+        MAP THE COVERAGE OF EVERY FILE THROUGH A CHANGESET, IN ONE PASS
+        :param operators: MAP FROM PATH TO RunMap (FILES NOT MENTIONED ARE UNCHANGED)
+        :param backward: True IF THIS COVERAGE IS ON THE CHANGESET'S new REVISION
+        :return: RevisionCoverage ON THE CHANGESET'S new REVISION (old REVISION IF backward)
+        """
+        operator, layout = self.changeset_operator(operators, backward=backward)
+        covered = operator.apply(self.to_bools())
+        return RevisionCoverage(layout.paths, layout.offsets, np.packbits(covered))
+
+    def __or__(self, other):
+        _same_layout(self, other)
+        return RevisionCoverage(self.paths, self.offsets, self.bits | other.bits)
+
+    def __and__(self, other):
+        _same_layout(self, other)
+        return RevisionCoverage(self.paths, self.offsets, self.bits & other.bits)
+
+
+def union(coverages):
+    """
+    ONE BATCHED OR OVER MANY RevisionCoverage OF THE SAME REVISION
+    THEY MAY HAVE DIFFERENT FILES (eg DIFFERENT TEST SUITES); THE RESULT HAS ALL OF THEM
+    :param coverages: LIST OF RevisionCoverage
+    :return: RevisionCoverage WITH EVERY LINE COVERED BY ANY OF coverages
+    """
+    coverages = list(coverages)
+    if not coverages:
+        return RevisionCoverage([], np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.uint8))
+    first = coverages[0]
+    if all(first.same_layout(c) for c in coverages[1:]):
+        return RevisionCoverage(first.paths, first.offsets, np.bitwise_or.reduce([c.bits for c in coverages]))
+
+    lengths = {}
+    for c in coverages:
+        for path, length in zip(c.paths, np.diff(c.offsets).tolist()):
+            expected = lengths.setdefault(path, length)
+            if expected != length:
+                Log.error("{{path}} has {{a}} lines in one coverage, and {{b}} in another", path=path, a=expected, b=length)
+    paths = sorted(lengths.keys())
+    layout = Layout.from_lengths(paths, [lengths[p] for p in paths])
+
+    covered = np.zeros(layout.length, dtype=bool)
+    for c in coverages:
+        # MOVE EACH FILE FROM ITS OFFSET IN c TO ITS OFFSET IN layout
+        lines = np.flatnonzero(c.to_bools())
+        starts = layout.offsets[[layout.index[p] for p in c.paths]] if c.paths else np.zeros(0, dtype=np.int64)
+        shift = np.repeat(starts - c.offsets[:-1], np.diff(c.offsets))
+        covered[lines + shift[lines]] = True
+    return RevisionCoverage(layout.paths, layout.offsets, np.packbits(covered))
+
+
+def adds_file(operator, backward=False):
+    """
+    :return: True IF THE operator CREATES ITS FILE (NOTHING COMES FROM THE old REVISION)
+             IF backward, True IF THE operator DELETES ITS FILE
+    """
+    return operator.num_runs == 0 and (operator.tail_new if backward else operator.tail_old) == 0
+
+
+def _output_length(operator, length, backward):
+    if backward:
+        return operator.lengths(new_length=length)[1]
+    return operator.lengths(old_length=length)[0]
+
+
+def _to_bools(vector):
+    if isinstance(vector, CoverageVector):
+        return vector.to_bools()
+    return np.asarray(vector, dtype=bool).ravel()
+
+
+def _same_length(a, b):
+    if a.length != b.length:
+        Log.error("expecting vectors of same length ({{a}} != {{b}})", a=a.length, b=b.length)
+
+
+def _same_layout(a, b):
+    if not a.same_layout(b):
+        Log.error("expecting coverage of the same revision")
@@ -0,0 +1,171 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+from __future__ import division
+from __future__ import unicode_literals
+
+import os
+
+import numpy as np
+from mo_files import File
+from mo_json import json2value, value2json
+from mo_logs import Log
+
+from coverage_vectors import Layout, RevisionCoverage
+from operators import NO_LINE
+from projection import CoverageMerge
+
+LCOV_EXTENSIONS = (".info", ".lcov")
+JSON_LINES_EXTENSIONS = (".json", ".jsonl")
+
+
+class CoverageIngester(object):
+    """
+    STREAM COVERAGE ARTIFACTS, FILE BY FILE, ONTO ONE target REVISION
+
+    EACH RECORD IS (coverage_revision, path, covered lines); ITS LINES ARE
+    MAPPED TO THE target IN ONE VECTORIZED STEP, THROUGH THE COMPOSED
+    CHANGESET OPERATORS, AND OR-ED INTO A BOOLEAN VECTOR FOR THE FILE. MEMORY
+    IS BOUNDED BY THE COVERED LINES OF THE target, NOT BY THE INPUT SIZE.
+
+    FILE LENGTHS ARE NOT KNOWN FROM COVERAGE ARTIFACTS, SO EACH FILE'S VECTOR
+    ENDS AT ITS LAST COVERED LINE, UNLESS coverage() IS GIVEN THE LENGTHS
+    """
+
+    def __init__(self, changesets, target):
+        """
+        :param changesets: LIST OF (changeset_id, {path: RunMap}) IN BRANCH ORDER (SEE CoverageMerge)
+        :param target: THE changeset_id OF THE REVISION TO MAP ONTO
+        """
+        self.merge = CoverageMerge(changesets, target)
+        self.covered = {}  # MAP FROM PATH TO BOOLEAN VECTOR ON target
+        self.records = 0
+        self.lines = 0
+
+    def add(self, revision_id, path, lines):
+        """
+        :param revision_id: REVISION THE COVERAGE WAS TAKEN ON
+        :param path: FULL PATH OF THE FILE, WITH LEADING SLASH
+        :param lines: ZERO-BASED LINE NUMBERS COVERED ON revision_id
+        """
+        lines = np.asarray(lines, dtype=np.int64)
+        self.records += 1
+        self.lines += len(lines)
+        operators, backward = self.merge.operators(revision_id)
+        operator = operators.get(path)
+        if operator is not None:
+            lines = operator.map_lines(lines, backward=backward)
+            lines = lines[lines != NO_LINE]
+        if not len(lines):
+            return
+
+        covered = self.covered.get(path)
+        length = int(lines.max()) + 1
+        if covered is None:
+            covered = self.covered[path] = np.zeros(length, dtype=bool)
+        elif len(covered) < length:
+            covered = self.covered[path] = np.concatenate((covered, np.zeros(length - len(covered), dtype=bool)))
+        covered[lines] = True
+
+    def add_lcov(self, revision_id, filename):
+        """
+        :param revision_id: REVISION THE COVERAGE WAS TAKEN ON
+        :param filename: lcov TRACE FILE
+        """
+        for path, lines in read_lcov(File(filename).read_lines()):
+            self.add(revision_id, path, lines)
+
+    def add_json_lines(self, filename, revision_id=None):
+        """
+        :param filename: ONE {"revision", "path", "covered"} PER LINE ("covered" ARE ONE-BASED LINE NUMBERS)
+        :param revision_id: THE REVISION, FOR RECORDS WITHOUT ONE
+        """
+        for line in File(filename).read_lines():
+            if not line.strip():
+                continue
+            record = json2value(line, leaves=False)
+            revision = record["revision"] or revision_id
+            if not revision:
+                Log.error("expecting a revision for {{path}} in {{filename}}", path=record["path"], filename=filename)
+            self.add(revision, _full_path(record["path"]), np.array(list(record["covered"]), dtype=np.int64) - 1)
+
+    def add_directory(self, directory, revision_id=None):
+        """
+        INGEST EVERY lcov AND JSON-LINES FILE UNDER directory, ONE AT A TIME
+        :param revision_id: REVISION THE COVERAGE WAS TAKEN ON (lcov HAS NO REVISION OF ITS OWN)
+        """
+        for root, dirs, files in os.walk(File(directory).os_path):
+            dirs.sort()
+            for name in sorted(files):
+                filename = os.path.join(root, name)
+                if name.endswith(LCOV_EXTENSIONS):
+                    if not revision_id:
+                        Log.error("expecting the revision of {{filename}}", filename=filename)
+                    self.add_lcov(revision_id, filename)
+                elif name.endswith(JSON_LINES_EXTENSIONS):
+                    self.add_json_lines(filename, revision_id)
+
+    def coverage(self, file_lengths=None):
+        """
+        :param file_lengths: OPTIONAL MAP FROM PATH TO LENGTH ON THE target
+        :return: RevisionCoverage ON THE target
+        """
+        files = {}
+        for path, covered in self.covered.items():
+            length = len(covered) if not file_lengths or path not in file_lengths else file_lengths[path]
+            if length < len(covered):
+                Log.error("{{path}} has {{length}} lines, but line {{line}} is covered", path=path, length=length, line=len(covered) - 1)
+            files[path] = np.concatenate((covered, np.zeros(length - len(covered), dtype=bool)))
+        return RevisionCoverage.from_files(files)
+
+
+def read_lcov(lines):
+    """
+    :param lines: ITERABLE OF lcov TRACE FILE LINES
+    :return: GENERATOR OF (path, ZERO-BASED COVERED LINE NUMBERS), ONE PER SOURCE FILE RECORD
+    """
+    path = None
+    covered = []
+    for line in lines:
+        if line.startswith("SF:"):
+            path = _full_path(line[3:].strip())
+            covered = []
+        elif line.startswith("DA:"):
+            line_number, count = line[3:].split(",")[:2]
+            if int(count) > 0:
+                covered.append(int(line_number) - 1)
+        elif line.startswith("end_of_record"):
+            if path is None:
+                Log.error("expecting SF: before end_of_record")
+            yield path, covered
+            path = None
+    if path is not None:
+        yield path, covered
+
+
+def write_coverage(coverage, filename):
+    """
+    ONE LINE OF JSON FOR THE Layout, THEN THE PACKED BITS
+    """
+    header = value2json({"paths": coverage.paths, "offsets": coverage.offsets.tolist()}).encode("utf8")
+    File(filename).write_bytes(header + b"\n" + coverage.bits.tobytes())
+
+
+def read_coverage(filename):
+    """
+    :return: RevisionCoverage FROM write_coverage()
+    """
+    content = File(filename).read_bytes()
+    end = content.index(b"\n")
+    header = json2value(content[:end].decode("utf8"), leaves=False)
+    layout = Layout(list(header["paths"]), np.array(list(header["offsets"]), dtype=np.int64))
+    return RevisionCoverage(layout.paths, layout.offsets, np.frombuffer(content[end + 1:], dtype=np.uint8))
+
+
+def _full_path(path):
+    return path if path.startswith("/") else "/" + path
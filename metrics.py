@@ -0,0 +1,79 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+from __future__ import division
+from __future__ import unicode_literals
+
+import numpy as np
+from mo_dots import wrap
+
+
+def file_metrics(path, operator, covered=None):
+    """
+    :param path: FILE NAME
+    :param operator: RunMap OF THE CHANGESET, FOR THIS FILE
+    :param covered: BOOLEAN COVERAGE OF THE FILE ON THE CHANGESET'S new REVISION (OPTIONAL)
+    :return: {"path", "net_new_lines", "net_new_covered", "net_new_percent"}
+    """
+    # EVERY new LINE BEFORE THE TAIL THAT IS NOT IN A RUN IS NET-NEW
+    net_new_lines = int(operator.tail_new - np.sum(operator.length))
+    output = {"path": path, "net_new_lines": net_new_lines}
+    if covered is not None:
+        covered = np.asarray(covered, dtype=bool)
+        net_new_covered = int(np.count_nonzero(covered & operator.net_new_lines(len(covered))))
+        output["net_new_covered"] = net_new_covered
+        output["net_new_percent"] = _percent(net_new_covered, net_new_lines)
+    return output
+
+
+def changeset_metrics(operators, coverage=None):
+    """
+    FILES THE coverage DOES NOT HAVE (eg README, OR CODE THAT IS NOT INSTRUMENTED)
+    GET NO COVERAGE NUMBERS, AND ARE LEFT OUT OF THE CHANGESET'S net_new_percent
+
+    :param operators: MAP FROM PATH TO RunMap, FOR ONE CHANGESET
+    :param coverage: RevisionCoverage OF THE CHANGESET'S new REVISION (OPTIONAL)
+    :return: {"files": [file_metrics, ...], "net_new_lines", "net_new_covered", "net_new_percent"}
+    """
+    files = []
+    for path in sorted(operators.keys()):
+        vector = None if coverage is None else coverage[path]
+        files.append(file_metrics(path, operators[path], None if vector is None else vector.to_bools()))
+
+    output = {"files": files, "net_new_lines": sum(f["net_new_lines"] for f in files)}
+    if coverage is not None:
+        measured = [f for f in files if "net_new_covered" in f]
+        output["net_new_covered"] = sum(f["net_new_covered"] for f in measured)
+        output["net_new_percent"] = _percent(output["net_new_covered"], sum(f["net_new_lines"] for f in measured))
+    return wrap(output)
+
+
+def push_metrics(changesets, coverage):
+    """
+    METRICS FOR EVERY CHANGESET IN A PUSH, USING COVERAGE FROM THE END OF THE PUSH
+    THE coverage IS PROJECTED BACKWARD, ONE CHANGESET AT A TIME, SO EACH
+    CHANGESET IS MEASURED WITH THE COVERAGE OF ITS OWN new REVISION
+
+    :param changesets: LIST OF (changeset_id, {path: RunMap}) IN BRANCH ORDER
+    :param coverage: RevisionCoverage OF THE new REVISION OF THE LAST CHANGESET
+    :return: LIST OF changeset_metrics (WITH "changeset"), IN BRANCH ORDER
+    """
+    output = []
+    for changeset_id, operators in reversed(changesets):
+        metrics = changeset_metrics(operators, coverage)
+        metrics["changeset"] = changeset_id
+        output.append(metrics)
+        coverage = coverage.project(operators, backward=True)
+    output.reverse()
+    return wrap(output)
+
+
+def _percent(covered, total):
+    if not total:
+        return None
+    return covered / total
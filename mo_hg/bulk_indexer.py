@@ -0,0 +1,128 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+
+from __future__ import division
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+
+from mo_dots import wrap
+from mo_json import value2json
+from mo_logs import Log
+from mo_threads import Lock, Queue, Thread, Till, THREAD_STOP
+from mo_times.durations import SECOND
+
+BATCH_SIZE = 500  # MOST DOCUMENTS IN ONE _bulk REQUEST
+BATCH_BYTES = 10 * 1000 * 1000  # MOST JSON BYTES IN ONE _bulk REQUEST
+BATCH_PERIOD = 5 * SECOND  # LONGEST A DOCUMENT WAITS FOR ITS BATCH TO FILL
+QUEUE_SIZE = 10000  # add() WAITS WHEN THIS MANY DOCUMENTS ARE WAITING
+
+
+class BulkIndexer(object):
+    """
+    WRITE-BEHIND FOR AN ES INDEX: add() RETURNS AT ONCE, AND A BACKGROUND
+    THREAD SENDS THE DOCUMENTS IN _bulk REQUESTS, BY COUNT, BYTES, OR TIME
+
+    A DOCUMENT IS SERIALIZED IN add(), SO THE CALLER IS FREE TO CHANGE IT
+    AFTERWARD. DOCUMENTS WITH THE SAME id IN ONE BATCH ARE SENT ONCE (THE
+    LAST ONE WINS). EVERYTHING WAITING IS SENT WHEN THE INDEXER IS STOPPED
+    """
+
+    def __init__(self, index, batch_size=BATCH_SIZE, batch_bytes=BATCH_BYTES, period=BATCH_PERIOD, max_size=QUEUE_SIZE):
+        """
+        :param index: ES Index (ANYTHING WITH extend([{"id", "json"}]))
+        """
+        self.index = index
+        self.batch_size = batch_size
+        self.batch_bytes = batch_bytes
+        self.period = period
+        self.queue = Queue("bulk index", max=max_size, silent=True)
+        self.batching = 0  # DOCUMENTS TAKEN FROM THE QUEUE, BUT NOT SENT YET
+        self.locker = Lock()  # FOR THE stats
+        self.stats = wrap({"added": 0, "duplicates": 0, "batches": 0, "sent": 0, "failures": 0})
+        self.worker = Thread.run("bulk indexer", self._worker)
+
+    def add(self, record):
+        """
+        :param record: {"id": id, "value": document}
+        """
+        with self.locker:
+            self.stats.added += 1
+        self.queue.add({"id": record["id"], "json": value2json(record["value"])})
+
+    @property
+    def depth(self):
+        """
+        :return: NUMBER OF DOCUMENTS NOT SENT YET
+        """
+        return len(self.queue) + self.batching
+
+    def stop(self):
+        """
+        SEND EVERYTHING WAITING, THEN STOP
+        """
+        self.worker.stop()
+        self.worker.join()
+
+    def _worker(self, please_stop):
+        batch = OrderedDict()  # MAP FROM id TO RECORD
+        num_bytes = 0
+        deadline = None
+        while True:
+            record = self.queue.pop(till=please_stop if deadline is None else please_stop | deadline)
+            if record is not None and record is not THREAD_STOP:
+                num_bytes += self._add(batch, record)
+                if deadline is None:
+                    deadline = Till(seconds=self.period.seconds)
+
+            if please_stop or record is THREAD_STOP:
+                for r in self.queue.pop_all():
+                    num_bytes += self._add(batch, r)
+                    if len(batch) >= self.batch_size or num_bytes >= self.batch_bytes:
+                        self._send(batch)
+                        batch = OrderedDict()
+                        num_bytes = 0
+                self._send(batch)
+                return
+
+            if len(batch) >= self.batch_size or num_bytes >= self.batch_bytes or (batch and deadline):
+                self._send(batch)
+                batch = OrderedDict()
+                num_bytes = 0
+                deadline = None
+
+    def _add(self, batch, record):
+        """
+        :return: CHANGE IN THE NUMBER OF BYTES IN THE batch
+        """
+        size = len(record["json"])
+        old = batch.pop(record["id"], None)
+        if old is not None:
+            with self.locker:
+                self.stats.duplicates += 1
+            size -= len(old["json"])
+        batch[record["id"]] = record
+        self.batching = len(batch)
+        return size
+
+    def _send(self, batch):
+        if not batch:
+            return
+        try:
+            self.index.extend(list(batch.values()))
+            with self.locker:
+                self.stats.sent += len(batch)
+        except Exception as e:
+            with self.locker:
+                self.stats.failures += len(batch)
+            Log.warning("did not save {{num}} documents to ES", num=len(batch), cause=e)
+        finally:
+            with self.locker:
+                self.stats.batches += 1
+            self.batching = 0
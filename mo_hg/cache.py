@@ -0,0 +1,183 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+
+from __future__ import division
+from __future__ import unicode_literals
+
+import sys
+from collections import OrderedDict
+from functools import wraps
+from itertools import islice
+
+from mo_dots import wrap, unwrap, Data
+from mo_future import get_function_arguments, get_function_defaults
+from mo_threads import Lock
+from mo_times.dates import Date
+from mo_times.durations import HOUR
+
+SIZE_SAMPLE = 10  # LONGER LISTS ARE SIZED FROM THIS MANY OF THEIR ITEMS
+
+
+class LruCache(object):
+    """
+    LEAST-RECENTLY-USED CACHE, BOUNDED BY THE (ESTIMATED) BYTES IT HOLDS;
+    EVERY ENTRY ALSO EXPIRES AFTER ITS duration
+    """
+
+    def __init__(self, name, max_bytes):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.locker = Lock()
+        self.entries = OrderedDict()  # MAP FROM KEY TO (expires, size, value); OLDEST USE FIRST
+        self.pending = {}  # MAP FROM KEY TO Lock, FOR THE KEYS BEING COMPUTED
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, count=True):
+        """
+        :param count: False IF THIS LOOKUP WAS ALREADY COUNTED
+        :return: (found, value)
+        """
+        with self.locker:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] < Date.now().unix:
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += count
+                return False, None
+            # MOVE TO THE END: MOST RECENTLY USED
+            del self.entries[key]
+            self.entries[key] = entry
+            self.hits += count
+            return True, entry[2]
+
+    def set(self, key, value, duration=HOUR):
+        size = estimate_size(value)
+        with self.locker:
+            if key in self.entries:
+                self._remove(key)
+            if size > self.max_bytes:
+                return  # WOULD EVICT EVERYTHING ELSE
+            self.entries[key] = (Date.now().unix + duration.seconds, size, value)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                oldest = next(iter(self.entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def clear(self):
+        with self.locker:
+            self.entries.clear()
+            self.bytes = 0
+
+    @property
+    def stats(self):
+        with self.locker:
+            return wrap({
+                "name": self.name,
+                "items": len(self.entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations
+            })
+
+    def _remove(self, key):
+        _, size, _ = self.entries.pop(key)
+        self.bytes -= size
+
+
+def cached(store, duration=HOUR, lock=False):
+    """
+    METHOD DECORATOR, USING THE LruCache AT self.caches[name]
+    THE DECORATED METHOD HAS locate(self, *args, **kwargs), RETURNING THE
+    (LruCache, key) OF A CALL, SO OTHER METHODS CAN SHARE ITS ENTRIES
+    :param store: name, OR FUNCTION(*args, **kwargs) (THE METHOD'S PARAMETERS, WITHOUT self) RETURNING name
+    :param duration: HOW LONG AN ENTRY IS GOOD FOR
+    :param lock: True TO COMPUTE EACH KEY ONCE, WHEN MANY THREADS ASK FOR IT AT THE SAME TIME
+    """
+    def decorator(func):
+        def locate(self, *args, **kwargs):
+            return self.caches[store(*args, **kwargs) if callable(store) else store], _call_key(func, args, kwargs)
+
+        @wraps(func)
+        def wrapper(self, *args, **kwargs):
+            cache, key = locate(self, *args, **kwargs)
+            found, value = cache.get(key)
+            if found:
+                return value
+            if not lock:
+                value = func(self, *args, **kwargs)
+                cache.set(key, value, duration)
+                return value
+
+            with cache.locker:
+                key_lock = cache.pending.setdefault(key, Lock())
+            try:
+                with key_lock:
+                    found, value = cache.get(key, count=False)
+                    if found:
+                        return value
+                    value = func(self, *args, **kwargs)
+                    cache.set(key, value, duration)
+                    return value
+            finally:
+                with cache.locker:
+                    if cache.pending.get(key) is key_lock:
+                        del cache.pending[key]
+        wrapper.locate = locate
+        return wrapper
+    return decorator
+
+
+def estimate_size(value):
+    """
+    :return: ABOUT THE NUMBER OF BYTES value TAKES IN MEMORY; A LONG LIST IS
+             SIZED FROM ITS FIRST SIZE_SAMPLE ITEMS, SO A BIG DIFF IS NOT WALKED
+    """
+    value = unwrap(value)
+    if isinstance(value, (dict, Data)):
+        return sys.getsizeof(value) + sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple)):
+        sample = sum(estimate_size(v) for v in islice(value, SIZE_SAMPLE))
+        return sys.getsizeof(value) + sample * len(value) // max(1, min(len(value), SIZE_SAMPLE))
+    else:
+        return sys.getsizeof(value)
+
+
+def _call_key(func, args, kwargs):
+    """
+    :return: HASHABLE KEY FOR func(self, *args, **kwargs), THE SAME HOWEVER THE PARAMETERS ARE PASSED
+    """
+    names = get_function_arguments(func)[1:]  # WITHOUT self
+    defaults = get_function_defaults(func) or ()
+    values = dict(zip(names[len(names) - len(defaults):], defaults))
+    values.update(zip(names, args))
+    values.update(kwargs)
+    return (func.__name__,) + tuple(_hashable(values.get(n)) for n in names)
+
+
+def _hashable(value):
+    """
+    :return: value, WITH ANY dict OR list CONVERTED TO A tuple
+    """
+    value = unwrap(value)
+    if isinstance(value, (dict, Data)):
+        return tuple(sorted((k, _hashable(v)) for k, v in value.items()))
+    elif isinstance(value, (list, tuple)):
+        return tuple(_hashable(v) for v in value)
+    else:
+        return value
@@ -0,0 +1,53 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+
+from __future__ import division
+from __future__ import unicode_literals
+
+import threading
+from contextlib import contextmanager
+
+from mo_threads import Lock
+
+
+class ClientPool(object):
+    """
+    NO MORE THAN size CLIENTS, EACH USED BY ONE THREAD AT A TIME, FOR CLIENTS
+    THAT ARE NOT KNOWN TO BE THREAD-SAFE; THEY ARE MADE WHEN FIRST NEEDED
+    """
+
+    def __init__(self, create, size):
+        """
+        :param create: FUNCTION RETURNING A NEW CLIENT
+        :param size: MOST CLIENTS; MORE THREADS WAIT FOR ONE
+        """
+        self.create = create
+        self.size = size
+        self.available = threading.BoundedSemaphore(size)
+        self.locker = Lock()
+        self.idle = []
+        self.made = 0
+
+    @contextmanager
+    def client(self):
+        """
+        WAIT FOR A CLIENT NO OTHER THREAD IS USING
+        """
+        with self.available:
+            with self.locker:
+                client = self.idle.pop() if self.idle else None
+            if client is None:
+                client = self.create()
+                with self.locker:
+                    self.made += 1
+            try:
+                yield client
+            finally:
+                with self.locker:
+                    self.idle.append(client)
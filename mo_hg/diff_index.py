@@ -0,0 +1,137 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+
+from __future__ import division
+from __future__ import unicode_literals
+
+import re
+
+from mo_dots import wrap
+from mo_files import File
+from mo_json import value2json, json2value
+from mo_logs import Log
+
+from mo_hg.parse import diff_to_json_stream
+
+FILE_HEADER = re.compile(br"^--- ", re.MULTILINE)
+DEV_NULL = "dev/null"
+INDEX_SUFFIX = ".index.json"
+
+
+class DiffIndex(object):
+    """
+    BYTE OFFSETS OF EVERY FILE IN A RAW UNIFIED DIFF
+    SO WE CAN PARSE JUST THE FILES WE ARE ASKED FOR
+    """
+
+    def __init__(self, files, size=None):
+        """
+        :param files: LIST OF {"old": name, "new": name, "start": offset, "end": offset}
+        :param size: NUMBER OF BYTES IN THE DIFF, TO CHECK A CACHED INDEX STILL MATCHES IT
+        """
+        self.files = files
+        self.size = size
+        self.lookup = {}
+        for f in files:
+            for name in (f["old"], f["new"]):
+                if not name.endswith(DEV_NULL):
+                    self.lookup.setdefault(name, f)
+
+    @classmethod
+    def scan(cls, diff):
+        """
+        ONE PASS OVER THE DIFF, NOTHING IS DECODED BUT THE FILE HEADERS
+        :param diff: BYTES OF THE UNIFIED DIFF
+        :return: DiffIndex
+        """
+        file_starts = [m.start() for m in FILE_HEADER.finditer(diff)]
+        file_ends = file_starts[1:] + [len(diff)]
+
+        files = []
+        for start, end in zip(file_starts, file_ends):
+            old_end = _line_end(diff, start, end)
+            new_end = _line_end(diff, old_end + 1, end)
+            files.append({
+                "old": diff[start + 5:old_end].decode("utf8", "replace"),  # eg "--- a/dom/base/nsDocument.cpp"
+                "new": diff[old_end + 6:new_end].decode("utf8", "replace"),  # eg "+++ b/dom/base/nsDocument.cpp"
+                "start": start,
+                "end": end
+            })
+        return DiffIndex(files, len(diff))
+
+    @classmethod
+    def for_file(cls, filename):
+        """
+        USE THE INDEX CACHED NEXT TO THE DIFF FILE, OR MAKE ONE
+        THE CACHED INDEX IS REBUILT IF IT WAS MADE FOR A DIFF OF ANOTHER SIZE
+        :param filename: NAME OF FILE WITH THE RAW DIFF
+        :return: DiffIndex
+        """
+        diff_file = File(filename)
+        index_file = File(filename + INDEX_SUFFIX)
+        if index_file.exists:
+            try:
+                output = DiffIndex.from_value(json2value(index_file.read(), leaves=False))
+                if output.size == diff_file.size:
+                    return output
+            except Exception as e:
+                Log.warning("Can not read {{filename}}, rebuilding it", filename=index_file.abs_path, cause=e)
+        output = DiffIndex.scan(diff_file.read_bytes())
+        index_file.write(value2json(output.to_value()))
+        return output
+
+    @classmethod
+    def from_value(cls, value):
+        return DiffIndex([
+            {
+                "old": f["old"],
+                "new": f["new"],
+                "start": f["start"],
+                "end": f["end"]
+            }
+            for f in value["files"]
+        ], value["size"])
+
+    def to_value(self):
+        return {"files": self.files, "size": self.size}
+
+    @property
+    def paths(self):
+        """
+        :return: NAME OF EVERY FILE IN THE DIFF (THE old NAME FOR DELETED FILES)
+        """
+        return [f["old"] if f["new"].endswith(DEV_NULL) else f["new"] for f in self.files]
+
+    def file_bytes(self, diff, path):
+        """
+        :param diff: BYTES OF THE UNIFIED DIFF
+        :param path: old OR new NAME OF FILE, WITH LEADING SLASH
+        :return: THE PART OF THE diff FOR path, STARTING WITH THE "--- " LINE; None IF NOT IN DIFF
+        """
+        f = self.lookup.get(path)
+        if f is None:
+            return None
+        return diff[f["start"]:f["end"]]
+
+    def diff_to_json(self, diff, paths):
+        """
+        LIKE mo_hg.parse.diff_to_json(), BUT ONLY FOR THE GIVEN paths
+        """
+        output = []
+        for path in paths:
+            content = self.file_bytes(diff, path)
+            if content is None:
+                continue
+            output.extend(diff_to_json_stream(content.decode("utf8", "replace").split("\n")))
+        return wrap(output)
+
+
+def _line_end(diff, start, end):
+    i = diff.find(b"\n", start, end)
+    return end if i == -1 else i
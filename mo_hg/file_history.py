@@ -0,0 +1,178 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+
+from __future__ import division
+from __future__ import unicode_literals
+
+import os
+from bisect import bisect_left, bisect_right
+
+from mo_dots import listwrap
+from mo_files import File
+from mo_json import value2json, json2value
+from mo_logs import Log
+from mo_threads import Lock
+
+DEV_NULL = "dev/null"
+
+
+class FileHistory(object):
+    """
+    FOR EACH BRANCH, MAP FILE PATH TO THE ORDERED LIST OF CHANGESETS THAT TOUCH IT
+    CHANGESETS ARE ORDERED BY THEIR (BRANCH-LOCAL) REVISION index
+
+    WE ALSO KEEP WHICH REVISION INDEXES HAVE BEEN RECORDED, SO A CALLER CAN TELL
+    A FILE THAT WAS NOT TOUCHED FROM A REVISION WE NEVER SAW
+
+    directory/
+        <branch>.json   - ONE {"index", "changeset", "paths"} PER LINE, FOR EVERY REVISION RECORDED
+    """
+
+    def __init__(self, directory=None):
+        """
+        :param directory: WHERE TO PERSIST THE HISTORY (None FOR MEMORY ONLY)
+        """
+        self.locker = Lock()
+        self.directory = None if directory == None else File(directory)
+        self.branches = {}  # MAP FROM BRANCH NAME TO {path: ([index, ...], [changeset_id, ...])}
+        self.indexed = {}  # MAP FROM BRANCH NAME TO IndexRanges OF THE REVISIONS RECORDED
+
+        if self.directory and self.directory.exists:
+            for filename in sorted(os.listdir(self.directory.os_path)):
+                if not filename.endswith(".json"):
+                    continue
+                branch = filename[:-5]
+                for line in File.new_instance(self.directory, filename).read().split("\n"):
+                    if line.strip():
+                        record = json2value(line, leaves=False)
+                        self._add(branch, record["index"], record["changeset"], list(record["paths"]))
+
+    def add(self, revision):
+        """
+        RECORD THE FILES TOUCHED BY revision
+        :param revision: Revision WITH branch.name, index, changeset.id, AND changeset.files AND/OR changeset.diff
+        """
+        index = revision.index
+        if index == None or not revision.changeset.id:
+            return
+        if revision.changeset.files == None and revision.changeset.diff == None:
+            return  # WE DO NOT KNOW WHAT IT TOUCHED
+        branch = revision.branch.name
+        paths = sorted(files_touched(revision))
+
+        with self.locker:
+            if self.indexed.get(branch, IndexRanges()).contains(index):
+                return
+            self._add(branch, index, revision.changeset.id, paths)
+            if self.directory:
+                File.new_instance(self.directory, branch + ".json").append(value2json({
+                    "index": index,
+                    "changeset": revision.changeset.id,
+                    "paths": paths
+                }))
+
+    def _add(self, branch_name, index, changeset_id, paths):
+        self.indexed.setdefault(branch_name, IndexRanges()).add(index)
+        branch = self.branches.setdefault(branch_name, {})
+        for path in paths:
+            indexes, changesets = branch.setdefault(path, ([], []))
+            i = bisect_left(indexes, index)
+            if i < len(indexes) and indexes[i] == index:
+                continue
+            indexes.insert(i, index)
+            changesets.insert(i, changeset_id)
+
+    def missing(self, branch, from_index, to_index):
+        """
+        :return: NUMBER OF REVISIONS IN (from_index, to_index] NOT RECORDED
+        """
+        with self.locker:
+            return self.indexed.get(branch, IndexRanges()).missing(from_index + 1, to_index + 1)
+
+    def changesets(self, branch, path, from_index, to_index):
+        """
+        :param branch: BRANCH NAME
+        :param path: FULL PATH, WITH LEADING SLASH
+        :param from_index: REVISION index WE START FROM (NOT INCLUDED)
+        :param to_index: REVISION index WE END AT (INCLUDED)
+        :return: LIST OF CHANGESET IDS, IN BRANCH ORDER, THAT TOUCH path
+        """
+        missing = self.missing(branch, from_index, to_index)
+        if missing:
+            Log.error(
+                "{{num}} revisions between {{from_index}} and {{to_index}} of {{branch}} are not in the file history",
+                num=missing,
+                from_index=from_index,
+                to_index=to_index,
+                branch=branch
+            )
+        with self.locker:
+            indexes, changesets = self.branches.get(branch, {}).get(path, ([], []))
+            start = bisect_right(indexes, from_index)
+            end = bisect_right(indexes, to_index)
+            return changesets[start:end]
+
+
+class IndexRanges(object):
+    """
+    A SET OF INTEGERS, KEPT AS SORTED, DISJOINT, NON-ADJACENT [start, end) RANGES
+    """
+
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+
+    def add(self, index):
+        i = bisect_right(self.starts, index) - 1
+        if i >= 0 and index < self.ends[i]:
+            return  # ALREADY HAVE IT
+        joins_left = i >= 0 and self.ends[i] == index
+        joins_right = i + 1 < len(self.starts) and self.starts[i + 1] == index + 1
+        if joins_left and joins_right:
+            self.ends[i] = self.ends[i + 1]
+            del self.starts[i + 1]
+            del self.ends[i + 1]
+        elif joins_left:
+            self.ends[i] = index + 1
+        elif joins_right:
+            self.starts[i + 1] = index
+        else:
+            self.starts.insert(i + 1, index)
+            self.ends.insert(i + 1, index + 1)
+
+    def contains(self, index):
+        i = bisect_right(self.starts, index) - 1
+        return i >= 0 and index < self.ends[i]
+
+    def missing(self, start, end):
+        """
+        :return: NUMBER OF INTEGERS IN [start, end) NOT IN THIS SET
+        """
+        if end <= start:
+            return 0
+        have = 0
+        for i in range(max(bisect_right(self.starts, start) - 1, 0), len(self.starts)):
+            if self.starts[i] >= end:
+                break
+            have += max(0, min(end, self.ends[i]) - max(start, self.starts[i]))
+        return (end - start) - have
+
+
+def files_touched(revision):
+    """
+    :return: SET OF FULL PATHS (WITH LEADING SLASH) THE revision CHANGES
+    """
+    output = set()
+    for f in listwrap(revision.changeset.files):
+        output.add("/" + f.lstrip("/"))
+    for f in listwrap(revision.changeset.diff):
+        for name in (f.new.name, f.old.name):
+            if name and not name.endswith(DEV_NULL):
+                output.add("/" + name.lstrip("/"))
+    return output
@@ -0,0 +1,102 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+
+from __future__ import division
+from __future__ import unicode_literals
+
+import threading
+from contextlib import contextmanager
+
+import requests
+from mo_threads import Lock, Thread
+from requests.adapters import HTTPAdapter
+
+from pyLibrary.env import http
+
+REQUESTS_PER_HOST = 4  # MOST REQUESTS IN FLIGHT TO ONE HOST, OVER ALL THREADS
+
+
+class HgFetcher(object):
+    """
+    ONE KEEP-ALIVE CONNECTION POOL FOR ALL hg REQUESTS, WITH NO MORE THAN
+    per_host REQUESTS IN FLIGHT TO ANY ONE HOST
+
+    start() RUNS A CALL ON ITS OWN THREAD, SO THE INDEPENDENT REQUESTS FOR A
+    REVISION CAN BE ISSUED AT THE SAME TIME; join() THE THREAD FOR THE RESULT
+    """
+
+    def __init__(self, per_host=REQUESTS_PER_HOST):
+        self.per_host = per_host
+        self.session = requests.Session()
+        self.session.headers.update(http.default_headers)
+        adapter = HTTPAdapter(pool_maxsize=per_host)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.locker = Lock()
+        self.hosts = {}  # MAP FROM HOST TO SEMAPHORE
+
+    def get(self, url, **kwargs):
+        """
+        SAME AS http.get(), OVER THE SHARED POOL
+        """
+        with self.slot(url):
+            return http.get(url, session=self.session, **kwargs)
+
+    @contextmanager
+    def stream(self, url, **kwargs):
+        """
+        STREAMED http.get(); THE SLOT IS HELD UNTIL THE RESPONSE IS CONSUMED,
+        SO DO NOT join() OTHER REQUESTS WHILE STREAMING: THEY MAY BE WAITING
+        FOR THE SAME SLOTS
+        """
+        with self.slot(url):
+            response = http.get(url, session=self.session, stream=True, **kwargs)
+            try:
+                yield response
+            finally:
+                response.close()
+
+    @contextmanager
+    def slot(self, url):
+        """
+        WAIT FOR ONE OF THE per_host SLOTS OF THE url's HOST
+        """
+        host = url.split("/")[2]
+        with self.locker:
+            semaphore = self.hosts.get(host)
+            if semaphore is None:
+                semaphore = self.hosts[host] = threading.BoundedSemaphore(self.per_host)
+        with semaphore:
+            yield
+
+    def start(self, name, function, *args):
+        """
+        :return: Thread RUNNING function(*args); join() IT FOR THE RESULT (OR THE EXCEPTION)
+        """
+        return Thread.run(name, lambda please_stop: function(*args))
+
+    def join_all(self, threads):
+        """
+        JOIN EVERY THREAD (None IS IGNORED), EVEN IF AN EARLIER ONE FAILED
+        :return: LIST OF RESULTS; RAISE THE FIRST FAILURE
+        """
+        results = []
+        failure = None
+        for t in threads:
+            if t is None:
+                results.append(None)
+                continue
+            try:
+                results.append(t.join())
+            except Exception as e:
+                results.append(None)
+                failure = failure or e
+        if failure:
+            raise failure
+        return results
@@ -17,8 +17,13 @@ from copy import copy
 from mo_future import text_type, binary_type
 
 import mo_threads
-from mo_dots import set_default, Null, coalesce, unwraplist, listwrap, wrap, Data
-from mo_hg.parse import diff_to_json
+from mo_dots import set_default, Null, coalesce, unwraplist, listwrap, wrap, Data, FlatList
+from mo_hg.bulk_indexer import BulkIndexer
+from mo_hg.cache import LruCache, cached
+from mo_hg.client_pool import ClientPool
+from mo_hg.file_history import FileHistory
+from mo_hg.hg_fetch import HgFetcher
+from mo_hg.parse import diff_to_json_stream, bytes_to_lines
 from mo_hg.repos.changesets import Changeset
 from mo_hg.repos.pushs import Push
 from mo_hg.repos.revisions import Revision, revision_schema
@@ -39,10 +44,6 @@ _hg_branches = None
 _OLD_BRANCH = None
 
 
-def _count(values):
-    return len(list(values))
-
-
 def _late_imports():
     global _hg_branches
     global _OLD_BRANCH
@@ -68,13 +69,23 @@ MIN_ETL_AGE = Date("22sep2017").unix  # sept 22nd 2017  ARTIFACTS OLDER THAN THI
 
 GET_DIFF = True
 MAX_DIFF_SIZE = 1000
+DIFF_CHUNK_SIZE = 2 ** 16  # BYTES READ FROM THE DIFF RESPONSE AT A TIME
 DIFF_URL = "{{location}}/raw-rev/{{rev}}"
 FILE_URL = "{{location}}/raw-file/{{rev}}{{path}}"
+FILE_LENGTH_THREADS = 4  # NUMBER OF FILES TO PULL FROM hg AT ONCE
+METADATA_CACHE_BYTES = 100 * 1000 * 1000  # REVISIONS WITHOUT DIFFS, PUSHES, RAW hg RESPONSES
+DIFF_CACHE_BYTES = 500 * 1000 * 1000  # REVISIONS WITH DIFFS
+MAX_IDS_PER_QUERY = 1000  # changeset.id12 IN ONE terms QUERY
+ES_CLIENTS = 8  # MOST ES SEARCHES AT ONCE
 
 
 last_called_url = {}
 
 
+def _revision_cache(revision, locale=None, get_diff=False):
+    return "diff" if get_diff else "metadata"
+
+
 class HgMozillaOrg(object):
     """
     USE hg.mozilla.org FOR REPO INFORMATION
@@ -89,13 +100,21 @@ class HgMozillaOrg(object):
         branches=None,  # CONNECTION INFO FOR ES CACHE
         use_cache=False,   # True IF WE WILL USE THE ES FOR DOWNLOADING BRANCHES
         timeout=30 * SECOND,
+        file_history=None,  # DIRECTORY TO PERSIST WHICH FILES EACH REVISION TOUCHES
+        metadata_cache=METADATA_CACHE_BYTES,  # MOST BYTES OF hg METADATA TO KEEP IN MEMORY
+        diff_cache=DIFF_CACHE_BYTES,  # MOST BYTES OF REVISIONS WITH DIFFS TO KEEP IN MEMORY
         kwargs=None
     ):
         if not _hg_branches:
             _late_imports()
 
-        self.es_locker = Lock()
+        self.fetcher = HgFetcher()  # ALL hg REQUESTS SHARE ONE CONNECTION POOL
+        self.caches = {
+            "metadata": LruCache("hg metadata", metadata_cache),
+            "diff": LruCache("hg diffs", diff_cache)
+        }
         self.todo = mo_threads.Queue("todo for hg daemon", max=DAEMON_QUEUE_SIZE)
+        self.file_history = FileHistory(file_history)  # EVERY REVISION WE SEE IS RECORDED
 
         self.settings = kwargs
         self.timeout = Duration(timeout)
@@ -107,10 +126,20 @@ class HgMozillaOrg(object):
         if branches == None:
             self.branches = _hg_branches.get_branches(kwargs=kwargs)
             self.es = None
+            self.es_clients = None
+            self.indexer = None
+            self.daemon = None
             return
 
         set_default(repo, {"schema": revision_schema})
-        self.es = elasticsearch.Cluster(kwargs=repo).get_or_create_index(kwargs=repo)
+        def new_index():
+            return elasticsearch.Cluster(kwargs=repo).get_or_create_index(kwargs=repo)
+
+        # THE ES CLIENT IS NOT KNOWN TO BE THREAD-SAFE: EVERY SEARCH BORROWS ONE
+        # FROM A POOL, AND THE BulkIndexer WRITES WITH ITS OWN
+        self.es = new_index()
+        self.es_clients = ClientPool(new_index, ES_CLIENTS)
+        self.indexer = BulkIndexer(new_index())  # SO get_revision() DOES NOT WAIT ON ES
 
         def setup_es(please_stop):
             with suppress_exception:
@@ -122,9 +151,24 @@ class HgMozillaOrg(object):
         Thread.run("setup_es", setup_es)
         self.branches = _hg_branches.get_branches(kwargs=kwargs)
 
-        Thread.run("hg daemon", self._daemon)
+        self.daemon = Thread.run("hg daemon", self._daemon)
+
+    def stop(self):
+        """
+        STOP THE DAEMON, AND SEND THE REVISIONS STILL WAITING FOR ES
+        """
+        if self.daemon is not None:
+            self.daemon.stop()
+            self.daemon.join()
 
     def _daemon(self, please_stop):
+        try:
+            self._scan(please_stop)
+        finally:
+            if please_stop:
+                self.indexer.stop()  # SHUTTING DOWN: SEND WHAT IS WAITING
+
+    def _scan(self, please_stop):
         while not please_stop:
             with Explanation("looking for work"):
                 try:
@@ -136,64 +180,134 @@ class HgMozillaOrg(object):
                         raise e
                 if branch.name in DAEMON_DO_NO_SCAN:
                     continue
-                revisions = set(revisions)
+                revisions = list(set(revisions))
 
                 # FIND THE REVSIONS ON THIS BRANCH
-                for r in list(revisions):
-                    try:
-                        rev = self.get_revision(Revision(branch=branch, changeset={"id": r}))
-                        if DAEMON_DEBUG:
+                problems = []
+                found = self.get_revisions([Revision(branch=branch, changeset={"id": r}) for r in revisions], problems=problems)
+                if DAEMON_DEBUG:
+                    for rev in found:
+                        if rev:
                             Log.note("found revision with push date {{date|datetime}}", date=rev.push.date)
-                        revisions.discard(r)
-
-                        if rev.etl.timestamp > Date.now()-DAEMON_RECENT_HG_PULL:
-                            # SOME PUSHES ARE BIG, RUNNING THE RISK OTHER MACHINES ARE
-                            # ALSO INTERESTED AND PERFORMING THE SAME SCAN. THIS DELAY
-                            # WILL HAVE SMALL EFFECT ON THE MAJORITY OF SMALL PUSHES
-                            # https://bugzilla.mozilla.org/show_bug.cgi?id=1417720
-                            Till(seconds=Random.float(DAEMON_HG_INTERVAL).seconds).wait()
-
-                    except Exception as e:
-                        Log.warning(
-                            "Scanning {{branch}} {{revision|left(12)}}",
-                            branch=branch.name,
-                            revision=r,
-                            cause=e
-                        )
-                        if "Read timed out" in e:
-                            Till(seconds=DAEMON_WAIT_AFTER_TIMEOUT.seconds).wait()
+                if any(rev.etl.timestamp > Date.now()-DAEMON_RECENT_HG_PULL for rev in found if rev):
+                    # SOME PUSHES ARE BIG, RUNNING THE RISK OTHER MACHINES ARE
+                    # ALSO INTERESTED AND PERFORMING THE SAME SCAN. THIS DELAY
+                    # WILL HAVE SMALL EFFECT ON THE MAJORITY OF SMALL PUSHES
+                    # https://bugzilla.mozilla.org/show_bug.cgi?id=1417720
+                    Till(seconds=Random.float(DAEMON_HG_INTERVAL).seconds).wait()
 
+                for e in problems:
+                    Log.warning("Scanning {{branch}}", branch=branch.name, cause=e)
+                if any("Read timed out" in e for e in problems):
+                    Till(seconds=DAEMON_WAIT_AFTER_TIMEOUT.seconds).wait()
+
+                revisions = [r for r, rev in zip(revisions, found) if not rev]
 
                 # FIND ANY BRANCH THAT MAY HAVE THIS REVISION
                 for r in list(revisions):
                     self._find_revision(r)
 
-    @cache(duration=HOUR, lock=True)
+    @cached(_revision_cache, duration=HOUR, lock=True)
     def get_revision(self, revision, locale=None, get_diff=False):
         """
         EXPECTING INCOMPLETE revision OBJECT
         RETURNS revision
         """
-        rev = revision.changeset.id
-        if not rev:
-            return Null
-        elif rev == "None":
-            return Null
-        elif revision.branch.name == None:
+        if _no_revision(revision):
             return Null
         locale = coalesce(locale, revision.branch.locale, DEFAULT_LOCALE)
         output = self._get_from_elasticsearch(revision, locale=locale, get_diff=get_diff)
         if output:
-            if not get_diff:  # DIFF IS BIG, DO NOT KEEP IT IF NOT NEEDED
-                output.changeset.diff = None
-            if DEBUG:
-                Log.note("Got hg ({{branch}}, {{locale}}, {{revision}}) from ES", branch=output.branch.name, locale=locale, revision=output.changeset.id)
-            if output.push.date >= Date.now()-MAX_TODO_AGE:
-                self.todo.add((output.branch, listwrap(output.parents)))
-                self.todo.add((output.branch, listwrap(output.children)))
+            output = self._use_es_revision(output, locale, get_diff)
             if output.push.date:
                 return output
+        return self._get_from_hg(revision, locale, get_diff)
+
+    def get_revisions(self, revisions, locale=None, get_diff=False, problems=None):
+        """
+        SAME AS get_revision(), FOR MANY REVISIONS, SHARING ITS CACHE: ONE ES QUERY
+        FOR EACH (branch, locale), THEN THE MISSES ARE PULLED FROM hg IN PARALLEL
+        :param revisions: LIST OF INCOMPLETE revision OBJECTS
+        :param problems: OPTIONAL LIST; THE FAILURES ARE ADDED, INSTEAD OF LOGGED
+        :return: LIST OF revision, IN THE SAME ORDER (Null FOR ANY NOT FOUND)
+        """
+        output = [Null] * len(revisions)
+        entries = [None] * len(revisions)  # THE (cache, key) get_revision() USES FOR EACH
+        groups = {}  # MAP FROM (branch, locale) TO LIST OF INDEXES INTO revisions
+        for i, revision in enumerate(revisions):
+            if _no_revision(revision):
+                continue
+            cache, key = entries[i] = HgMozillaOrg.get_revision.locate(self, revision, locale, get_diff)
+            found, value = cache.get(key)
+            if found:
+                output[i] = value
+                continue
+            revision_locale = coalesce(locale, revision.branch.locale, DEFAULT_LOCALE)
+            groups.setdefault((revision.branch.name, revision_locale), []).append(i)
+
+        misses = []
+        for (branch_name, revision_locale), indexes in groups.items():
+            docs = self._get_many_from_elasticsearch(branch_name, revision_locale, [revisions[i].changeset.id for i in indexes], get_diff)
+            for i in indexes:
+                found = docs.get(revisions[i].changeset.id[0:12])
+                if found:
+                    found = self._use_es_revision(found, revision_locale, get_diff)
+                    if found.push.date:
+                        output[i] = found
+                        cache, key = entries[i]
+                        cache.set(key, found, HOUR)
+                        continue
+                misses.append((i, revision_locale))
+
+        if not misses:
+            return output
+
+        locker = Lock()
+        queue = Queue("revisions from hg", max=len(misses) + 1)
+        queue.extend(misses)
+        queue.add(THREAD_STOP)
+
+        def _get(please_stop):
+            for i, revision_locale in queue:
+                if please_stop:
+                    return
+                try:
+                    found = self._get_from_hg(revisions[i], revision_locale, get_diff)
+                    cache, key = entries[i]
+                    cache.set(key, found, HOUR)
+                    with locker:
+                        output[i] = found
+                except Exception as e:
+                    if problems is None:
+                        Log.warning("could not get revision {{revision|left(12)}}", revision=revisions[i].changeset.id, cause=e)
+                    else:
+                        with locker:
+                            problems.append(Except.wrap(e))
+
+        # ONE REVISION PER hg SLOT; EACH REVISION'S OWN REQUESTS WAIT FOR SLOTS TOO
+        threads = [
+            Thread.run("get revision " + text_type(i), _get)
+            for i in range(min(self.fetcher.per_host, len(misses)))
+        ]
+        for t in threads:
+            t.join()
+        return output
 
+    def _use_es_revision(self, output, locale, get_diff):
+        """
+        BOOKKEEPING FOR A REVISION FOUND IN ES
+        """
+        self.file_history.add(output)
+        if not get_diff:  # DIFF IS BIG, DO NOT KEEP IT IF NOT NEEDED
+            output.changeset.diff = None
+        if DEBUG:
+            Log.note("Got hg ({{branch}}, {{locale}}, {{revision}}) from ES", branch=output.branch.name, locale=locale, revision=output.changeset.id)
+        if output.push.date >= Date.now()-MAX_TODO_AGE:
+            self.todo.add((output.branch, listwrap(output.parents)))
+            self.todo.add((output.branch, listwrap(output.children)))
+        return output
+
+    def _get_from_hg(self, revision, locale, get_diff):
         found_revision = copy(revision)
         if isinstance(found_revision.branch, (text_type, binary_type)):
             lower_name = found_revision.branch.lower()
@@ -212,21 +326,27 @@ class HgMozillaOrg(object):
         if Date.now() - Date(b.etl.timestamp) > _OLD_BRANCH:
             self.branches = _hg_branches.get_branches(kwargs=self.settings)
 
-        push = self._get_push(found_revision.branch, found_revision.changeset.id)
-
+        # THE hg REQUESTS ARE INDEPENDENT; ISSUE THEM ALL AT ONCE
         url1 = found_revision.branch.url.rstrip("/") + "/json-info?node=" + found_revision.changeset.id[0:12]
         url2 = found_revision.branch.url.rstrip("/") + "/json-rev/" + found_revision.changeset.id[0:12]
+        push = self.fetcher.start("get push", self._get_push, found_revision.branch, found_revision.changeset.id)
+        info = self.fetcher.start("get json-info", self._get_raw_json_info, url1, found_revision.branch)
+        raw = self.fetcher.start("get json-rev", self._get_raw_json_rev, url2, found_revision.branch)
+        diff = None
+        if get_diff or GET_DIFF:
+            diff = self.fetcher.start("get diff", self._get_diff_after_info, found_revision, info)
+
         with Explanation("get revision from {{url}}", url=url1, debug=DEBUG):
-            raw_rev2 = Null
             try:
-                raw_rev1 = self._get_raw_json_info(url1, found_revision.branch)
-                raw_rev2 = self._get_raw_json_rev(url2, found_revision.branch)
+                raw_rev1, raw_rev2 = self.fetcher.join_all([info, raw])
             except Exception as e:
                 if "Hg denies it exists" in e:
-                    raw_rev1 = Data(node=revision.changeset.id)
+                    raw_rev1, raw_rev2 = Data(node=revision.changeset.id), Null
                 else:
+                    with suppress_exception:
+                        self.fetcher.join_all([push, diff])
                     raise e
-            output = self._normalize_revision(set_default(raw_rev1, raw_rev2), found_revision, push, get_diff)
+            output = self._normalize_revision(set_default(raw_rev1, raw_rev2), found_revision, push.join(), get_diff, diff)
             if output.push.date >= Date.now()-MAX_TODO_AGE:
                 self.todo.add((output.branch, listwrap(output.parents)))
                 self.todo.add((output.branch, listwrap(output.children)))
@@ -235,6 +355,10 @@ class HgMozillaOrg(object):
                 output.changeset.diff = None
             return output
 
+    def _search(self, query):
+        with self.es_clients.client() as es:
+            return es.search(query)
+
     def _get_from_elasticsearch(self, revision, locale=None, get_diff=False):
         rev = revision.changeset.id
         if self.es.cluster.version.startswith("1.7."):
@@ -263,8 +387,7 @@ class HgMozillaOrg(object):
 
         for attempt in range(3):
             try:
-                with self.es_locker:
-                    docs = self.es.search(query).hits.hits
+                docs = self._search(query).hits.hits
                 break
             except Exception as e:
                 e = Except.wrap(e)
@@ -279,23 +402,44 @@ class HgMozillaOrg(object):
                     Log.warning("Bad ES call, fall back to TH", cause=e)
                     return None
 
-        best = docs[0]._source
-        if len(docs) > 1:
+        return _best_doc(docs, get_diff)
+
+    def _get_many_from_elasticsearch(self, branch_name, locale, changeset_ids, get_diff):
+        """
+        :return: MAP FROM id12 TO REVISION, FOR THOSE FOUND IN ES
+        """
+        ids = sorted(set(c[0:12] for c in changeset_ids))
+        output = {}
+        for start in range(0, len(ids), MAX_IDS_PER_QUERY):
+            batch = ids[start:start + MAX_IDS_PER_QUERY]
+            must = [
+                {"terms": {"changeset.id12": batch}},
+                {"term": {"branch.name": branch_name}},
+                {"term": {"branch.locale": locale}},
+                {"range": {"etl.timestamp": {"gt": MIN_ETL_AGE}}}
+            ]
+            if self.es.cluster.version.startswith("1.7."):
+                query = {"query": {"filtered": {"query": {"match_all": {}}, "filter": {"and": must}}}}
+            else:
+                query = {"query": {"bool": {"must": must}}}
+            query["size"] = 10 * len(batch)  # ROOM FOR DUPLICATES
+
+            try:
+                docs = self._search(query).hits.hits
+            except Exception as e:
+                Log.warning("Bad ES call, fall back to hg", cause=e)
+                continue
+
+            by_id = {}
             for d in docs:
-                if d._id.endswith(d._source.branch.locale):
-                    best = d._source
-            Log.warning("expecting no more than one document")
-
-        if not GET_DIFF and not get_diff:
-            return best
-        elif best.changeset.diff:
-            return best
-        elif not best.changeset.files:
-            return best  # NOT EXPECTING A DIFF, RETURN IT ANYWAY
-        else:
-            return None
+                by_id.setdefault(d._source.changeset.id12, []).append(d)
+            for id12, same in by_id.items():
+                best = _best_doc(same, get_diff)
+                if best:
+                    output[id12] = best
+        return output
 
-    @cache(duration=HOUR, lock=True)
+    @cached("metadata", duration=HOUR, lock=True)
     def _get_raw_json_info(self, url, branch):
         raw_revs = self._get_and_retry(url, branch)
         if "(not in 'served' subset)" in raw_revs:
@@ -306,12 +450,12 @@ class HgMozillaOrg(object):
             Log.error("do not know what to do")
         return raw_revs.values()[0]
 
-    @cache(duration=HOUR, lock=True)
+    @cached("metadata", duration=HOUR, lock=True)
     def _get_raw_json_rev(self, url, branch):
         raw_rev = self._get_and_retry(url, branch)
         return raw_rev
 
-    @cache(duration=HOUR, lock=True)
+    @cached("metadata", duration=HOUR, lock=True)
     def _get_push(self, branch, changeset_id):
         if self.es.cluster.version.startswith("1.7."):
             query = {
@@ -335,9 +479,8 @@ class HgMozillaOrg(object):
 
         try:
             # ALWAYS TRY ES FIRST
-            with self.es_locker:
-                response = self.es.search(query)
-                json_push = response.hits.hits[0]._source.push
+            response = self._search(query)
+            json_push = response.hits.hits[0]._source.push
             if json_push:
                 return json_push
         except Exception:
@@ -365,7 +508,10 @@ class HgMozillaOrg(object):
         else:
             Log.error("do not know what to do")
 
-    def _normalize_revision(self, r, found_revision, push, get_diff):
+    def _normalize_revision(self, r, found_revision, push, get_diff, diff=None):
+        """
+        :param diff: OPTIONAL Thread ALREADY FETCHING THE DIFF
+        """
         new_names = set(r.keys()) - {"rev", "node", "user", "description", "desc", "date", "files", "backedoutby", "parents", "children", "branch", "tags", "pushuser", "pushdate", "pushid", "phase", "bookmarks"}
         if new_names and not r.tags:
             Log.warning("hg is returning new property names ({{names}})", names=new_names)
@@ -409,13 +555,15 @@ class HgMozillaOrg(object):
         set_default(rev, r)
 
         # ADD THE DIFF
-        if get_diff or GET_DIFF:
+        if diff is not None:
+            rev.changeset.diff = diff.join()
+        elif get_diff or GET_DIFF:
             rev.changeset.diff = self._get_json_diff_from_hg(rev)
+        self.file_history.add(rev)
 
         try:
             _id = coalesce(rev.changeset.id12, "") + "-" + rev.branch.name + "-" + coalesce(rev.branch.locale, DEFAULT_LOCALE)
-            with self.es_locker:
-                self.es.add({"id": _id, "value": rev})
+            self.indexer.add({"id": _id, "value": rev})
         except Exception as e:
             Log.warning("did not save to ES", cause=e)
 
@@ -427,14 +575,14 @@ class HgMozillaOrg(object):
         """
         kwargs = set_default(kwargs, {"timeout": self.timeout.seconds})
         try:
-            output = _get_url(url, branch, **kwargs)
+            output = _get_url(self.fetcher, url, branch, **kwargs)
             return output
         except Exception as e:
             output = Null
 
         try:
             (Till(seconds=5)).wait()
-            return _get_url(url.replace("https://", "http://"), branch, **kwargs)
+            return _get_url(self.fetcher, url.replace("https://", "http://"), branch, **kwargs)
         except Exception as f:
             pass
 
@@ -467,7 +615,7 @@ class HgMozillaOrg(object):
 
         Log.error("Tried {{url}} twice.  Both failed.", {"url": url}, cause=[e, f])
 
-    @cache(duration=HOUR, lock=True)
+    @cached("metadata", duration=HOUR, lock=True)
     def _find_revision(self, revision):
         please_stop = False
         locker = Lock()
@@ -511,6 +659,20 @@ class HgMozillaOrg(object):
             return int(match[0])
         return None
 
+    def _get_diff_after_info(self, revision, info):
+        """
+        WAIT FOR THE DESCRIPTION (AND FILES) BEFORE STREAMING THE DIFF: A STREAM HOLDS AN hg
+        SLOT, SO IT MUST NOT WAIT ON ANOTHER REQUEST THAT MAY NEED THAT SLOT
+        :param revision: INCOMPLETE REVISION OBJECT
+        :param info: Thread FETCHING THE json-info
+        """
+        try:
+            r = info.join()
+        except Exception:
+            r = Null  # NOT A MERGE, AS FAR AS WE KNOW
+        revision = set_default({"changeset": {"description": coalesce(r.description, r.desc), "files": r.files}}, revision)
+        return self._get_json_diff_from_hg(revision)
+
     def _get_json_diff_from_hg(self, revision):
         """
         :param revision: INCOMPLETE REVISION OBJECT
@@ -540,9 +702,8 @@ class HgMozillaOrg(object):
 
             try:
                 # ALWAYS TRY ES FIRST
-                with self.es_locker:
-                    response = self.es.search(query)
-                    json_diff = response.hits.hits[0]._source.changeset.diff
+                response = self._search(query)
+                json_diff = response.hits.hits[0]._source.changeset.diff
                 if json_diff:
                     return json_diff
             except Exception as e:
@@ -552,27 +713,77 @@ class HgMozillaOrg(object):
             if DEBUG:
                 Log.note("get unified diff from {{url}}", url=url)
             try:
-                response = http.get(url)
-                diff = response.content.decode("utf8", "replace")
-                json_diff = diff_to_json(diff)
-                num_changes = _count(c for f in json_diff for c in f.changes)
-                if json_diff:
-                    if num_changes < MAX_DIFF_SIZE:
-                        return json_diff
-                    elif revision.changeset.description.startswith("merge "):
-                        return None  # IGNORE THE MERGE CHANGESETS
+                with self.fetcher.stream(url) as response:
+                    json_diff = FlatList()
+                    num_changes = 0
+                    for file in diff_to_json_stream(bytes_to_lines(response.iter_content(DIFF_CHUNK_SIZE))):
+                        file = wrap(file)
+                        json_diff.append(file)
+                        num_changes += len(file.changes)
+                        if num_changes >= MAX_DIFF_SIZE:
+                            break  # STOP READING; CLOSING THE RESPONSE DROPS THE REST
                     else:
-                        Log.warning("Revision at {{url}} has a diff with {{num}} changes, ignored", url=url, num=num_changes)
-                        for file in json_diff:
-                            file.changes = None
-                        return json_diff
+                        return json_diff if json_diff else None
+
+                if coalesce(revision.changeset.description, "").startswith("merge "):
+                    return None  # IGNORE THE MERGE CHANGESETS
+                Log.warning("Revision at {{url}} has a diff with at least {{num}} changes, ignored", url=url, num=num_changes)
+
+                # KEEP THE FILE NAMES ONLY; THE ONES NOT READ YET COME FROM THE CHANGESET
+                seen = set()
+                for f in json_diff:
+                    f.changes = None
+                    seen.add(f.old.name)
+                    seen.add(f.new.name)
+                for path in listwrap(revision.changeset.files):
+                    name = "/" + path
+                    if name not in seen:
+                        json_diff.append({"new": {"name": name}, "old": {"name": name}, "changes": None})
+                return json_diff
             except Exception as e:
                 Log.warning("could not get unified diff", cause=e)
 
         return inner(revision.changeset.id)
 
+    def get_file_lengths(self, revision, paths):
+        """
+        THE CHANGESET OPERATORS DO NOT NEED FILE LENGTHS; THIS IS FOR THE FEW
+        CALLERS THAT DO (eg DENSE MATRICES)
+        :param revision: Revision WITH branch.url AND changeset.id
+        :param paths: FULL PATHS, WITH LEADING SLASH
+        :return: MAP FROM PATH TO len(source.split("\n"))
+        """
+        output = {}
+        locker = Lock()
+        queue = Queue("file lengths", max=len(paths) + 1)
+        queue.extend(paths)
+        queue.add(THREAD_STOP)
+
+        def _get(please_stop):
+            for path in queue:
+                if please_stop:
+                    return
+                length = self._get_file_length(revision, path)
+                with locker:
+                    output[path] = length
+
+        threads = [
+            Thread.run("get file length " + text_type(i), _get)
+            for i in range(min(FILE_LENGTH_THREADS, len(paths)))
+        ]
+        for t in threads:
+            t.join()
+        return output
+
+    @cached("metadata", duration=HOUR, lock=True)
+    def _get_file_length(self, revision, file_path):
+        return len(self._get_source_code_from_hg(revision, file_path).split("\n"))
+
     def _get_source_code_from_hg(self, revision, file_path):
-        response = http.get(expand_template(FILE_URL, {"location": revision.branch.url, "rev": revision.changeset.id, "path": file_path}))
+        url = expand_template(FILE_URL, {"location": revision.branch.url, "rev": revision.changeset.id, "path": file_path})
+        response = self.fetcher.get(url)
+        if response.status_code != 200:
+            Log.error("Tried {{url}}. Got status {{status}}", url=url, status=response.status_code)
         return response.content.decode("utf8", "replace")
 
 
@@ -580,9 +791,36 @@ def _trim(url):
     return url.split("/json-pushes?")[0].split("/json-info?")[0].split("/json-rev/")[0]
 
 
-def _get_url(url, branch, **kwargs):
+def _no_revision(revision):
+    rev = revision.changeset.id
+    return not rev or rev == "None" or revision.branch.name == None
+
+
+def _best_doc(docs, get_diff):
+    """
+    :param docs: ES HITS FOR ONE REVISION
+    :return: THE REVISION, OR None IF IT IS MISSING ITS DIFF
+    """
+    best = docs[0]._source
+    if len(docs) > 1:
+        for d in docs:
+            if d._id.endswith(d._source.branch.locale):
+                best = d._source
+        Log.warning("expecting no more than one document")
+
+    if not GET_DIFF and not get_diff:
+        return best
+    elif best.changeset.diff:
+        return best
+    elif not best.changeset.files:
+        return best  # NOT EXPECTING A DIFF, RETURN IT ANYWAY
+    else:
+        return None
+
+
+def _get_url(fetcher, url, branch, **kwargs):
     with Explanation("get push from {{url}}", url=url, debug=DEBUG):
-        response = http.get(url, **kwargs)
+        response = fetcher.get(url, **kwargs)
         data = json2value(response.content.decode("utf8"))
         if isinstance(data, (text_type, str)) and data.startswith("unknown revision"):
             Log.error("Unknown push {{revision}}", revision=strings.between(data, "'", "'"))
@@ -9,7 +9,12 @@
 from __future__ import division
 from __future__ import unicode_literals
 
+import codecs
 import re
+import struct
+import zlib
+
+import numpy as np
 
 from mo_dots import wrap
 from mo_logs import Log, strings
@@ -31,6 +36,9 @@ MOVE = {
 }
 no_change = MOVE[' ']
 
+BINARY_DIFF_MAGIC = b"HGD1"
+NEW, OLD = 0, 1  # KIND OF A RUN OF CHANGES IN THE BINARY DIFF
+
 
 def diff_to_json(unified_diff):
     """
@@ -38,57 +46,234 @@ def diff_to_json(unified_diff):
     :param unified_diff: text
     :return: JSON details
     """
-    output = []
-    files = FILE_SEP.split(unified_diff)[1:]
-    for file_ in files:
-        changes = []
-        old_file_header, new_file_header, file_diff = file_.split("\n", 2)
-        old_file_path = old_file_header[1:]  # eg old_file_header == "a/testing/marionette/harness/marionette_harness/tests/unit/unit-tests.ini"
-        new_file_path = new_file_header[5:]  # eg new_file_header == "+++ b/tests/resources/example_file.py"
-
-        c = 0, 0
-        hunks = HUNK_SEP.split(file_diff)[1:]
-        for hunk in hunks:
-            line_diffs = hunk.split("\n")
-            old_start, old_length, new_start, new_length = HUNK_HEADER.match(line_diffs[0]).groups()
+    return wrap(list(diff_to_json_stream(unified_diff.split("\n"))))
+
+
+def diff_to_json_stream(lines):
+    """
+    SAME AS diff_to_json(), BUT CONSUMES THE DIFF ONE LINE AT A TIME, AND
+    GENERATES ONE FILE RECORD AT A TIME, SO THE WHOLE DIFF IS NEVER IN MEMORY
+    :param lines: ITERATOR OF TEXT LINES (WITHOUT "\n")
+    :return: GENERATOR OF FILE DETAILS
+    """
+    file_ = None
+    expecting_new_header = False
+    in_hunk = False
+    c = 0, 0
+    for line in lines:
+        if line.startswith("--- "):
+            if file_ is not None:
+                yield file_
+            old_file_path = line[5:]  # eg line == "--- a/testing/marionette/harness/marionette_harness/tests/unit/unit-tests.ini"
+            file_ = {"new": {"name": None}, "old": {"name": old_file_path}, "changes": []}
+            expecting_new_header = True
+            in_hunk = False
+            c = 0, 0
+        elif file_ is None:
+            continue
+        elif expecting_new_header:
+            file_["new"]["name"] = line[5:]  # eg line == "+++ b/tests/resources/example_file.py"
+            expecting_new_header = False
+        elif line.startswith("@@ "):
+            old_start, old_length, new_start, new_length = HUNK_HEADER.match(line[3:]).groups()
             next_c = max(0, int(new_start)-1), max(0, int(old_start)-1)
             if next_c[0] - next_c[1] != c[0] - c[1]:
                 Log.error("expecting a skew of {{skew}}", skew=next_c[0] - next_c[1])
             if c[0] > next_c[0]:
                 Log.error("can not handle out-of-order diffs")
-            while c[0] != next_c[0]:
-                c = no_change(c)
-
-            for line in line_diffs[1:]:
-                if not line:
-                    continue
-                if (
-                    line.startswith("new file mode") or
-                    line.startswith("deleted file mode") or
-                    line.startswith("index ") or
-                    line.startswith("diff --git")
-                ):
-                    # HAPPENS AT THE TOP OF NEW FILES
-                    # diff --git a/security/sandbox/linux/SandboxFilter.cpp b/security/sandbox/linux/SandboxFilter.cpp
-                    # u'new file mode 100644'
-                    # u'deleted file mode 100644'
-                    # index a763e390731f5379ddf5fa77090550009a002d13..798826525491b3d762503a422b1481f140238d19
-                    # GIT binary patch
-                    # literal 30804
-                    break
-                d = line[0]
-                if d == '+':
-                    changes.append({"new": {"line": int(c[0]), "content": strings.limit(line[1:], MAX_CONTENT_LENGTH)}})
-                elif d == '-':
-                    changes.append({"old": {"line": int(c[1]), "content": strings.limit(line[1:], MAX_CONTENT_LENGTH)}})
-                try:
-                    c = MOVE[d](c)
-                except Exception as e:
-                    Log.warning("bad line {{line|quote}}", line=line, cause=e)
-
-        output.append({
-            "new": {"name": new_file_path},
-            "old": {"name": old_file_path},
-            "changes": changes
-        })
+            c = next_c
+            in_hunk = True
+        elif not in_hunk or not line:
+            continue
+        elif (
+            line.startswith("new file mode") or
+            line.startswith("deleted file mode") or
+            line.startswith("index ") or
+            line.startswith("diff --git")
+        ):
+            # HAPPENS AT THE TOP OF NEW FILES
+            # diff --git a/security/sandbox/linux/SandboxFilter.cpp b/security/sandbox/linux/SandboxFilter.cpp
+            # u'new file mode 100644'
+            # u'deleted file mode 100644'
+            # index a763e390731f5379ddf5fa77090550009a002d13..798826525491b3d762503a422b1481f140238d19
+            # GIT binary patch
+            # literal 30804
+            in_hunk = False
+        else:
+            d = line[0]
+            if d == '+':
+                file_["changes"].append({"new": {"line": int(c[0]), "content": strings.limit(line[1:], MAX_CONTENT_LENGTH)}})
+            elif d == '-':
+                file_["changes"].append({"old": {"line": int(c[1]), "content": strings.limit(line[1:], MAX_CONTENT_LENGTH)}})
+            try:
+                c = MOVE[d](c)
+            except Exception as e:
+                Log.warning("bad line {{line|quote}}", line=line, cause=e)
+
+    if file_ is not None:
+        yield file_
+
+
+def diff_to_binary(diff):
+    """
+    COMPACT ENCODING OF THE diff_to_json() FORMAT
+
+        MAGIC, THEN zlib OF
+            BYTE LENGTH OF THE NUMBERS (4 BYTES, LITTLE ENDIAN)
+            NUMBERS, EACH A VARINT:
+                STRING TABLE: count, THEN utf8 length OF EACH DISTINCT NAME AND CONTENT
+                FILES: count, THEN FOR EACH FILE
+                    new name, old name (STRING INDEX + 1; 0 FOR None)
+                    runs + 1 (0 WHEN changes IS None)
+                    FOR EACH RUN OF CONSECUTIVE LINES ON ONE SIDE:
+                        (zigzag(start - end of previous run on that side) << 1) | kind
+                        length, THEN THE STRING INDEX + 1 OF EACH LINE'S CONTENT
+            THE utf8 OF THE STRING TABLE, CONCATENATED
+
+    :param diff: FROM diff_to_json()
+    :return: BYTES
+    """
+    table = {}  # MAP FROM STRING TO INDEX + 1
+
+    def string(value):
+        if value == None:
+            return 0
+        index = table.get(value)
+        if index is None:
+            index = table[value] = len(table) + 1
+        return index
+
+    numbers = []
+    diff = wrap(diff)
+    numbers.append(len(diff))
+    for file in diff:
+        numbers.append(string(file.new.name))
+        numbers.append(string(file.old.name))
+        if file.changes == None:
+            numbers.append(0)
+            continue
+        runs = _runs(file.changes)
+        numbers.append(len(runs) + 1)
+        ends = [0, 0]  # LINE AFTER THE PREVIOUS RUN, FOR EACH KIND
+        for kind, start, contents in runs:
+            numbers.append((_zigzag(start - ends[kind]) << 1) | kind)
+            numbers.append(len(contents))
+            numbers.extend(string(c) for c in contents)
+            ends[kind] = start + len(contents)
+
+    strings_ = [value.encode("utf8") for value, _ in sorted(table.items(), key=lambda p: p[1])]
+    varints = bytearray()
+    for n in [len(strings_)] + [len(s) for s in strings_] + numbers:
+        _write_varint(varints, n)
+    return BINARY_DIFF_MAGIC + zlib.compress(struct.pack(str("<I"), len(varints)) + bytes(varints) + b"".join(strings_))
+
+
+def binary_to_diff(data):
+    """
+    :param data: FROM diff_to_binary()
+    :return: SAME AS diff_to_json()
+    """
+    if not data.startswith(BINARY_DIFF_MAGIC):
+        Log.error("expecting a binary diff")
+    content = zlib.decompress(data[len(BINARY_DIFF_MAGIC):])
+    num_bytes, = struct.unpack(str("<I"), content[:4])
+    numbers = _read_varints(content[4:4 + num_bytes])
+    blob = content[4 + num_bytes:]
+
+    num_strings = numbers[0]
+    table = [None]
+    end = 0
+    for length in numbers[1:num_strings + 1]:
+        table.append(blob[end:end + length].decode("utf8"))
+        end += length
+
+    i = num_strings + 1
+    output = []
+    num_files = numbers[i]
+    i += 1
+    for _ in range(num_files):
+        new_name, old_name, num_runs = numbers[i:i + 3]
+        i += 3
+        file_ = {"new": {"name": table[new_name]}, "old": {"name": table[old_name]}, "changes": None}
+        output.append(file_)
+        if not num_runs:
+            continue
+        changes = file_["changes"] = []
+        ends = [0, 0]
+        for _ in range(num_runs - 1):
+            header, length = numbers[i:i + 2]
+            i += 2
+            kind = header & 1
+            start = ends[kind] + _unzigzag(header >> 1)
+            side = "old" if kind == OLD else "new"
+            changes.extend(
+                {side: {"line": line, "content": table[c]}}
+                for line, c in zip(range(start, start + length), numbers[i:i + length])
+            )
+            i += length
+            ends[kind] = start + length
     return wrap(output)
+
+
+def _runs(changes):
+    """
+    :return: LIST OF (kind, start, contents) FOR EACH RUN OF CONSECUTIVE LINES ON ONE SIDE
+    """
+    runs = []
+    kind = end = contents = None
+    for change in changes:
+        if change.new.line != None:
+            k, line, content = NEW, change.new.line, change.new.content
+        else:
+            k, line, content = OLD, change.old.line, change.old.content
+        if k == kind and line == end:
+            contents.append(content)
+        else:
+            kind, contents = k, [content]
+            runs.append((kind, line, contents))
+        end = line + 1
+    return runs
+
+
+def _zigzag(value):
+    return value << 1 if value >= 0 else ((-value) << 1) - 1
+
+
+def _unzigzag(value):
+    return value >> 1 if not value & 1 else -((value + 1) >> 1)
+
+
+def _write_varint(buffer, value):
+    while value >= 0x80:
+        buffer.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def _read_varints(content):
+    """
+    DECODE ALL THE VARINTS AT ONCE
+    :return: LIST OF int
+    """
+    b = np.frombuffer(content, dtype=np.uint8).astype(np.int64)
+    if not len(b):
+        return []
+    last = b < 0x80  # LAST BYTE OF EACH VARINT
+    starts = np.concatenate(([0], np.flatnonzero(last)[:-1] + 1))
+    position = np.arange(len(b)) - np.repeat(starts, np.diff(np.append(starts, len(b))))
+    return np.bitwise_or.reduceat((b & 0x7F) << (7 * position), starts).tolist()
+
+
+def bytes_to_lines(chunks, encoding="utf8"):
+    """
+    :param chunks: ITERATOR OF BYTES (eg response.iter_content())
+    :return: GENERATOR OF DECODED LINES, SPLIT ON "\n" ONLY
+    """
+    decoder = codecs.getincrementaldecoder(encoding)("replace")
+    remainder = ""
+    for chunk in chunks:
+        lines = (remainder + decoder.decode(chunk)).split("\n")
+        remainder = lines.pop()
+        for line in lines:
+            yield line
+    yield remainder + decoder.decode(b"", final=True)
@@ -0,0 +1,437 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+from __future__ import division
+from __future__ import unicode_literals
+
+import numpy as np
+from mo_logs import Log
+
+NO_LINE = -1  # MARKS A LINE WITH NO PARTNER (NET-NEW, OR REMOVED)
+LINE_TYPE = np.int32
+
+
+class LineMap(object):
+    """
+    O(n) CHANGESET OPERATOR FOR A SINGLE FILE
+
+    new_to_old[new_line] == old_line THE new LINE CAME FROM, OR NO_LINE IF NET-NEW
+    old_to_new[old_line] == new_line THE old LINE WENT TO, OR NO_LINE IF REMOVED
+
+    THIS IS THE SAME INFORMATION AS THE (old_length x new_length) MATRIX, BUT
+    WITHOUT THE ZEROS
+    """
+
+    __slots__ = ["new_to_old", "old_to_new"]
+
+    def __init__(self, new_to_old, old_to_new):
+        self.new_to_old = new_to_old
+        self.old_to_new = old_to_new
+
+    @classmethod
+    def from_coordinates(cls, coord, new_length=None, old_length=None):
+        """
+        :param coord: LIST OF (new_line, old_line) PAIRS FOR THE UNCHANGED LINES
+        :param new_length: NUMBER OF LINES IN THE NEW FILE (DEFAULT IS JUST ENOUGH TO HOLD coord)
+        :param old_length: NUMBER OF LINES IN THE OLD FILE (DEFAULT IS JUST ENOUGH TO HOLD coord)
+        :return: LineMap
+        """
+        coord = np.asarray(coord, dtype=LINE_TYPE).reshape(-1, 2)
+        new_lines, old_lines = coord[:, 0], coord[:, 1]
+        if new_length is None:
+            new_length = int(np.max(new_lines)) + 1 if len(coord) else 0
+        if old_length is None:
+            old_length = int(np.max(old_lines)) + 1 if len(coord) else 0
+
+        new_to_old = np.full(new_length, NO_LINE, dtype=LINE_TYPE)
+        old_to_new = np.full(old_length, NO_LINE, dtype=LINE_TYPE)
+        new_to_old[new_lines] = old_lines
+        old_to_new[old_lines] = new_lines
+        return LineMap(new_to_old, old_to_new)
+
+    @property
+    def new_length(self):
+        return len(self.new_to_old)
+
+    @property
+    def old_length(self):
+        return len(self.old_to_new)
+
+    def apply(self, coverage, backward=False):
+        """
+        MAP A VECTOR ON THE old FILE TO A VECTOR ON THE new FILE
+        NET-NEW LINES ARE GIVEN ZERO
+        :param coverage: VECTOR OF old_length (new_length IF backward)
+        :param backward: True TO MAP FROM THE new FILE TO THE old FILE
+        :return: VECTOR OF new_length (old_length IF backward), SAME dtype
+        """
+        to_from, from_to = (self.old_to_new, self.new_to_old) if backward else (self.new_to_old, self.old_to_new)
+        coverage = np.asarray(coverage).ravel()
+        if len(coverage) != len(from_to):
+            Log.error(
+                "expecting vector of length {{expected}}, not {{length}}",
+                expected=len(from_to),
+                length=len(coverage)
+            )
+        output = np.zeros(len(to_from), dtype=coverage.dtype)
+        exists = to_from != NO_LINE
+        output[exists] = coverage[to_from[exists]]
+        return output
+
+    def transpose(self):
+        """
+        :return: THE OPERATOR THAT MAPS new BACK TO old (NO COPY IS MADE)
+        """
+        return LineMap(self.old_to_new, self.new_to_old)
+
+    @property
+    def T(self):
+        return self.transpose()
+
+    def net_new_lines(self):
+        """
+        :return: BOOLEAN VECTOR OF new_length; True FOR LINES ADDED BY THE CHANGESET
+        """
+        return self.new_to_old == NO_LINE
+
+    def removed_lines(self):
+        """
+        :return: BOOLEAN VECTOR OF old_length; True FOR LINES REMOVED BY THE CHANGESET
+        """
+        return self.old_to_new == NO_LINE
+
+    def to_matrix(self):
+        """
+        :return: THE DENSE (old_length x new_length) uint8 MATRIX - O(n^2), FOR TESTING ONLY
+        """
+        matrix = np.zeros((self.old_length, self.new_length), dtype=np.uint8)
+        new_lines = np.flatnonzero(self.new_to_old != NO_LINE)
+        matrix[self.new_to_old[new_lines], new_lines] = 1
+        return matrix
+
+    def __eq__(self, other):
+        if not isinstance(other, LineMap):
+            return False
+        return np.array_equal(self.new_to_old, other.new_to_old) and np.array_equal(self.old_to_new, other.old_to_new)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        return "LineMap(new_length=" + str(self.new_length) + ", old_length=" + str(self.old_length) + ")"
+
+
+class RunMap(object):
+    """
+    O(hunks) CHANGESET OPERATOR FOR A SINGLE FILE
+
+    EACH RUN i MAPS THE UNCHANGED old LINES old_start[i] .. old_start[i]+length[i]-1
+    ONTO THE new LINES new_start[i] .. new_start[i]+length[i]-1
+    THE tail IS AN OPEN-ENDED RUN STARTING AT (tail_new, tail_old) THAT CONTINUES
+    TO THE END OF THE FILE, SO THE FILE LENGTH IS NOT NEEDED UNTIL THE OPERATOR IS
+    APPLIED TO A VECTOR
+
+    RUNS ARE SORTED, AND MONOTONIC IN BOTH new AND old LINES
+
+    THE RUNS READ THE SAME IN BOTH DIRECTIONS, SO EVERY METHOD THAT MAPS
+    VECTORS OR LINES TAKES backward=True TO GO FROM new TO old, AT THE SAME
+    COST AS FORWARD; THERE IS NO NEED TO TRANSPOSE FIRST
+    """
+
+    __slots__ = ["new_start", "old_start", "length", "tail_new", "tail_old"]
+
+    def __init__(self, new_start, old_start, length, tail_new, tail_old):
+        self.new_start = np.asarray(new_start, dtype=LINE_TYPE)
+        self.old_start = np.asarray(old_start, dtype=LINE_TYPE)
+        self.length = np.asarray(length, dtype=LINE_TYPE)
+        self.tail_new = int(tail_new)
+        self.tail_old = int(tail_old)
+
+    @classmethod
+    def identity(cls):
+        return RunMap([], [], [], 0, 0)
+
+    @classmethod
+    def from_runs(cls, runs, tail_new, tail_old):
+        """
+        :param runs: LIST OF (new_start, old_start, length) TRIPLES
+        """
+        runs = np.asarray(runs, dtype=LINE_TYPE).reshape(-1, 3)
+        return RunMap(runs[:, 0], runs[:, 1], runs[:, 2], tail_new, tail_old)
+
+    @property
+    def num_runs(self):
+        return len(self.length)
+
+    @property
+    def skew(self):
+        """
+        :return: new_length - old_length
+        """
+        return self.tail_new - self.tail_old
+
+    def lengths(self, new_length=None, old_length=None):
+        """
+        GIVEN ONE FILE LENGTH, RETURN BOTH
+        :return: (new_length, old_length)
+        """
+        if new_length is not None:
+            old_length = new_length - self.skew
+        elif old_length is not None:
+            new_length = old_length + self.skew
+        else:
+            Log.error("expecting new_length or old_length")
+        if new_length < self.tail_new or old_length < self.tail_old:
+            Log.error(
+                "file of {{length}} lines is too short for changeset ending at line {{tail}}",
+                length=old_length,
+                tail=self.tail_old
+            )
+        return new_length, old_length
+
+    def directed(self, backward=False):
+        """
+        :return: (to_start, from_start, length, to_tail, from_tail) FOR MAPPING IN THE GIVEN DIRECTION
+        """
+        if backward:
+            return self.old_start, self.new_start, self.length, self.tail_old, self.tail_new
+        return self.new_start, self.old_start, self.length, self.tail_new, self.tail_old
+
+    def apply(self, coverage, backward=False):
+        """
+        MAP A VECTOR ON THE old FILE TO A VECTOR ON THE new FILE
+        NET-NEW LINES ARE GIVEN ZERO
+        :param coverage: VECTOR ON THE old FILE (THE new FILE IF backward)
+        :param backward: True TO MAP FROM THE new FILE TO THE old FILE
+        :return: VECTOR ON THE new FILE (THE old FILE IF backward), SAME dtype
+        """
+        coverage = np.asarray(coverage).ravel()
+        if backward:
+            output_length = self.lengths(new_length=len(coverage))[1]
+        else:
+            output_length = self.lengths(old_length=len(coverage))[0]
+        to_start, from_start, length, to_tail, from_tail = self.directed(backward)
+        output = np.zeros(output_length, dtype=coverage.dtype)
+        for t, f, l in zip(to_start.tolist(), from_start.tolist(), length.tolist()):
+            output[t:t + l] = coverage[f:f + l]
+        output[to_tail:] = coverage[from_tail:]
+        return output
+
+    def map_lines(self, lines, backward=False):
+        """
+        WHERE EACH old LINE IS ON THE new FILE; THE FILE LENGTH IS NOT NEEDED
+        :param lines: ZERO-BASED old LINE NUMBERS (new LINE NUMBERS IF backward)
+        :param backward: True TO MAP new LINES TO old LINES
+        :return: new LINE NUMBERS (old IF backward), NO_LINE FOR LINES WITH NO PARTNER
+        """
+        to_start, from_start, length, to_tail, from_tail = self.directed(backward)
+        lines = np.asarray(lines, dtype=LINE_TYPE).ravel()
+        output = np.full(len(lines), NO_LINE, dtype=LINE_TYPE)
+        run = np.searchsorted(from_start, lines, side="right") - 1
+        in_run = run >= 0
+        in_run[in_run] = lines[in_run] - from_start[run[in_run]] < length[run[in_run]]
+        output[in_run] = lines[in_run] - from_start[run[in_run]] + to_start[run[in_run]]
+        in_tail = lines >= from_tail
+        output[in_tail] = lines[in_tail] - from_tail + to_tail
+        return output
+
+    def transpose(self):
+        """
+        :return: THE OPERATOR THAT MAPS new BACK TO old (NO COPY IS MADE)
+        """
+        return RunMap(self.old_start, self.new_start, self.length, self.tail_old, self.tail_new)
+
+    @property
+    def T(self):
+        return self.transpose()
+
+    def net_new_lines(self, new_length=None):
+        """
+        :param new_length: LENGTH OF THE new FILE (DEFAULT IS THE START OF THE tail, SINCE THE tail HAS NO NET-NEW LINES)
+        :return: BOOLEAN VECTOR; True FOR LINES ADDED BY THE CHANGESET
+        """
+        return _uncovered(self.new_start, self.length, self.tail_new, new_length)
+
+    def removed_lines(self, old_length=None):
+        """
+        :param old_length: LENGTH OF THE old FILE (DEFAULT IS THE START OF THE tail, SINCE THE tail HAS NO REMOVED LINES)
+        :return: BOOLEAN VECTOR; True FOR LINES REMOVED BY THE CHANGESET
+        """
+        return _uncovered(self.old_start, self.length, self.tail_old, old_length)
+
+    def to_line_map(self, new_length=None, old_length=None):
+        new_length, old_length = self.lengths(new_length, old_length)
+        new_to_old = np.full(new_length, NO_LINE, dtype=LINE_TYPE)
+        old_to_new = np.full(old_length, NO_LINE, dtype=LINE_TYPE)
+        for n, o, l in zip(self.new_start.tolist(), self.old_start.tolist(), self.length.tolist()):
+            new_to_old[n:n + l] = np.arange(o, o + l, dtype=LINE_TYPE)
+            old_to_new[o:o + l] = np.arange(n, n + l, dtype=LINE_TYPE)
+        new_to_old[self.tail_new:] = np.arange(self.tail_old, old_length, dtype=LINE_TYPE)
+        old_to_new[self.tail_old:] = np.arange(self.tail_new, new_length, dtype=LINE_TYPE)
+        return LineMap(new_to_old, old_to_new)
+
+    def to_matrix(self, new_length=None, old_length=None):
+        """
+        :return: THE DENSE (old_length x new_length) uint8 MATRIX - O(n^2), FOR TESTING ONLY
+        """
+        return self.to_line_map(new_length, old_length).to_matrix()
+
+    def __mul__(self, other):
+        """
+        LIKE MATRICES: (c1 * c2) IS c1 FOLLOWED BY c2
+        """
+        return compose(self, other)
+
+    def __eq__(self, other):
+        if not isinstance(other, RunMap):
+            return False
+        return (
+            self.tail_new == other.tail_new and
+            self.tail_old == other.tail_old and
+            np.array_equal(self.new_start, other.new_start) and
+            np.array_equal(self.old_start, other.old_start) and
+            np.array_equal(self.length, other.length)
+        )
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        return "RunMap(runs=" + str(self.num_runs) + ", tail=(" + str(self.tail_new) + ", " + str(self.tail_old) + "))"
+
+
+class RunBuilder(object):
+    """
+    ACCUMULATE RUNS IN ORDER, MERGING ADJACENT ONES
+    """
+
+    __slots__ = ["new_start", "old_start", "length"]
+
+    def __init__(self):
+        self.new_start = []
+        self.old_start = []
+        self.length = []
+
+    def add(self, new_start, old_start, length):
+        if length <= 0:
+            return
+        if self.length:
+            last = len(self.length) - 1
+            end = self.new_start[last] + self.length[last]
+            if end == new_start and self.old_start[last] + self.length[last] == old_start:
+                self.length[last] += length
+                return
+            if end > new_start:
+                Log.error("can not handle out-of-order diffs")
+        self.new_start.append(new_start)
+        self.old_start.append(old_start)
+        self.length.append(length)
+
+    def build(self, tail_new, tail_old):
+        """
+        :return: RunMap, WITH THE LAST RUN ABSORBED INTO THE tail, IF IT TOUCHES
+        """
+        if self.length:
+            last = len(self.length) - 1
+            if self.new_start[last] + self.length[last] == tail_new and self.old_start[last] + self.length[last] == tail_old:
+                tail_new, tail_old = self.new_start[last], self.old_start[last]
+                self.new_start.pop()
+                self.old_start.pop()
+                self.length.pop()
+        return RunMap(self.new_start, self.old_start, self.length, tail_new, tail_old)
+
+
+def compose(first, second):
+    """
+    ASSOCIATIVE: compose(compose(a, b), c) == compose(a, compose(b, c))
+    O(first.num_runs + second.num_runs)
+
+    :param first: RunMap FROM v0 TO v1
+    :param second: RunMap FROM v1 TO v2
+    :return: RunMap FROM v0 TO v2
+    """
+    # BOTH OPERATORS MEET ON v1: first.new AND second.old; INTERSECT THEIR RUNS THERE
+    a = _runs_with_tail(first.new_start, first.old_start, first.length, first.tail_new, first.tail_old)
+    b = _runs_with_tail(second.old_start, second.new_start, second.length, second.tail_old, second.tail_new)
+
+    runs = RunBuilder()
+    i, j = 0, 0
+    while True:
+        a_start, a_from, a_end = a[i]
+        b_start, b_to, b_end = b[j]
+        start = max(a_start, b_start)
+        if a_end is None:
+            end = b_end
+        elif b_end is None:
+            end = a_end
+        else:
+            end = min(a_end, b_end)
+        if end is None:
+            # BOTH tails OVERLAP, TO THE END OF THE FILE
+            return runs.build(b_to + start - b_start, a_from + start - a_start)
+        if start < end:
+            runs.add(b_to + start - b_start, a_from + start - a_start, end - start)
+        if b_end is None or (a_end is not None and a_end <= b_end):
+            i += 1
+        else:
+            j += 1
+
+
+def compose_changesets(first, second):
+    """
+    :param first: MAP FROM PATH TO RunMap, FROM v0 TO v1
+    :param second: MAP FROM PATH TO RunMap, FROM v1 TO v2
+    :return: MAP FROM PATH TO RunMap, FROM v0 TO v2; FILES NOT MENTIONED ARE UNCHANGED
+    """
+    output = dict(first)
+    for path, operator in second.items():
+        previous = first.get(path)
+        if previous is None:
+            output[path] = operator
+        else:
+            output[path] = compose(previous, operator)
+    return output
+
+
+def operator_to_json(operator):
+    """
+    :return: JSON-ABLE VALUE FOR RunMap
+    """
+    return {
+        "runs": list(map(list, zip(operator.new_start.tolist(), operator.old_start.tolist(), operator.length.tolist()))),
+        "tail": [operator.tail_new, operator.tail_old]
+    }
+
+
+def json_to_operator(value):
+    """
+    :param value: FROM operator_to_json()
+    :return: RunMap
+    """
+    tail_new, tail_old = value["tail"]
+    return RunMap.from_runs([tuple(r) for r in value["runs"]], tail_new, tail_old)
+
+
+def _runs_with_tail(start, other_start, length, tail, other_tail):
+    """
+    :return: LIST OF (start, other_start, end) TRIPLES, ENDING WITH THE tail, WHICH HAS end==None
+    """
+    start = start.tolist()
+    output = [(s, o, s + l) for s, o, l in zip(start, other_start.tolist(), length.tolist())]
+    output.append((tail, other_tail, None))
+    return output
+
+
+def _uncovered(starts, lengths, tail, length):
+    if length is None:
+        length = tail
+    output = np.ones(length, dtype=bool)
+    for s, l in zip(starts.tolist(), lengths.tolist()):
+        output[s:s + l] = False
+    output[tail:] = False
+    return output
@@ -11,127 +11,415 @@ from __future__ import unicode_literals
 import re
 
 import numpy as np
-from mo_dots import Data
+from mo_dots import Data, listwrap
+from mo_future import text_type
 from mo_logs import Log, startup, constants
-from numpy import copy
+from mo_logs.strings import expand_template
+from pyLibrary.env import http
 
-from mo_hg.hg_mozilla_org import HgMozillaOrg
+from mo_hg.diff_index import DiffIndex
+from mo_hg.hg_mozilla_org import HgMozillaOrg, DIFF_URL
+from mo_hg.repos.revisions import Revision
+from operators import RunBuilder, RunMap, LINE_TYPE
 
 GET_DIFF = "{{location}}/rev/{{rev}}"
 GET_FILE = "{{location}}/file/{{rev}}{{path}}"
 
-HUNK_HEADER = re.compile(r"^-(\d+),(\d+) \+(\d+),(\d+) @@.*")
+HUNK_HEADER = re.compile(r"^-(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@.*")
 FILE_SEP = re.compile(r"^--- ", re.MULTILINE)
 HUNK_SEP = re.compile(r"^@@ ", re.MULTILINE)
+HUNK_HEADER_BYTES = re.compile(br"-(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+DEV_NULL = "/dev/null"
 
-MOVE = {
-    ' ': np.array([1, 1], dtype=int),
-    '\\': np.array([0, 0], dtype=int),  # FOR "\ no newline at end of file"
-    '+': np.array([1, 0], dtype=int),
-    '-': np.array([0, 1], dtype=int)
-}
-no_change = MOVE[' ']
+NEW_LINE, SPACE, PLUS, MINUS, BACKSLASH, AT = bytearray(b"\n +-\\@")
+HUNK_LINE_TYPES = [NEW_LINE, SPACE, PLUS, MINUS, BACKSLASH]  # "\n" IS AN EMPTY LINE, "\\" IS FOR "\ no newline at end of file"
 
 
-def parse_changeset_to_matrix(branch, changeset_id, new_source_code=None):
+def parse_changeset_to_matrix(branch, changeset_id, new_source_code=None, dense=False):
     """
     :param branch:  Data with `url` parameter pointing to hg instance
     :param changeset_id:
     :param new_source_code:  for testing - provide the resulting file (for file length only)
-    :return:
+    :param dense: True TO RETURN THE O(n^2) MATRIX (FOR TESTING), OTHERWISE A RunMap
+    :return: MAP FROM FULL PATH TO OPERATOR
     """
-    diff = _get_changeset(branch, changeset_id)
-    map = _parse_diff(diff, new_source_code)
-    return _map_to_matrix(map)
+    diff = _get_changeset(branch, changeset_id).decode("utf8", "replace")
+    file_lengths = None
+    if dense and new_source_code is None:
+        # ONLY THE DENSE MATRIX NEEDS THE FILE LENGTHS
+        if hg is None:
+            Log.error("expecting main() to connect to hg")
+        new_names = _new_file_names(diff.encode("utf8"))
+        lengths = hg.get_file_lengths(
+            Revision(branch=branch, changeset={"id": changeset_id}),
+            sorted(set(n for n in new_names.values() if n is not None))
+        )
+        file_lengths = {path: 0 if name is None else lengths[name] for path, name in new_names.items()}
+    return parse_diff_to_matrix(diff, new_source_code, dense, file_lengths)
 
 
-def parse_diff_to_matrix(diff, new_source_code=None):
+def _new_file_names(diff):
+    """
+    :param diff: BYTES OF THE UNIFIED DIFF
+    :return: MAP FROM PATH (AS _parse_diff() NAMES IT) TO THE FILE'S NAME AFTER
+             THE CHANGESET, OR None IF THE CHANGESET DELETES IT
+    """
+    output = {}
+    for f in DiffIndex.scan(diff).files:
+        old, new = f["old"], f["new"]
+        deleted = new.endswith(DEV_NULL[1:])
+        output[new if old.endswith(DEV_NULL[1:]) else old] = None if deleted else new
+    return output
+
+
+def parse_diff_to_matrix(diff, new_source_code=None, dense=False, file_lengths=None):
     """
     :param diff:  textual diff
     :param new_source_code:  for testing - provide the resulting file (for file length only)
-    :return:
+    :param dense: True TO RETURN THE O(n^2) MATRIX (FOR TESTING), OTHERWISE A RunMap
+    :param file_lengths: MAP FROM PATH (THE old NAME OF A RENAMED FILE) TO ITS LENGTH AFTER THE
+                         CHANGESET (0 IF DELETED), FOR dense WITHOUT new_source_code
+    :return: MAP FROM FULL PATH TO OPERATOR
     """
-    return _map_to_matrix(_parse_diff(diff, new_source_code))
+    map = _parse_diff(diff)
+    if dense:
+        if new_source_code is not None:
+            file_lengths = {file_path: len(new_source_code) for file_path in map}
+        elif file_lengths is None:
+            Log.error("dense matrix requires the new_source_code, or file_lengths")
+        return _map_to_matrix(map, file_lengths)
+    return map
 
 
-def _map_to_matrix(map):
-    output = {}
-    for file_path, coord in map.items():
-        maxx = np.max(coord, 0)
-        matrix = np.zeros(maxx + 1, dtype=np.uint8)
-        matrix[zip(*coord)] = 1
-        output[file_path] = matrix.T  # OOPS! coordinates were reversed
-    return output
+def _map_to_matrix(map, file_lengths):
+    return {file_path: operator.to_matrix(new_length=file_lengths[file_path]) for file_path, operator in map.items()}
 
 
-def parse_to_map(branch, changeset_id):
+def parse_to_map(branch, changeset_id, paths=None):
     """
-    MATRICIES ARE O(n^2), WE NEED A O(n) SOLUTION
+    O(hunks), INDEPENDENT OF FILE LENGTH
 
     :param branch: OBJECT TO DESCRIBE THE BRANCH TO PULL INFO
     :param changeset_id: THE REVISION NUMEBR OF THE CHANGESET
+    :param paths: OPTIONAL LIST OF FILES WE ARE INTERESTED IN (DEFAULT ALL)
     :return:  MAP FROM FULL PATH TO OPERATOR
     """
+    diff = _get_changeset(branch, changeset_id)
+    if paths is None:
+        return _parse_diff(diff.decode("utf8", "replace"))
+    return parse_diff_files(diff, paths)
+
+
+def parse_diff_files(diff, paths, index=None):
+    """
+    PARSE ONLY THE PART OF THE diff FOR THE GIVEN paths
 
-    map = _parse_diff(_get_changeset(branch, changeset_id))
+    :param diff: BYTES OF THE UNIFIED DIFF
+    :param paths: LIST OF FULL PATHS (A RENAMED FILE IS FOUND BY EITHER NAME)
+    :param index: DiffIndex OF THE diff, IF WE ALREADY HAVE ONE
+    :return: MAP FROM EACH OF paths TO OPERATOR (FILES NOT IN THE diff ARE NOT INCLUDED)
+    """
+    if index is None:
+        index = DiffIndex.scan(diff)
     output = {}
-    for file_path, coord in map.items():
-        maxx = np.max(coord, 0)
-        matrix = np.zeros(maxx + 1, dtype=np.uint8)
-        matrix[zip(*coord)] = 1
-        output[file_path] = matrix.T
+    for path in paths:
+        content = index.file_bytes(diff, path)
+        if content is None:
+            continue
+        # ONE FILE, BUT _parse_diff() NAMES IT BY ITS old NAME
+        for operator in _parse_diff(content.decode("utf8", "replace")).values():
+            output[path] = operator
     return output
 
 
-def _parse_diff(changeset, new_source_code=None):
+def get_operator_chain(hg, branch, path, from_changeset, to_changeset):
     """
-    :param branch: OBJECT TO DESCRIBE THE BRANCH TO PULL INFO
+    ONLY THE CHANGESETS THAT TOUCH path ARE FETCHED AND PARSED
+
+    :param hg: HgMozillaOrg, WHOSE file_history RECORDS EVERY REVISION IT SEES
+    :param branch: Data with `name` and `url` parameters
+    :param path: FULL PATH OF THE FILE, WITH LEADING SLASH
+    :param from_changeset: THE REVISION THE VECTOR IS ON
+    :param to_changeset: THE REVISION TO PROJECT TO (MAY BE BEFORE from_changeset)
+    :return: LIST OF RunMap, TO BE APPLIED IN ORDER
+    """
+    start = hg.get_revision(Revision(branch=branch, changeset={"id": from_changeset})).index
+    end = hg.get_revision(Revision(branch=branch, changeset={"id": to_changeset})).index
+    if start == None or end == None:
+        Log.error("can not find revision index for {{path}}", path=path)
+
+    if start <= end:
+        _backfill_file_history(hg, branch, to_changeset, start, end)
+        return [
+            _file_operator(branch, changeset_id, path)
+            for changeset_id in hg.file_history.changesets(branch.name, path, start, end)
+        ]
+    else:
+        _backfill_file_history(hg, branch, from_changeset, end, start)
+        return [
+            _file_operator(branch, changeset_id, path).transpose()
+            for changeset_id in reversed(hg.file_history.changesets(branch.name, path, end, start))
+        ]
+
+
+def _file_operator(branch, changeset_id, path):
+    """
+    :return: THE OPERATOR FOR path, FROM A CHANGESET KNOWN TO TOUCH IT
+    """
+    operator = parse_to_map(branch, changeset_id, [path]).get(path)
+    if operator is None:
+        Log.error("changeset {{changeset|left(12)}} touches {{path}}, but its diff has no hunks for it", changeset=changeset_id, path=path)
+    return operator
+
+
+def _backfill_file_history(hg, branch, last_changeset, first_index, last_index):
+    """
+    MAKE SURE EVERY REVISION IN (first_index, last_index] IS IN hg.file_history,
+    BY WALKING PARENTS BACK FROM last_changeset
+    """
+    if not hg.file_history.missing(branch.name, first_index, last_index):
+        return
+    changeset_id = last_changeset
+    while True:
+        revision = hg.get_revision(Revision(branch=branch, changeset={"id": changeset_id}))  # RECORDS IN file_history
+        if revision.index == None or revision.index <= first_index + 1:
+            return
+        parents = listwrap(revision.parents)
+        if not parents:
+            return
+        changeset_id = parents[0]
+
+
+def _get_changeset(branch, changeset_id):
+    """
+    :return: THE UNIFIED DIFF BYTES
+    """
+    response = http.get(expand_template(DIFF_URL, {"location": branch.url, "rev": changeset_id}))
+    return response.content
+
+
+def _parse_diff(changeset):
+    """
+    EVERY LINE OF THE DIFF IS CLASSIFIED AT ONCE, BY ITS FIRST BYTES, AND THE
+    LINE NUMBERS COME FROM CUMULATIVE SUMS; ONLY THE FILE AND HUNK HEADERS ARE
+    VISITED ONE AT A TIME. SAME RESULT AS _parse_diff_by_line()
+
+    :param changeset: THE DIFF CONTENT (TEXT, OR UTF8 BYTES)
+    :return:  MAP FROM FULL PATH TO RunMap
+    """
+    if isinstance(changeset, text_type):
+        changeset = changeset.encode("utf8")
+    content = np.frombuffer(changeset, dtype=np.uint8)
+    line_starts = np.concatenate(([0], np.flatnonzero(content == NEW_LINE) + 1))
+    num_lines = len(line_starts)
+
+    def line(i):
+        end = line_starts[i + 1] - 1 if i + 1 < num_lines else len(changeset)
+        return changeset[line_starts[i]:end].decode("utf8", "replace")
+
+    # FIRST FOUR BYTES OF EVERY LINE; AN EMPTY LINE LOOKS LIKE "\n"
+    padded = np.concatenate((content, np.full(4, NEW_LINE, dtype=np.uint8)))
+    first, second, third, fourth = (padded[line_starts + i] for i in range(4))
+
+    # NUMBER OF new (AND old) LINES BEFORE EACH DIFF LINE
+    is_context = first == SPACE
+    new_before = np.concatenate(([0], np.cumsum(is_context | (first == PLUS))))
+    old_before = np.concatenate(([0], np.cumsum(is_context | (first == MINUS))))
+
+    # THE LINES OF EVERY "@@ " HUNK; A REMOVED LINE STARTING WITH "-- " IN THERE IS NOT A FILE HEADER
+    hunk_lines = np.flatnonzero((first == AT) & (second == AT) & (third == SPACE))  # "@@ "
+    matches = [HUNK_HEADER_BYTES.match(changeset, start + 3) for start in line_starts[hunk_lines].tolist()]
+    lengths = np.array([(int(m.group(2) or 1), int(m.group(4) or 1)) if m else (0, 0) for m in matches], dtype=int).reshape(len(matches), 2)
+    body = hunk_lines + 1
+    body_end = np.maximum(
+        np.searchsorted(new_before, new_before[body] + lengths[:, 1]),
+        np.searchsorted(old_before, old_before[body] + lengths[:, 0])
+    )
+    body_end = np.minimum(np.maximum(body_end, body), np.append(hunk_lines[1:], num_lines))
+    in_body = np.zeros(num_lines + 1, dtype=int)
+    np.add.at(in_body, body, 1)
+    np.add.at(in_body, body_end, -1)
+    in_body = np.cumsum(in_body[:-1]) > 0
+
+    # THE HEADERS
+    file_lines = np.flatnonzero((first == MINUS) & (second == MINUS) & (third == MINUS) & (fourth == SPACE) & ~in_body)  # "--- "
+    file_ends = np.append(file_lines[1:], num_lines)
+    hunk_files = np.searchsorted(file_lines, hunk_lines, side="right") - 1
+    keep = hunk_files >= 0
+    keep[keep] = hunk_lines[keep] >= file_lines[hunk_files[keep]] + 2  # HUNKS START AFTER THE "+++ " LINE
+    matches = [m for m, k in zip(matches, keep.tolist()) if k]
+    hunk_lines, hunk_files = hunk_lines[keep], hunk_files[keep]
+    num_hunks = len(hunk_lines)
+    hunk_starts = hunk_lines + 1
+    hunk_ends = np.minimum(np.append(hunk_lines[1:], num_lines), file_ends[hunk_files])
+
+    paths = [_file_path(line(f)[4:], line(f + 1)) for f in file_lines.tolist()]
+    headers = [_hunk_numbers(m, lambda: line(h)) for h, m in zip(hunk_lines.tolist(), matches)]
+    old_start, old_length, new_start, new_length = np.array(headers, dtype=int).reshape(num_hunks, 4).T
+
+    # EACH HUNK ENDS WHEN BOTH SIDES ARE CONSUMED
+    consumed = np.maximum(
+        np.searchsorted(new_before, new_before[hunk_starts] + new_length),
+        np.searchsorted(old_before, old_before[hunk_starts] + old_length)
+    )
+    hunk_ends = np.minimum(np.maximum(consumed, hunk_starts), hunk_ends)
+    in_hunk = np.zeros(num_lines + 1, dtype=int)
+    np.add.at(in_hunk, hunk_starts, 1)
+    np.add.at(in_hunk, hunk_ends, -1)
+    in_hunk = np.cumsum(in_hunk[:-1]) > 0
+
+    bad = np.flatnonzero(in_hunk & ~np.isin(first, HUNK_LINE_TYPES))
+    if len(bad):
+        Log.error("unexpected line {{line|quote}} in hunk", line=line(bad[0]))
+
+    # WHERE EACH HUNK ENDS, AND WHERE THE PREVIOUS ONE ENDED
+    new_end = new_start + new_before[hunk_ends] - new_before[hunk_starts]
+    old_end = old_start + old_before[hunk_ends] - old_before[hunk_starts]
+    first_in_file = np.ones(num_hunks, dtype=bool)
+    first_in_file[1:] = hunk_files[1:] != hunk_files[:-1]
+    prev_new = np.where(first_in_file, 0, np.roll(new_end, 1))
+    prev_old = np.where(first_in_file, 0, np.roll(old_end, 1))
+    bad = np.flatnonzero(new_start - old_start != prev_new - prev_old)
+    if len(bad):
+        Log.error("expecting a skew of {{skew}}", skew=int(new_start[bad[0]] - old_start[bad[0]]))
+    if np.any(prev_new > new_start):
+        Log.error("can not handle out-of-order diffs")
+
+    # THE RUNS: THE GAP BEFORE EACH HUNK, AND EACH CONTEXT LINE INSIDE THE HUNKS
+    context = np.flatnonzero(in_hunk & is_context)
+    context_hunk = np.searchsorted(hunk_starts, context, side="right") - 1
+    context_start = hunk_starts[context_hunk]
+    run_file = np.concatenate((hunk_files, hunk_files[context_hunk]))
+    run_new = np.concatenate((prev_new, new_start[context_hunk] + new_before[context] - new_before[context_start]))
+    run_old = np.concatenate((prev_old, old_start[context_hunk] + old_before[context] - old_before[context_start]))
+    run_length = np.concatenate((new_start - prev_new, np.ones(len(context), dtype=int)))
+    keep = run_length > 0
+    order = np.lexsort((run_new[keep], run_file[keep]))
+    run_file, run_new, run_old, run_length = (a[keep][order] for a in (run_file, run_new, run_old, run_length))
+
+    # MERGE ADJACENT RUNS
+    separate = np.ones(len(run_file), dtype=bool)
+    separate[1:] = (
+        (run_file[1:] != run_file[:-1]) |
+        (run_new[1:] != run_new[:-1] + run_length[:-1]) |
+        (run_old[1:] != run_old[:-1] + run_length[:-1])
+    )
+    starts = np.flatnonzero(separate)
+    run_length = np.add.reduceat(run_length, starts) if len(starts) else run_length
+    run_file = run_file[starts]
+    run_new = run_new[starts].astype(LINE_TYPE)
+    run_old = run_old[starts].astype(LINE_TYPE)
+    run_length = run_length.astype(LINE_TYPE)
+
+    # THE tail STARTS WHERE THE LAST HUNK OF EACH FILE ENDS
+    last_in_file = np.ones(num_hunks, dtype=bool)
+    last_in_file[:-1] = first_in_file[1:]
+    tail_new = np.zeros(len(paths), dtype=int)
+    tail_old = np.zeros(len(paths), dtype=int)
+    tail_new[hunk_files[last_in_file]] = new_end[last_in_file]
+    tail_old[hunk_files[last_in_file]] = old_end[last_in_file]
+
+    output = {}
+    file_runs = np.searchsorted(run_file, np.arange(len(paths) + 1)).tolist()
+    run_end_new = (run_new + run_length).tolist()
+    run_end_old = (run_old + run_length).tolist()
+    for f, (path, t_new, t_old) in enumerate(zip(paths, tail_new.tolist(), tail_old.tolist())):
+        start, end = file_runs[f], file_runs[f + 1]
+        if start < end and run_end_new[end - 1] == t_new and run_end_old[end - 1] == t_old:
+            # LAST RUN TOUCHES THE tail
+            end -= 1
+            t_new, t_old = int(run_new[end]), int(run_old[end])
+        output[path] = RunMap(run_new[start:end], run_old[start:end], run_length[start:end], t_new, t_old)
+    return output
+
+
+def _parse_diff_by_line(changeset):
+    """
+    ONLY THE LINES INSIDE THE HUNKS ARE VISITED; THE UNCHANGED LINES BETWEEN
+    HUNKS, AND AFTER THE LAST HUNK, ARE RUNS TAKEN FROM THE HUNK HEADERS
+    THIS IS THE REFERENCE IMPLEMENTATION FOR _parse_diff(), ONE LINE AT A TIME
+
     :param changeset: THE DIFF TEXT CONTENT
-    :param new_source_code:  for testing - provide the resulting file (for file length only)
-    :return:  MAP FROM FULL PATH TO LIST OF COORINATES
+    :return:  MAP FROM FULL PATH TO RunMap
     """
     output = {}
 
     files = FILE_SEP.split(changeset)
     for file in files[1:]:
         file_header_a, file_header_b, file_diff = file.split("\n", 2)
-        file_path = file_header_a[1:]  # eg file_header_a == "a/testing/marionette/harness/marionette_harness/tests/unit/unit-tests.ini"
+        file_path = _file_path(file_header_a, file_header_b)
 
-        coord = []
-        c = np.array([0,0], dtype=int)
+        runs = RunBuilder()
+        c_new, c_old = 0, 0
         for hunk in HUNK_SEP.split(file_diff)[1:]:
             line_diffs = hunk.split("\n")
-            old_start, old_length, new_start, new_length = HUNK_HEADER.match(line_diffs[0]).groups()
-            next_c = np.array([int(new_start)-1, int(old_start)-1], dtype=int)
-            if next_c[0] - next_c[1] != c[0] - c[1]:
-                Log.error("expecting a skew of {{skew}}", skew=next_c[0] - next_c[1])
-            if c[0] > next_c[0]:
+            old_start, old_length, new_start, new_length = _hunk_header(line_diffs[0])
+            if new_start - old_start != c_new - c_old:
+                Log.error("expecting a skew of {{skew}}", skew=new_start - old_start)
+            if c_new > new_start:
                 Log.error("can not handle out-of-order diffs")
-            while c[0] != next_c[0]:
-                coord.append(copy(c))
-                c += no_change
+            runs.add(c_new, c_old, new_start - c_new)
+            c_new, c_old = new_start, old_start
 
+            # WALK THE HUNK, UNTIL BOTH SIDES ARE CONSUMED
+            new_end, old_end = new_start + new_length, old_start + old_length
             for line in line_diffs[1:]:
+                if c_new >= new_end and c_old >= old_end:
+                    break
                 if not line:
                     continue
                 d = line[0]
                 if d == ' ':
-                    coord.append(copy(c))
-                c += MOVE[d]
+                    runs.add(c_new, c_old, 1)
+                    c_new += 1
+                    c_old += 1
+                elif d == '+':
+                    c_new += 1
+                elif d == '-':
+                    c_old += 1
+                elif d == '\\':
+                    pass  # FOR "\ no newline at end of file"
+                else:
+                    Log.error("unexpected line {{line|quote}} in hunk", line=line)
 
-        # WE ONLY NEED THE NUMBER OF CODE LINES SO WE KNOW THE CODE DIMENSIONS SO WE CAN MAKE THE MATRIX
-        # A MORE EFFICIENT IMPLEMENTATION COULD WORK WITHOUT KNOWING THE LENGTH OF THE SOURCE
-        if new_source_code is None:
-            new_length = len(get_source_code(branch, changeset_id, file_path))
-        else:
-            new_length = len(new_source_code)
+        output[file_path] = runs.build(c_new, c_old)
+    return output
 
-        while c[0] < new_length:
-            coord.append(copy(c))
-            c += no_change
 
-        output[file_path] = coord
-    return output
+def _file_path(file_header_a, file_header_b):
+    """
+    :param file_header_a: eg "a/testing/marionette/harness/marionette_harness/tests/unit/unit-tests.ini"
+    :param file_header_b: eg "+++ b/testing/marionette/harness/marionette_harness/tests/unit/unit-tests.ini"
+    :return: PATH, WITH LEADING SLASH
+    """
+    if file_header_a == DEV_NULL:
+        # NEW FILE
+        return file_header_b[5:]
+    return file_header_a[1:]
+
+
+def _hunk_header(line):
+    """
+    :return: ZERO-BASED (old_start, old_length, new_start, new_length)
+    """
+    return _hunk_numbers(HUNK_HEADER.match(line), lambda: line)
+
+
+def _hunk_numbers(match, line):
+    """
+    :param match: HUNK_HEADER MATCH
+    :param line: FUNCTION RETURNING THE HEADER LINE, FOR THE ERROR MESSAGE
+    :return: ZERO-BASED (old_start, old_length, new_start, new_length)
+    """
+    if not match:
+        Log.error("expecting hunk header, not {{line|quote}}", line=line())
+    old_start, old_length, new_start, new_length = match.groups()
+    old_length = 1 if old_length is None else int(old_length)
+    new_length = 1 if new_length is None else int(new_length)
+    # AN EMPTY RANGE POINTS TO THE LINE BEFORE, WHICH IS ALREADY THE ZERO-BASED START
+    old_start = int(old_start) - (1 if old_length else 0)
+    new_start = int(new_start) - (1 if new_length else 0)
+    return old_start, old_length, new_start, new_length
 
 
 config = None
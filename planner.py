@@ -0,0 +1,155 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+from __future__ import division
+from __future__ import unicode_literals
+
+import heapq
+
+from mo_dots import listwrap
+from mo_logs import Log
+
+UNKNOWN_COST = 1000  # HUNKS WE ASSUME FOR A CHANGESET WHOSE DIFF WE HAVE NOT SEEN
+MERGE_COST = 1000000  # A MERGE AGAINST ITS FIRST PARENT; HG SHOWS EVERYTHING MERGED IN, SO WE DISCARD THOSE DIFFS
+
+
+class RevisionDag(object):
+    """
+    THE PARENT/CHILD GRAPH OF REVISIONS, WITH THE COST (ABOUT THE NUMBER OF
+    HUNKS) OF THE OPERATOR ON EACH EDGE, TO PLAN THE CHEAPEST PROJECTION
+    BETWEEN TWO REVISIONS
+
+    AN EDGE IS ONE CHANGESET AGAINST ONE OF ITS PARENTS; IT CAN BE WALKED IN
+    EITHER DIRECTION (BACKWARD COSTS THE SAME AS FORWARD).  A MERGE HAS ONE
+    EDGE PER PARENT:  THE EDGE TO ITS FIRST PARENT IS THE DIFF hg SHOWS, AND
+    COSTS MERGE_COST; THE EDGE TO ANY OTHER PARENT HAS NO DIFF WE CAN FETCH,
+    SO IT IS ONLY WALKED IF add_edge() WAS GIVEN ITS COST
+    """
+
+    def __init__(self):
+        self.ids = {}  # MAP FROM id12 TO FULL CHANGESET ID
+        self.parents = {}  # MAP FROM id12 TO LIST OF PARENT id12, FIRST PARENT FIRST
+        self.neighbors = {}  # MAP FROM id12 TO SET OF id12 OF PARENTS AND CHILDREN
+        self.edges = set()  # (parent id12, child id12) PAIRS
+        self.costs = {}  # MAP FROM (parent id12, child id12) TO COST
+
+    def add(self, revision):
+        """
+        :param revision: Revision WITH changeset.id, parents, children, AND (OPTIONAL) changeset.diff
+        """
+        changeset_id = revision.changeset.id
+        child = self._node(changeset_id)
+        parents = [self._node(p) for p in listwrap(revision.parents)]
+        self.parents[child] = parents
+        for parent in parents:
+            self._link(parent, child)
+        for grandchild in listwrap(revision.children):
+            self._link(child, self._node(grandchild))
+
+        if len(parents) == 1 and revision.changeset.diff:
+            self.costs.setdefault((parents[0], child), diff_cost(revision.changeset.diff))
+
+    def add_edge(self, parent_id, child_id, cost):
+        """
+        THE COST OF ONE CHANGESET AGAINST ONE PARENT (eg A MERGE AGAINST ITS SECOND PARENT)
+        """
+        parent, child = self._node(parent_id), self._node(child_id)
+        self._link(parent, child)
+        self.costs[(parent, child)] = cost
+
+    def cost(self, parent, child):
+        """
+        :return: COST OF THE EDGE, OR None IF IT CAN NOT BE WALKED
+        """
+        cost = self.costs.get((parent, child))
+        if cost is not None:
+            return cost
+        parents = self.parents.get(child, [])
+        if len(parents) > 1:
+            return MERGE_COST if parents[0] == parent else None
+        return UNKNOWN_COST
+
+    def plan(self, from_id, to_id):
+        """
+        DIJKSTRA, FROM THE COVERED REVISION TO THE TARGET
+        :param from_id: REVISION THE COVERAGE IS ON
+        :param to_id: REVISION TO PROJECT TO
+        :return: (COST, LIST OF (changeset_id, parent_id, backward)); APPLY THE DIFF OF
+                 changeset_id AGAINST parent_id, FROM new TO old IF backward, IN ORDER
+        """
+        start, end = from_id[:12], to_id[:12]
+        best = {start: 0}
+        previous = {}  # MAP FROM NODE TO (NODE BEFORE, parent, child)
+        heap = [(0, start)]
+        while heap:
+            total, node = heapq.heappop(heap)
+            if node == end:
+                break
+            if total > best[node]:
+                continue
+            for other in self.neighbors.get(node, ()):
+                parent, child = (node, other) if (node, other) in self.edges else (other, node)
+                cost = self.cost(parent, child)
+                if cost is None:
+                    continue
+                if total + cost < best.get(other, total + cost + 1):
+                    best[other] = total + cost
+                    previous[other] = (node, parent, child)
+                    heapq.heappush(heap, (total + cost, other))
+        else:
+            Log.error("no path from {{from_id|left(12)}} to {{to_id|left(12)}}", from_id=from_id, to_id=to_id)
+
+        steps = []
+        node = end
+        while node != start:
+            node, parent, child = previous[node]
+            steps.append((self.ids[child], self.ids[parent], child == node))
+        steps.reverse()
+        return best[end], steps
+
+    def _node(self, changeset_id):
+        node = changeset_id[:12]
+        if len(changeset_id) > len(self.ids.get(node, "")):
+            self.ids[node] = changeset_id
+        self.neighbors.setdefault(node, set())
+        return node
+
+    def _link(self, parent, child):
+        self.edges.add((parent, child))
+        self.neighbors[parent].add(child)
+        self.neighbors[child].add(parent)
+
+
+def diff_cost(diff):
+    """
+    :param diff: FROM mo_hg.parse.diff_to_json()
+    :return: ABOUT THE NUMBER OF HUNKS: THE RUNS OF CONSECUTIVE CHANGED LINES
+    """
+    cost = 0
+    for file in diff:
+        changes = file.changes
+        if changes == None:
+            cost += UNKNOWN_COST  # TOO BIG, ONLY THE NAME WAS KEPT
+            continue
+        skew = 0  # new LINE - old LINE, AT THIS POINT IN THE FILE
+        cursor = None  # (new, old) RIGHT AFTER THE PREVIOUS CHANGE
+        for change in changes:
+            if change.new.line != None:
+                new = change.new.line
+                old = new - skew
+                skew += 1
+                after = new + 1, old
+            else:
+                old = change.old.line
+                new = old + skew
+                skew -= 1
+                after = new, old + 1
+            if cursor != (new, old):
+                cost += 1
+            cursor = after
+    return cost
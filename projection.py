@@ -0,0 +1,111 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+from __future__ import division
+from __future__ import unicode_literals
+
+from bisect import bisect_left, insort
+
+from mo_logs import Log
+
+from coverage_vectors import union
+from operators import compose_changesets
+
+
+class CoverageMerge(object):
+    """
+    UNION OF MANY COVERAGE RUNS, EACH TAKEN ON ITS OWN REVISION, AS SEEN ON ONE target REVISION
+
+    EACH RUN IS PROJECTED TO THE target THROUGH THE CHANGESETS BETWEEN (FORWARD
+    FOR OLDER RUNS, BACKWARD FOR NEWER ONES; BOTH COST THE SAME, NOTHING IS
+    TRANSPOSED).  THE COMPOSED OPERATOR FROM EVERY
+    RUN'S REVISION TO THE target IS KEPT, SO THE NEXT RUN ONLY COMPOSES THE
+    CHANGESETS BETWEEN ITS REVISION AND THE NEAREST RUN ALREADY SEEN, AND THEN
+    COSTS ONE MORE PROJECTION.
+    """
+
+    def __init__(self, changesets, target):
+        """
+        :param changesets: LIST OF (changeset_id, {path: RunMap}) IN BRANCH ORDER (eg FROM parse.parse_changeset_to_matrix())
+                           CHANGESET i TAKES THE REVISION OF CHANGESET i-1 TO ITS OWN
+        :param target: THE changeset_id OF THE REVISION TO MERGE ON
+        """
+        self.changesets = [operators for _, operators in changesets]
+        self.index = {changeset_id[:12]: i for i, (changeset_id, _) in enumerate(changesets)}
+        self.target = self._position(target)
+        # MAP FROM POSITION TO {path: RunMap} BETWEEN THAT REVISION AND target, ALWAYS FROM THE OLDER TO THE NEWER
+        self.cache = {self.target: {}}
+        self.before = [self.target]  # SORTED POSITIONS IN cache, UP TO target
+        self.after = [self.target]  # SORTED POSITIONS IN cache, FROM target
+        self.coverage = None  # UNION OF ALL RUNS SO FAR, ON target
+        self.runs = 0
+
+    def add(self, revision_id, coverage):
+        """
+        :param revision_id: REVISION THE RUN WAS TAKEN ON
+        :param coverage: RevisionCoverage OF THE RUN
+        :return: RevisionCoverage OF ALL RUNS SO FAR, ON THE target
+        """
+        return self.merge([(revision_id, coverage)])
+
+    def merge(self, runs):
+        """
+        PROJECT ALL runs, AND UNION THEM (WITH THE RUNS ALREADY ADDED) IN ONE BATCH
+        :param runs: LIST OF (revision_id, RevisionCoverage)
+        :return: RevisionCoverage OF ALL RUNS SO FAR, ON THE target
+        """
+        projected = [self.project(revision_id, coverage) for revision_id, coverage in runs]
+        if self.coverage is not None:
+            projected.append(self.coverage)
+        self.coverage = union(projected)
+        self.runs += len(runs)
+        return self.coverage
+
+    def project(self, revision_id, coverage):
+        """
+        :return: coverage, TAKEN ON revision_id, AS SEEN ON THE target
+        """
+        operators, backward = self.operators(revision_id)
+        return coverage.project(operators, backward=backward)
+
+    def operators(self, revision_id):
+        """
+        :return: (MAP FROM PATH TO RunMap, backward) TAKING revision_id TO THE target;
+                 backward IS True WHEN revision_id IS AFTER THE target, AND THE
+                 OPERATORS MUST BE APPLIED FROM new TO old
+        """
+        position = self._position(revision_id)
+        backward = position > self.target
+        operators = self.cache.get(position)
+        if operators is not None:
+            return operators, backward
+
+        if position < self.target:
+            # COMPOSE FORWARD TO THE NEAREST CACHED REVISION AFTER position
+            nearest = self.before[bisect_left(self.before, position)]
+            operators = {}
+            for p in range(position + 1, nearest + 1):
+                operators = compose_changesets(operators, self.changesets[p])
+            operators = compose_changesets(operators, self.cache[nearest])
+            insort(self.before, position)
+        else:
+            # COMPOSE target TO position, FROM THE NEAREST CACHED REVISION BEFORE position
+            nearest = self.after[bisect_left(self.after, position) - 1]
+            operators = self.cache[nearest]
+            for p in range(nearest + 1, position + 1):
+                operators = compose_changesets(operators, self.changesets[p])
+            insort(self.after, position)
+
+        self.cache[position] = operators
+        return operators, backward
+
+    def _position(self, revision_id):
+        position = self.index.get(revision_id[:12])
+        if position is None:
+            Log.error("revision {{revision|left(12)}} is not in the changesets given", revision=revision_id)
+        return position
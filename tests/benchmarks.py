@@ -0,0 +1,193 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+# RUN FROM THE PROJECT DIRECTORY WITH
+#
+#     python -m tests.benchmarks
+#
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import random
+from timeit import default_timer
+
+import numpy as np
+from mo_files import File
+from mo_json import json2value, value2json
+from mo_logs import Log
+
+from coverage_vectors import RevisionCoverage
+from mo_hg.parse import diff_to_json, diff_to_binary, binary_to_diff
+from parse import FILE_SEP, HUNK_SEP, _file_path, _hunk_header, _parse_diff, _parse_diff_by_line
+from tests.util import random_operator
+from tree_projection import TreeProjector
+
+REPEAT = 20
+
+# THE ORIGINAL PARSER MOVED A NUMPY COORDINATE ONE LINE AT A TIME
+MOVE = {
+    " ": np.array([1, 1], dtype=int),
+    "\\": np.array([0, 0], dtype=int),
+    "+": np.array([1, 0], dtype=int),
+    "-": np.array([0, 1], dtype=int)
+}
+
+
+def _time(func, *args):
+    """
+    :return: BEST SECONDS PER CALL, OVER REPEAT CALLS
+    """
+    best = None
+    for _ in range(REPEAT):
+        start = default_timer()
+        func(*args)
+        duration = default_timer() - start
+        if best is None or duration < best:
+            best = duration
+    return best
+
+
+def _parse_diff_by_coordinate(changeset, new_lengths):
+    """
+    THE PARSER THIS PROJECT STARTED WITH: ONE (new, old) COORDINATE FOR EVERY
+    UNCHANGED LINE, WALKED ONE LINE AT A TIME, TO THE END OF EACH FILE.
+    ONLY CHANGE: EACH HUNK STOPS WHEN BOTH SIDES ARE CONSUMED, SO IT CAN READ big.patch
+    :param new_lengths: MAP FROM PATH TO LENGTH OF THE FILE AFTER THE CHANGESET
+    :return: MAP FROM PATH TO LIST OF COORDINATES
+    """
+    output = {}
+    for file in FILE_SEP.split(changeset)[1:]:
+        file_header_a, file_header_b, file_diff = file.split("\n", 2)
+        file_path = _file_path(file_header_a, file_header_b)
+
+        coord = []
+        c = np.array([0, 0], dtype=int)
+        for hunk in HUNK_SEP.split(file_diff)[1:]:
+            line_diffs = hunk.split("\n")
+            old_start, old_length, new_start, new_length = _hunk_header(line_diffs[0])
+            while c[0] != new_start:
+                coord.append(np.copy(c))
+                c += MOVE[" "]
+            new_end, old_end = new_start + new_length, old_start + old_length
+            for line in line_diffs[1:]:
+                if c[0] >= new_end and c[1] >= old_end:
+                    break
+                if not line:
+                    continue
+                if line[0] == " ":
+                    coord.append(np.copy(c))
+                c += MOVE[line[0]]
+
+        while c[0] < new_lengths[file_path]:
+            coord.append(np.copy(c))
+            c += MOVE[" "]
+        output[file_path] = coord
+    return output
+
+
+def benchmark_parse():
+    """
+    "original" IS THE PARSER THIS PROJECT STARTED WITH; "one line at a time" IS
+    THE RunMap WALKER THAT REPLACED IT; "vectorized" IS WHAT parse.py USES NOW
+    """
+    diff = File("tests/resources/big.patch").read()
+    num_lines = diff.count("\n")
+    # THE ORIGINAL ALSO WALKED THE UNCHANGED LINES AFTER THE LAST HUNK; WE DO NOT
+    # HAVE THE FILES, SO ASSUME EACH IS 1000 LINES LONGER THAN ITS LAST HUNK
+    new_lengths = {path: operator.tail_new + 1000 for path, operator in _parse_diff(diff).items()}
+    for name, parser, args in [
+        ("original", _parse_diff_by_coordinate, (diff, new_lengths)),
+        ("one line at a time", _parse_diff_by_line, (diff,)),
+        ("vectorized", _parse_diff, (diff,))
+    ]:
+        duration = _time(parser, *args)
+        Log.note(
+            "parse big.patch {{name}}: {{rate|comma}} lines per second ({{duration|round(places=3)}} seconds)",
+            name=name,
+            rate=int(num_lines / duration),
+            duration=duration
+        )
+
+
+def benchmark_binary_diff():
+    """
+    SIZE AND DECODE TIME OF big.patch AS JSON (AS STORED IN ES) AND AS diff_to_binary()
+    """
+    diff = diff_to_json(File("tests/resources/big.patch").read())
+    as_json = value2json(diff)
+    as_binary = diff_to_binary(diff)
+    for name, size, decode, arg in [
+        ("json", len(as_json.encode("utf8")), lambda j: json2value(j, leaves=False), as_json),
+        ("binary", len(as_binary), binary_to_diff, as_binary)
+    ]:
+        duration = _time(decode, arg)
+        Log.note(
+            "big.patch as {{name}}: {{size|comma}} bytes, decoded in {{duration|round(places=3)}} seconds",
+            name=name,
+            size=size,
+            duration=duration
+        )
+
+
+def benchmark_projection(num_files=20000, lines_per_file=100, num_touched=300):
+    """
+    PROJECT A WHOLE REVISION OF COVERAGE (num_files * lines_per_file LINES) THROUGH ONE CHANGESET
+    """
+    rand = random.Random(42)
+    paths = ["/file" + str(i) + ".cpp" for i in range(num_files)]
+    coverage = RevisionCoverage.from_files({p: np.random.rand(lines_per_file) < 0.3 for p in paths})
+    operators = {p: random_operator(lines_per_file, rand)[0] for p in rand.sample(paths, num_touched)}
+
+    projected = coverage.project(operators)
+    for direction, start, backward in [("forward", coverage, False), ("backward", projected, True)]:
+        duration = _time(start.project, operators, backward)
+        Log.note(
+            "project {{lines|comma}} lines ({{bytes|comma}} bytes) {{direction}} through {{touched}} files: {{duration|round(places=4)}} seconds",
+            lines=coverage.length,
+            bytes=coverage.bits.nbytes,
+            direction=direction,
+            touched=num_touched,
+            duration=duration
+        )
+
+
+def benchmark_tree_projection(num_files=20000, lines_per_file=100, num_touched=3000):
+    """
+    PROJECT A WHOLE REVISION THROUGH A BIG CHANGESET RANGE, WITH ONE PROCESS, AND WITH ONE PER CORE
+    """
+    rand = random.Random(42)
+    paths = ["/file" + str(i) + ".cpp" for i in range(num_files)]
+    coverage = RevisionCoverage.from_files({p: np.random.rand(lines_per_file) < 0.3 for p in paths})
+    operators = {p: random_operator(lines_per_file, rand)[0] for p in rand.sample(paths, num_touched)}
+
+    for processes in sorted({1, TreeProjector().processes}):
+        projector = TreeProjector(processes)
+        projector.project(coverage, operators)
+        Log.note(
+            "project tree of {{lines|comma}} lines with {{processes}} processes: {{rate|comma}} lines per second per core ({{seconds|round(places=3)}} seconds)",
+            lines=projector.stats.lines,
+            processes=processes,
+            rate=int(projector.stats.lines_per_second_per_core),
+            seconds=projector.stats.seconds
+        )
+
+
+def main():
+    Log.start()
+    try:
+        benchmark_parse()
+        benchmark_binary_diff()
+        benchmark_projection()
+        benchmark_tree_projection()
+    finally:
+        Log.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -10,6 +10,9 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import unicode_literals
 
+import shutil
+import tempfile
+
 import numpy as np
 from mo_dots import wrap
 from mo_files import File
@@ -17,9 +20,13 @@ from mo_json import value2json
 from mo_logs import constants, Log, startup
 from mo_testing.fuzzytestcase import FuzzyTestCase
 
+from coverage_vectors import RevisionCoverage
+from metrics import file_metrics, push_metrics
+from mo_hg.diff_index import DiffIndex
 from mo_hg.hg_mozilla_org import HgMozillaOrg
-from mo_hg.parse import diff_to_json
-from parse import parse_diff_to_matrix
+from mo_hg.parse import diff_to_json, diff_to_json_stream, bytes_to_lines, diff_to_binary, binary_to_diff
+from operators import RunMap
+from parse import parse_diff_to_matrix, parse_diff_files, _parse_diff, _parse_diff_by_line, _new_file_names
 
 
 class TestParsing(FuzzyTestCase):
@@ -40,19 +47,21 @@ class TestParsing(FuzzyTestCase):
     def setUp(self):
         self.hg = HgMozillaOrg(TestParsing.config)
 
-    def _get_test_data(self):
+    def _get_test_data(self, dense=True):
         file1 = File("tests/resources/example_file_v1.py").read().split('\n')
         file2 = File("tests/resources/example_file_v2.py").read().split('\n')
         file3 = File("tests/resources/example_file_v3.py").read().split('\n')
 
         c1 = parse_diff_to_matrix(
             diff=File("tests/resources/diff1.patch").read(),
-            new_source_code=file2
+            new_source_code=file2,
+            dense=dense
         )["/tests/resources/example_file.py"]
 
         c2 = parse_diff_to_matrix(
             diff=File("tests/resources/diff2.patch").read(),
-            new_source_code=file3
+            new_source_code=file3,
+            dense=dense
         )["/tests/resources/example_file.py"]
 
         # file1 -> c1 -> file2 -> c2 -> file3
@@ -70,6 +79,125 @@ class TestParsing(FuzzyTestCase):
         self.assertEqual(coverage2.tolist(), [[1, 1, 0, 1, 1, 0, 0, 1, 1, 1, 0, 0]])
         self.assertEqual(coverage3.tolist(), [[1, 1, 0, 1, 1, 0, 0, 0, 0]])
 
+    def test_parse_operator(self):
+        file1, c1, file2, c2, file3 = self._get_test_data(dense=False)
+
+        coverage2 = np.array([1, 1, 0, 1, 1, 0, 0, 1, 1, 1, 0, 0], dtype=int)
+
+        coverage1 = c1.T.apply(coverage2)
+        coverage3 = c2.apply(coverage2)
+
+        self.assertEqual(coverage1.tolist(), [1, 1, 0, 1,       0, 1, 1, 1, 0, 0])
+        self.assertEqual(coverage3.tolist(), [1, 1, 0, 1, 1, 0, 0, 0, 0])
+
+    def test_operator_matches_matrix(self):
+        file1, c1, file2, c2, file3 = self._get_test_data(dense=False)
+        file1, m1, file2, m2, file3 = self._get_test_data(dense=True)
+
+        self.assertEqual(c1.to_matrix(new_length=len(file2)).tolist(), m1.tolist())
+        self.assertEqual(c2.to_matrix(new_length=len(file3)).tolist(), m2.tolist())
+
+    def test_dense_with_file_lengths(self):
+        file1, m1, file2, m2, file3 = self._get_test_data(dense=True)
+        c1 = parse_diff_to_matrix(
+            diff=File("tests/resources/diff1.patch").read(),
+            dense=True,
+            file_lengths={"/tests/resources/example_file.py": len(file2)}
+        )["/tests/resources/example_file.py"]
+
+        self.assertEqual(c1.tolist(), m1.tolist())
+
+    def test_dense_rename_and_delete(self):
+        diff = (
+            "diff --git a/old_name.py b/new_name.py\n"
+            "--- a/old_name.py\n"
+            "+++ b/new_name.py\n"
+            "@@ -1,2 +1,3 @@\n"
+            " a\n"
+            "+b\n"
+            " c\n"
+            "diff --git a/gone.py b/gone.py\n"
+            "--- a/gone.py\n"
+            "+++ /dev/null\n"
+            "@@ -1,2 +0,0 @@\n"
+            "-x\n"
+            "-y\n"
+        )
+        new_names = _new_file_names(diff.encode("utf8"))
+        self.assertEqual(new_names, {"/old_name.py": "/new_name.py", "/gone.py": None})
+        self.assertEqual(set(new_names.keys()), set(_parse_diff(diff).keys()))
+
+        hg_lengths = {"/new_name.py": 3}  # WHAT hg.get_file_lengths() WOULD RETURN
+        file_lengths = {path: 0 if name is None else hg_lengths[name] for path, name in new_names.items()}
+        matrices = parse_diff_to_matrix(diff, dense=True, file_lengths=file_lengths)
+        self.assertEqual(matrices["/old_name.py"].shape, (2, 3))
+        self.assertEqual(matrices["/gone.py"].shape, (2, 0))
+
+    def test_diff_files_by_either_name(self):
+        diff = (
+            "diff --git a/old_name.py b/new_name.py\n"
+            "--- a/old_name.py\n"
+            "+++ b/new_name.py\n"
+            "@@ -1,2 +1,3 @@\n"
+            " a\n"
+            "+b\n"
+            " c\n"
+        ).encode("utf8")
+        expected = _parse_diff(diff)["/old_name.py"]
+        for path in ["/new_name.py", "/old_name.py"]:
+            operators = parse_diff_files(diff, [path])
+            self.assertEqual(list(operators.keys()), [path])
+            self.assertTrue(operators[path] == expected)
+
+    def test_removed_line_looks_like_file_header(self):
+        # REMOVING "-- comment" FROM A SQL FILE GIVES A "--- comment" DIFF LINE
+        diff = (
+            "diff --git a/q.sql b/q.sql\n"
+            "--- a/q.sql\n"
+            "+++ b/q.sql\n"
+            "@@ -1,3 +1,2 @@\n"
+            " select 1;\n"
+            "--- comment\n"
+            " select 2;\n"
+            "@@ -10,2 +9,1 @@\n"
+            " select 10;\n"
+            "--- a/other.sql\n"
+        )
+        expected = _parse_diff(diff.replace("--- comment", "-x comment").replace("--- a/other", "-x a/other").encode("utf8"))
+        result = _parse_diff(diff.encode("utf8"))
+        self.assertEqual(list(result.keys()), ["/q.sql"])
+        self.assertTrue(result["/q.sql"] == expected["/q.sql"])
+        self.assertEqual(list(zip(result["/q.sql"].new_start.tolist(), result["/q.sql"].old_start.tolist(), result["/q.sql"].length.tolist())), [(0, 0, 1), (1, 2, 8)])
+
+    def test_operator_runs(self):
+        file1, c1, file2, c2, file3 = self._get_test_data(dense=False)
+
+        # (new_start, old_start, length) OF THE UNCHANGED LINES, AND THE OPEN-ENDED tail
+        self.assertEqual(list(zip(c1.new_start.tolist(), c1.old_start.tolist(), c1.length.tolist())), [(0, 0, 4), (5, 4, 1)])
+        self.assertEqual((c1.tail_new, c1.tail_old), (7, 5))
+        self.assertEqual(list(zip(c2.new_start.tolist(), c2.old_start.tolist(), c2.length.tolist())), [(0, 0, 7)])
+        self.assertEqual((c2.tail_new, c2.tail_old), (8, 11))
+
+    def test_compose_operators(self):
+        file1, c1, file2, c2, file3 = self._get_test_data(dense=False)
+
+        coverage1 = np.array([1, 1, 0, 1, 0, 1, 1, 1, 0, 0], dtype=int)
+        coverage3 = (c1 * c2).apply(coverage1)
+
+        self.assertEqual(coverage3.tolist(), c2.apply(c1.apply(coverage1)).tolist())
+        self.assertEqual((c1 * c2).T.apply(coverage3).tolist(), c1.T.apply(c2.T.apply(coverage3)).tolist())
+
+    def test_operator_on_long_file(self):
+        file1, c1, file2, c2, file3 = self._get_test_data(dense=False)
+
+        # THE OPERATOR DOES NOT DEPEND ON THE FILE LENGTH
+        coverage2 = np.zeros(50000, dtype=bool)
+        coverage2[-1] = True
+        coverage1 = c1.T.apply(coverage2)
+
+        self.assertEqual(len(coverage1), 50000 - 2)
+        self.assertEqual(coverage1[-1], True)
+
     def test_diff_to_json(self):
         j1 = diff_to_json(File("tests/resources/diff1.patch").read())
         j2 = diff_to_json(File("tests/resources/diff2.patch").read())
@@ -84,6 +212,76 @@ class TestParsing(FuzzyTestCase):
         expected = File("tests/resources/big.json").read_json(flexible=False, leaves=False)
         self.assertEqual(j1, expected)
 
+    def test_streaming_diff_to_json(self):
+        content = File("tests/resources/big.patch").read_bytes()
+        chunks = (content[i:i + 1000] for i in range(0, len(content), 1000))
+
+        j1 = wrap(list(diff_to_json_stream(bytes_to_lines(chunks))))
+        expected = diff_to_json(content.decode("utf8"))
+        self.assertEqual(j1, expected)
+
+    def test_binary_diff_round_trip(self):
+        for name in ["diff1.json", "diff2.json", "big.json"]:
+            content = File("tests/resources/" + name).read()
+            expected = File("tests/resources/" + name).read_json(flexible=False, leaves=False)
+            binary = diff_to_binary(expected)
+            self.assertLess(len(binary), len(content))
+            self.assertEqual(binary_to_diff(binary), expected)
+
+    def test_binary_diff_without_changes(self):
+        diff = diff_to_json(File("tests/resources/diff2.patch").read())
+        diff[0].changes = None
+        result = binary_to_diff(diff_to_binary(diff))
+        self.assertEqual(result[0].new.name, "/tests/resources/example_file.py")
+        self.assertEqual(result[0].changes, None)
+
+    def test_vectorized_parse(self):
+        for name in ["diff1.patch", "diff2.patch", "big.patch"]:
+            diff = File("tests/resources/" + name).read()
+            expected = _parse_diff_by_line(diff)
+            result = _parse_diff(diff)
+            self.assertEqual(sorted(result.keys()), sorted(expected.keys()))
+            for path, operator in expected.items():
+                self.assertTrue(result[path] == operator, path)
+
+    def test_diff_index(self):
+        content = File("tests/resources/big.patch").read_bytes()
+        index = DiffIndex.scan(content)
+        paths = ["/.clang-format-ignore", "/accessible/base/SelectionManager.h", "/not/in/diff.txt"]
+
+        everything = diff_to_json(content.decode("utf8"))
+        self.assertEqual(len(index.paths), len(everything))
+        self.assertEqual(
+            index.diff_to_json(content, paths),
+            [f for f in everything if f.new.name in paths]
+        )
+
+        operators = parse_diff_to_matrix(content.decode("utf8"))
+        some = parse_diff_files(content, paths, index)
+        self.assertEqual(sorted(some.keys()), sorted(paths[:2]))
+        for path, operator in some.items():
+            self.assertTrue(operator == operators[path])
+
+    def test_diff_index_round_trip(self):
+        content = File("tests/resources/big.patch").read_bytes()
+        index = DiffIndex.scan(content)
+        self.assertEqual(DiffIndex.from_value(wrap(index.to_value())).files, index.files)
+
+    def test_diff_index_cache_is_checked(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filename = File.new_instance(directory, "changeset.patch").abs_path
+            diff1 = File("tests/resources/diff1.patch").read_bytes()
+            File(filename).write_bytes(diff1)
+            self.assertEqual(DiffIndex.for_file(filename).files, DiffIndex.scan(diff1).files)
+
+            # SAME NAME, DIFFERENT DIFF: THE CACHED INDEX MUST NOT BE USED
+            big = File("tests/resources/big.patch").read_bytes()
+            File(filename).write_bytes(big)
+            self.assertEqual(DiffIndex.for_file(filename).files, DiffIndex.scan(big).files)
+        finally:
+            shutil.rmtree(directory)
+
     def test_changeset_to_json(self):
         j1 = self.hg.get_revision(
             wrap({
@@ -96,6 +294,21 @@ class TestParsing(FuzzyTestCase):
         expected = File("tests/resources/big.json").read_json(flexible=False, leaves=False)
         self.assertEqual(j1.changeset.diff, expected)
 
+    def test_get_revisions(self):
+        branch = {"name": "mozilla-central", "url": "https://hg.mozilla.org/mozilla-central"}
+        revisions = self.hg.get_revisions(
+            [
+                wrap({"branch": branch, "changeset": {"id": "e5693cea1ec944ca0"}}),
+                wrap({"branch": branch, "changeset": {"id": None}})
+            ],
+            None,  # Locale
+            True   # get_diff
+        )
+        self.assertEqual(len(revisions), 2)
+        self.assertEqual(revisions[0].changeset.id12, "e5693cea1ec9")
+        self.assertEqual(revisions[0].changeset.diff, File("tests/resources/big.json").read_json(flexible=False, leaves=False))
+        self.assertEqual(revisions[1], None)
+
     def test_net_new_lines(self):
         file1, c1, file2, c2, file3 = self._get_test_data()
 
@@ -104,6 +317,13 @@ class TestParsing(FuzzyTestCase):
 
         self.assertEqual(net_new_lines.tolist(), [0, 0, 0, 0, 1, 0, 1, 0, 0, 0, 0, 0])
 
+    def test_net_new_lines_operator(self):
+        file1, c1, file2, c2, file3 = self._get_test_data(dense=False)
+
+        net_new_lines = c1.net_new_lines(len(file2))
+
+        self.assertEqual(net_new_lines.astype(int).tolist(), [0, 0, 0, 0, 1, 0, 1, 0, 0, 0, 0, 0])
+
     def test_net_new_percent(self):
         file1, c1, file2, c2, file3 = self._get_test_data()
 
@@ -133,4 +353,34 @@ class TestParsing(FuzzyTestCase):
         net_new_percent = num_net_new_lines_covered / np.sum(net_new_lines2)
         self.assertEqual(net_new_percent, 1)
 
+    def test_net_new_percent_metrics(self):
+        file1, c1, file2, c2, file3 = self._get_test_data(dense=False)
+
+        coverage2 = np.array([1, 1, 0, 1, 1, 0, 0, 1, 1, 1, 0, 0], dtype=bool)
+        metrics = file_metrics("/tests/resources/example_file.py", c1, coverage2)
+        self.assertEqual(metrics, {"net_new_lines": 2, "net_new_covered": 1, "net_new_percent": 0.5})
+
+    def test_push_metrics(self):
+        file1, c1, file2, c2, file3 = self._get_test_data(dense=False)
+        path = "/tests/resources/example_file.py"
+
+        coverage3 = RevisionCoverage.from_files({path: np.ones(len(file3), dtype=bool)})
+        metrics = push_metrics([("c1", {path: c1}), ("c2", {path: c2})], coverage3)
+
+        self.assertEqual(metrics, [
+            {"changeset": "c1", "net_new_lines": 2, "net_new_covered": 2, "net_new_percent": 1},
+            {"changeset": "c2", "net_new_lines": 1, "net_new_covered": 1, "net_new_percent": 1}
+        ])
+
+    def test_push_metrics_with_uncovered_file(self):
+        file1, c1, file2, c2, file3 = self._get_test_data(dense=False)
+        path = "/tests/resources/example_file.py"
+        readme = RunMap([0], [0], [3], 5, 4)  # NOT IN THE COVERAGE
+
+        coverage3 = RevisionCoverage.from_files({path: np.ones(len(file3), dtype=bool)})
+        metrics = push_metrics([("c1", {path: c1, "/README.md": readme}), ("c2", {path: c2})], coverage3)
+
+        self.assertEqual(metrics[0], {"changeset": "c1", "net_new_lines": 4, "net_new_covered": 2, "net_new_percent": 1})
+        self.assertEqual(metrics[0].files[0], {"path": "/README.md", "net_new_lines": 2, "net_new_covered": None})
+
 
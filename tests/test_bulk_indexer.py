@@ -0,0 +1,94 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+from mo_json import json2value
+from mo_testing.fuzzytestcase import FuzzyTestCase
+from mo_threads import Signal, Thread, Till
+from mo_times.durations import SECOND, DAY
+
+from mo_hg.bulk_indexer import BulkIndexer
+
+
+class Index(object):
+    """
+    RECORDS EVERY _bulk REQUEST
+    """
+
+    def __init__(self, wait=None):
+        self.batches = []
+        self.wait = wait  # Signal TO WAIT ON BEFORE ACCEPTING A BATCH
+
+    def extend(self, records):
+        if self.wait is not None:
+            self.wait.wait()
+        self.batches.append([(r["id"], json2value(r["json"], leaves=False)) for r in records])
+
+
+class TestBulkIndexer(FuzzyTestCase):
+
+    def test_batch_by_count(self):
+        index = Index()
+        indexer = BulkIndexer(index, batch_size=3, period=DAY)
+        for i in range(7):
+            indexer.add({"id": i, "value": {"a": i}})
+        indexer.stop()
+        self.assertEqual([len(b) for b in index.batches], [3, 3, 1])
+        self.assertEqual(indexer.stats, {"added": 7, "batches": 3, "sent": 7, "failures": 0})
+
+    def test_batch_by_time(self):
+        index = Index()
+        indexer = BulkIndexer(index, period=0.1 * SECOND)
+        indexer.add({"id": 1, "value": {"a": 1}})
+        Till(seconds=1).wait()
+        self.assertEqual(index.batches, [[(1, {"a": 1})]])
+        self.assertEqual(indexer.depth, 0)
+        indexer.stop()
+
+    def test_batch_by_bytes(self):
+        index = Index()
+        indexer = BulkIndexer(index, batch_bytes=25, period=DAY)
+        for i in range(4):
+            indexer.add({"id": i, "value": {"text": "0123456789"}})
+        indexer.stop()
+        self.assertEqual([len(b) for b in index.batches], [2, 2])
+
+    def test_dedupe_and_snapshot(self):
+        index = Index()
+        indexer = BulkIndexer(index, period=DAY)
+        document = {"a": 1}
+        indexer.add({"id": "x", "value": document})
+        document["a"] = 2  # CHANGED AFTER add(); THE FIRST ONE IS STILL {"a": 1}
+        indexer.add({"id": "y", "value": document})
+        indexer.add({"id": "x", "value": {"a": 3}})
+        indexer.stop()
+        self.assertEqual(index.batches, [[("y", {"a": 2}), ("x", {"a": 3})]])
+        self.assertEqual(indexer.stats.duplicates, 1)
+
+    def test_backpressure(self):
+        go = Signal()
+        index = Index(wait=go)
+        indexer = BulkIndexer(index, batch_size=1, period=DAY, max_size=2)
+        done = Signal()
+
+        def add_many(please_stop):
+            for i in range(6):
+                indexer.add({"id": i, "value": {"a": i}})
+            done.go()
+
+        thread = Thread.run("add many", add_many)
+        Till(seconds=0.5).wait()
+        self.assertFalse(done)  # WAITING ON A FULL QUEUE
+        self.assertGreaterEqual(indexer.depth, 2)
+        go.go()
+        thread.join()
+        indexer.stop()
+        self.assertEqual(sorted(b[0][0] for b in index.batches), list(range(6)))
@@ -0,0 +1,122 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+from mo_dots import Data
+from mo_testing.fuzzytestcase import FuzzyTestCase
+from mo_threads import Thread, Till
+from mo_times.durations import SECOND
+
+from mo_hg.cache import LruCache, cached, estimate_size
+
+
+class Hg(object):
+    """
+    COUNTS THE CALLS THAT GET PAST THE CACHE
+    """
+
+    def __init__(self):
+        self.caches = {"metadata": LruCache("metadata", 10000), "diff": LruCache("diff", 10000)}
+        self.calls = 0
+
+    @cached(lambda name, get_diff=False: "diff" if get_diff else "metadata")
+    def get(self, name, get_diff=False):
+        self.calls += 1
+        return {"name": name, "diff": "x" * 100 if get_diff else None}
+
+    def get_many(self, names):
+        """
+        SHARES THE ENTRIES OF get()
+        """
+        output = []
+        for name in names:
+            cache, key = Hg.get.locate(self, name)
+            found, value = cache.get(key)
+            if not found:
+                self.calls += 1
+                value = {"name": name, "diff": None}
+                cache.set(key, value)
+            output.append(value)
+        return output
+
+    @cached("metadata", lock=True)
+    def slow(self, name):
+        self.calls += 1
+        Till(seconds=0.3).wait()
+        return name
+
+
+class TestCache(FuzzyTestCase):
+
+    def test_evict_least_recently_used(self):
+        cache = LruCache("test", 3 * estimate_size("aaaa"))
+        cache.set("a", "aaaa")
+        cache.set("b", "bbbb")
+        cache.set("c", "cccc")
+        self.assertEqual(cache.get("a"), (True, "aaaa"))  # NOW b IS THE OLDEST
+        cache.set("d", "dddd")
+        self.assertEqual(cache.get("b"), (False, None))
+        self.assertEqual(cache.get("c"), (True, "cccc"))
+        self.assertEqual(cache.stats, {"items": 3, "bytes": 3 * estimate_size("aaaa"), "hits": 2, "misses": 1, "evictions": 1})
+
+    def test_too_big(self):
+        cache = LruCache("test", 10)
+        cache.set("a", "a" * 100)
+        self.assertEqual(cache.get("a"), (False, None))
+        self.assertEqual(cache.stats.bytes, 0)
+
+    def test_expire(self):
+        cache = LruCache("test", 1000)
+        cache.set("a", "aaaa", duration=0.2 * SECOND)
+        self.assertEqual(cache.get("a"), (True, "aaaa"))
+        Till(seconds=1.2).wait()
+        self.assertEqual(cache.get("a"), (False, None))
+        self.assertEqual(cache.stats, {"items": 0, "bytes": 0, "expirations": 1})
+
+    def test_separate_budgets(self):
+        hg = Hg()
+        hg.get("a")
+        hg.get("a")
+        hg.get("a", get_diff=True)
+        self.assertEqual(hg.calls, 2)
+        self.assertEqual(hg.caches["metadata"].stats, {"items": 1, "hits": 1, "misses": 1})
+        self.assertEqual(hg.caches["diff"].stats, {"items": 1, "hits": 0, "misses": 1})
+        self.assertGreater(hg.caches["diff"].bytes, 100)
+
+    def test_compute_once(self):
+        hg = Hg()
+        threads = [Thread.run("slow " + str(i), lambda please_stop: hg.slow("a")) for i in range(4)]
+        self.assertEqual([t.join() for t in threads], ["a"] * 4)
+        self.assertEqual(hg.calls, 1)
+        self.assertEqual(hg.caches["metadata"].pending, {})
+
+    def test_same_key_however_called(self):
+        hg = Hg()
+        hg.get("a")
+        hg.get("a", False)
+        hg.get("a", get_diff=False)
+        hg.get(name="a")
+        self.assertEqual(hg.calls, 1)
+        hg.get(Data(branch={"name": "b"}, changeset={"id": "c"}))
+        hg.get({"changeset": {"id": "c"}, "branch": {"name": "b"}})
+        self.assertEqual(hg.calls, 2)
+
+    def test_size_of_long_list(self):
+        changes = [{"new": {"line": i, "content": "line " + str(i)}} for i in range(10000)]
+        exact = sum(estimate_size(c) for c in changes)
+        self.assertAlmostEqual(estimate_size(Data(changes=changes)), exact, delta=exact * 0.1)
+
+    def test_share_entries(self):
+        hg = Hg()
+        hg.get("a")
+        self.assertEqual([r["name"] for r in hg.get_many(["a", "b"])], ["a", "b"])
+        hg.get(name="b", get_diff=False)
+        self.assertEqual(hg.calls, 2)
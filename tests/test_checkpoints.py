@@ -0,0 +1,106 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import random
+import shutil
+import tempfile
+
+import numpy as np
+from mo_dots import Data
+from mo_testing.fuzzytestcase import FuzzyTestCase
+
+from checkpoints import CheckpointTree
+from operators import compose
+from tests.util import random_operator
+
+FILE = "/dom/base/nsDocument.cpp"
+
+
+class TestCheckpoints(FuzzyTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.rand = random.Random(42)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _random_history(self, num):
+        length = 200
+        lengths = [length]
+        operators = []
+        for i in range(num):
+            operator, length = random_operator(length, self.rand)
+            operators.append(operator)
+            lengths.append(length)
+        return operators, lengths
+
+    def test_compose_is_sequential_apply(self):
+        operators, lengths = self._random_history(3)
+        a, b, c = operators
+        coverage = np.arange(1, lengths[0] + 1)
+
+        expected = c.apply(b.apply(a.apply(coverage)))
+        self.assertEqual(compose(compose(a, b), c).apply(coverage).tolist(), expected.tolist())
+        self.assertEqual(compose(a, compose(b, c)).apply(coverage).tolist(), expected.tolist())
+        self.assertEqual((a * b * c).transpose().apply(expected).tolist(), a.T.apply(b.T.apply(c.T.apply(expected))).tolist())
+
+    def test_project_range(self):
+        operators, lengths = self._random_history(37)
+        branch = Data(name="mozilla-central")
+        tree = CheckpointTree(self.directory, branch)
+        tree.append("base", {})
+        for i, operator in enumerate(operators):
+            tree.append("c" + str(i), {FILE: operator, "/README": operator})
+
+        # REOPEN FROM DISK
+        tree = CheckpointTree(self.directory, branch)
+        ids = ["base"] + ["c" + str(i) for i in range(len(operators))]
+
+        for start, end in [(0, 37), (3, 29), (16, 32), (5, 6), (36, 37)]:
+            coverage = np.arange(1, lengths[start] + 1)
+            expected = coverage
+            for operator in operators[start:end]:
+                expected = operator.apply(expected)
+            self.assertEqual(tree.project(FILE, coverage, ids[start], ids[end]).tolist(), expected.tolist())
+
+            # BACKWARD
+            backward = expected
+            for operator in reversed(operators[start:end]):
+                backward = operator.transpose().apply(backward)
+            self.assertEqual(tree.project(FILE, expected, ids[end], ids[start]).tolist(), backward.tolist())
+
+    def test_untouched_file(self):
+        tree = CheckpointTree(self.directory, Data(name="mozilla-central"))
+        tree.append("base", {})
+        operator, _ = random_operator(100, self.rand)
+        tree.append("c1", {FILE: operator})
+        tree.append("c2", {})
+
+        coverage = np.ones(100, dtype=bool)
+        self.assertEqual(tree.project("/other/file.js", coverage, "base", "c2").tolist(), coverage.tolist())
+
+    def test_decoded_blocks_are_cached(self):
+        operators, lengths = self._random_history(8)
+        branch = Data(name="mozilla-central")
+        tree = CheckpointTree(self.directory, branch)
+        tree.append("base", {})
+        for i, operator in enumerate(operators):
+            tree.append("c" + str(i), {FILE: operator, "/README": operator})
+
+        tree = CheckpointTree(self.directory, branch)
+        coverage = np.arange(1, lengths[0] + 1)
+        expected = tree.project(FILE, coverage, "base", "c7")
+
+        # THE SECOND QUERY DOES NOT TOUCH THE DISK
+        shutil.rmtree(tree.directory.os_path)
+        self.assertEqual(tree.project(FILE, coverage, "base", "c7").tolist(), expected.tolist())
@@ -0,0 +1,73 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+from mo_testing.fuzzytestcase import FuzzyTestCase
+from mo_threads import Lock, Thread, Till
+
+from mo_hg.client_pool import ClientPool
+
+
+class Client(object):
+    """
+    COMPLAINS IF TWO THREADS USE IT AT ONCE
+    """
+
+    def __init__(self):
+        self.locker = Lock()
+        self.busy = False
+
+    def search(self, query):
+        with self.locker:
+            if self.busy:
+                raise Exception("used by two threads")
+            self.busy = True
+        Till(seconds=0.05).wait()
+        with self.locker:
+            self.busy = False
+        return query
+
+
+class TestClientPool(FuzzyTestCase):
+
+    def test_one_thread_per_client(self):
+        pool = ClientPool(Client, 3)
+
+        def search(please_stop):
+            output = []
+            for i in range(5):
+                with pool.client() as client:
+                    output.append(client.search(i))
+            return output
+
+        threads = [Thread.run("search " + str(i), search) for i in range(8)]
+        self.assertEqual([t.join() for t in threads], [list(range(5))] * 8)
+        self.assertEqual(pool.made, 3)
+        self.assertEqual(len(pool.idle), 3)
+
+    def test_reuse_client(self):
+        pool = ClientPool(Client, 3)
+        with pool.client() as first:
+            pass
+        with pool.client() as second:
+            self.assertIs(first, second)
+        self.assertEqual(pool.made, 1)
+
+    def test_client_returned_after_failure(self):
+        pool = ClientPool(Client, 1)
+        try:
+            with pool.client():
+                raise Exception("search failed")
+        except Exception:
+            pass
+        with pool.client() as client:
+            self.assertEqual(client.search("a"), "a")
+        self.assertEqual(pool.made, 1)
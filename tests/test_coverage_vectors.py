@@ -0,0 +1,94 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import random
+
+import numpy as np
+from mo_testing.fuzzytestcase import FuzzyTestCase
+
+from coverage_vectors import CoverageVector, RevisionCoverage
+from operators import RunMap
+from tests.util import random_operator
+
+
+class TestCoverageVectors(FuzzyTestCase):
+
+    def setUp(self):
+        self.rand = random.Random(42)
+
+    def test_set_operations(self):
+        a = CoverageVector.from_lines([0, 3, 9, 10], 13)
+        b = CoverageVector.from_lines([3, 4, 10, 12], 13)
+
+        self.assertEqual((a | b).lines().tolist(), [0, 3, 4, 9, 10, 12])
+        self.assertEqual((a & b).lines().tolist(), [3, 10])
+        self.assertEqual((a | b).count(), 6)
+        self.assertEqual(len(a), 13)
+
+    def test_project_revision(self):
+        files = {}
+        for i in range(50):
+            length = self.rand.randint(0, 300)
+            files["/file" + str(i) + ".cpp"] = np.array([self.rand.random() < 0.3 for _ in range(length)], dtype=bool)
+        coverage = RevisionCoverage.from_files(files)
+        self.assertEqual(coverage.count(), sum(int(np.sum(v)) for v in files.values()))
+
+        operators = {}
+        for path in self.rand.sample(sorted(files.keys()), 10):
+            operators[path], _ = random_operator(len(files[path]), self.rand)
+        operators["/new_file.js"] = RunMap([], [], [], 7, 0)
+
+        projected = coverage.project(operators)
+        for path, covered in files.items():
+            operator = operators.get(path)
+            expected = covered if operator is None else operator.apply(covered)
+            self.assertEqual(projected[path].to_bools().tolist(), expected.tolist(), path)
+        self.assertEqual(projected["/new_file.js"].to_bools().tolist(), [False] * 7)
+
+    def test_project_ignores_uncovered_files(self):
+        coverage = RevisionCoverage.from_files({"/a.js": [1, 0, 1]})
+
+        projected = coverage.project({
+            "/README.md": RunMap([0], [0], [3], 5, 4),  # MODIFIED, BUT NOT IN THE COVERAGE
+            "/a.js": RunMap([1], [0], [3], 4, 3)
+        })
+        self.assertEqual(projected.paths, ["/a.js"])
+        self.assertEqual(projected["/a.js"].to_bools().tolist(), [False, True, False, True])
+
+    def test_union_of_revisions(self):
+        a = RevisionCoverage.from_files({"/a.js": [1, 0, 0], "/b.js": [0, 0, 1, 0]})
+        b = RevisionCoverage.from_files({"/a.js": [0, 1, 0], "/b.js": [0, 0, 1, 1]})
+
+        union = a | b
+        self.assertEqual(union["/a.js"].lines().tolist(), [0, 1])
+        self.assertEqual(union["/b.js"].lines().tolist(), [2, 3])
+        self.assertEqual((a & b).count(), 1)
+
+    def test_backward_is_transpose(self):
+        for _ in range(20):
+            operator, new_length = random_operator(self.rand.randint(0, 300), self.rand)
+            coverage = np.arange(1, new_length + 1)
+            self.assertEqual(operator.apply(coverage, backward=True).tolist(), operator.T.apply(coverage).tolist())
+            lines = np.arange(new_length + 3)
+            self.assertEqual(operator.map_lines(lines, backward=True).tolist(), operator.T.map_lines(lines).tolist())
+
+        files = {"/file" + str(i) + ".cpp": np.array([self.rand.random() < 0.3 for _ in range(100)], dtype=bool) for i in range(20)}
+        files["/deleted.js"] = np.zeros(0, dtype=bool)
+        coverage = RevisionCoverage.from_files(files)
+        operators = {path: random_operator(100, self.rand)[0].T for path in sorted(files.keys())[:8]}
+        operators["/deleted.js"] = RunMap([], [], [], 0, 5)  # DELETED; GOING BACKWARD IT COMES BACK
+
+        expected = coverage.project({path: operator.T for path, operator in operators.items()})
+        result = coverage.project(operators, backward=True)
+        self.assertTrue(result.same_layout(expected))
+        self.assertEqual(result.to_bools().tolist(), expected.to_bools().tolist())
+        self.assertEqual(len(result["/deleted.js"]), 5)
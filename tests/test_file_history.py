@@ -0,0 +1,77 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import shutil
+import tempfile
+
+from mo_dots import wrap
+from mo_files import File
+from mo_testing.fuzzytestcase import FuzzyTestCase
+
+from mo_hg.file_history import FileHistory
+
+
+def _revision(index, changeset_id, files=None, diff=None):
+    return wrap({
+        "branch": {"name": "mozilla-central"},
+        "index": index,
+        "changeset": {"id": changeset_id, "files": files, "diff": diff}
+    })
+
+
+class TestFileHistory(FuzzyTestCase):
+
+    def test_only_touching_changesets(self):
+        history = FileHistory()
+        history.add(_revision(3, "ccc", files=["a.js", "b.js"]))
+        history.add(_revision(1, "aaa", files=["a.js"]))
+        history.add(_revision(2, "bbb", files=["b.js"]))
+        history.add(_revision(4, "ddd", files=["c.txt"]))
+        history.add(_revision(5, "eee", files=["a.js"]))
+        history.add(_revision(3, "ccc", files=["a.js", "b.js"]))  # DUPLICATES ARE IGNORED
+
+        self.assertEqual(history.changesets("mozilla-central", "/a.js", 0, 5), ["aaa", "ccc", "eee"])
+        self.assertEqual(history.changesets("mozilla-central", "/a.js", 1, 4), ["ccc"])
+        self.assertEqual(history.changesets("mozilla-central", "/b.js", 2, 5), ["ccc"])
+        self.assertEqual(history.changesets("mozilla-central", "/c.js", 0, 5), [])
+        self.assertRaises(Exception, history.changesets, "mozilla-inbound", "/a.js", 0, 5)  # NEVER SEEN
+
+    def test_files_from_diff(self):
+        history = FileHistory()
+        diff = File("tests/resources/diff1.json").read_json(flexible=False, leaves=False)
+        history.add(_revision(7, "ddd", diff=diff))
+
+        self.assertEqual(history.changesets("mozilla-central", "/tests/resources/example_file.py", 6, 7), ["ddd"])
+
+    def test_gaps_are_errors(self):
+        history = FileHistory()
+        history.add(_revision(1, "aaa", files=["a.js"]))
+        history.add(_revision(3, "ccc", files=["b.js"]))
+
+        self.assertEqual(history.missing("mozilla-central", 0, 3), 1)
+        self.assertRaises(Exception, history.changesets, "mozilla-central", "/a.js", 0, 3)
+        history.add(_revision(2, "bbb", files=[]))  # TOUCHES NOTHING, BUT STILL SEEN
+        self.assertEqual(history.changesets("mozilla-central", "/a.js", 0, 3), ["aaa"])
+
+    def test_persisted(self):
+        directory = tempfile.mkdtemp()
+        try:
+            history = FileHistory(directory)
+            history.add(_revision(1, "aaa", files=["a.js"]))
+            history.add(_revision(2, "bbb", files=["a.js", "b.js"]))
+
+            reloaded = FileHistory(directory)
+            self.assertEqual(reloaded.changesets("mozilla-central", "/a.js", 0, 2), ["aaa", "bbb"])
+            self.assertEqual(reloaded.missing("mozilla-central", 0, 2), 0)
+        finally:
+            shutil.rmtree(directory)
+
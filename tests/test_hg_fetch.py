@@ -0,0 +1,75 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+from mo_logs import Log
+from mo_testing.fuzzytestcase import FuzzyTestCase
+from mo_threads import Lock, Till
+
+from mo_hg.hg_fetch import HgFetcher
+
+
+class TestHgFetch(FuzzyTestCase):
+
+    def test_requests_run_at_once(self):
+        fetcher = HgFetcher(per_host=4)
+        locker = Lock()
+        state = {"running": 0, "most": 0}
+
+        def request(url):
+            with fetcher.slot(url):
+                with locker:
+                    state["running"] += 1
+                    state["most"] = max(state["most"], state["running"])
+                Till(seconds=0.2).wait()
+                with locker:
+                    state["running"] -= 1
+            return url
+
+        urls = ["https://hg.mozilla.org/" + str(i) for i in range(3)]
+        results = fetcher.join_all([fetcher.start("request", request, u) for u in urls])
+        self.assertEqual(results, urls)
+        self.assertEqual(state["most"], 3)
+
+    def test_per_host_cap(self):
+        fetcher = HgFetcher(per_host=2)
+        locker = Lock()
+        running = {}
+        most = {}
+
+        def request(url):
+            host = url.split("/")[2]
+            with fetcher.slot(url):
+                with locker:
+                    running[host] = running.get(host, 0) + 1
+                    most[host] = max(most.get(host, 0), running[host])
+                Till(seconds=0.1).wait()
+                with locker:
+                    running[host] -= 1
+
+        urls = ["https://hg.mozilla.org/" + str(i) for i in range(6)] + ["https://other.org/" + str(i) for i in range(2)]
+        fetcher.join_all([fetcher.start("request", request, u) for u in urls])
+        self.assertEqual(most, {"hg.mozilla.org": 2, "other.org": 2})
+
+    def test_join_all_waits_for_every_thread(self):
+        fetcher = HgFetcher()
+        done = []
+
+        def fail():
+            Log.error("hg denies it exists")
+
+        def slow():
+            Till(seconds=0.2).wait()
+            done.append(True)
+
+        threads = [fetcher.start("fail", fail), fetcher.start("slow", slow), None]
+        self.assertRaises(Exception, fetcher.join_all, threads)
+        self.assertEqual(done, [True])
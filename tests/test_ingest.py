@@ -0,0 +1,106 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import os
+import random
+import shutil
+import tempfile
+
+import numpy as np
+from mo_files import File
+from mo_json import value2json
+from mo_testing.fuzzytestcase import FuzzyTestCase
+
+from coverage_vectors import RevisionCoverage
+from ingest import CoverageIngester, read_coverage, read_lcov, write_coverage
+from operators import NO_LINE
+from projection import CoverageMerge
+from tests.util import random_operator
+
+
+class TestIngest(FuzzyTestCase):
+
+    def setUp(self):
+        self.rand = random.Random(42)
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_map_lines(self):
+        for _ in range(20):
+            operator, _ = random_operator(self.rand.randint(0, 300), self.rand)
+            old_length = operator.tail_old + 5
+            expected = operator.to_line_map(old_length=old_length).old_to_new
+            self.assertEqual(operator.map_lines(np.arange(old_length)).tolist(), expected.tolist())
+        self.assertEqual(operator.T.map_lines([]).tolist(), [])
+        self.assertTrue(NO_LINE in expected.tolist())
+
+    def test_read_lcov(self):
+        lines = [
+            "TN:",
+            "SF:dom/base/nsDocument.cpp",
+            "DA:1,3",
+            "DA:2,0",
+            "DA:7,1",
+            "end_of_record",
+            "SF:/js/src/jsapi.cpp",
+            "DA:4,0",
+            "end_of_record"
+        ]
+        self.assertEqual(list(read_lcov(lines)), [("/dom/base/nsDocument.cpp", [0, 6]), ("/js/src/jsapi.cpp", [])])
+
+    def test_ingest_directory(self):
+        lengths = {"/file" + str(i) + ".cpp": self.rand.randint(10, 200) for i in range(10)}
+        changesets = [("c0", {})]
+        history = [dict(lengths)]
+        for i in range(1, 10):
+            operators = {}
+            for path in self.rand.sample(sorted(lengths.keys()), 3):
+                operators[path], lengths[path] = random_operator(lengths[path], self.rand)
+            changesets.append(("c" + str(i), operators))
+            history.append(dict(lengths))
+
+        # ONE lcov RUN ON c2, AND ONE JSON-LINES RUN ON c8
+        runs = []
+        for revision, position in [("c2", 2), ("c8", 8)]:
+            runs.append((revision, RevisionCoverage.from_files({
+                p: np.array([self.rand.random() < 0.3 for _ in range(l)], dtype=bool)
+                for p, l in history[position].items()
+            })))
+        lcov = []
+        for path, vector in runs[0][1].files().items():
+            lcov.append("SF:" + path[1:])
+            lcov.extend("DA:" + str(l + 1) + ",1" for l in vector.lines().tolist())
+            lcov.append("end_of_record")
+        File.new_instance(self.directory, "a", "run1.info").write("\n".join(lcov))
+        File.new_instance(self.directory, "b", "run2.json").write("\n".join(
+            value2json({"revision": "c8", "path": path, "covered": (vector.lines() + 1).tolist()})
+            for path, vector in runs[1][1].files().items()
+        ))
+
+        ingester = CoverageIngester(changesets, "c5")
+        ingester.add_directory(self.directory, "c2")
+        result = ingester.coverage(history[5])
+        expected = CoverageMerge(changesets, "c5").merge(runs)
+
+        self.assertEqual(ingester.records, 20)
+        self.assertEqual(sorted(result.paths), sorted(expected.paths))
+        for path in expected.paths:
+            self.assertEqual(result[path].to_bools().tolist(), expected[path].to_bools().tolist(), path)
+
+        # COMPACT FILE ROUND TRIP
+        filename = os.path.join(self.directory, "c5.coverage")
+        write_coverage(result, filename)
+        copy = read_coverage(filename)
+        self.assertTrue(copy.same_layout(result))
+        self.assertEqual(copy.to_bools().tolist(), result.to_bools().tolist())
@@ -0,0 +1,95 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+from mo_dots import wrap
+from mo_testing.fuzzytestcase import FuzzyTestCase
+
+from mo_hg.parse import diff_to_json
+from planner import RevisionDag, diff_cost, MERGE_COST
+
+
+def _id(name):
+    return (name + "_" * 12)[:12] + "0" * 28
+
+
+def _hunks(num):
+    # ONE FILE, WITH num SEPARATE ONE-LINE EDITS
+    return [{"new": {"name": "/a.js"}, "old": {"name": "/a.js"}, "changes": [{"new": {"line": i * 10}} for i in range(num)]}]
+
+
+class TestPlanner(FuzzyTestCase):
+
+    def setUp(self):
+        # CENTRAL: c0 - c1 - c2 - a - m - t
+        # AUTOLAND:       \- x1 - x2 - b -/   (m MERGES b INTO a)
+        self.dag = RevisionDag()
+        graph = [
+            ("c0", [], ["c1"], 1),
+            ("c1", ["c0"], ["c2", "x1"], 1),
+            ("c2", ["c1"], ["a"], 2),
+            ("a", ["c2"], ["m"], 1),
+            ("x1", ["c1"], ["x2"], 1),
+            ("x2", ["x1"], ["b"], 3),
+            ("b", ["x2"], ["m"], 1),
+            ("m", ["a", "b"], ["t"], None),
+            ("t", ["m"], [], 1)
+        ]
+        for name, parents, children, hunks in graph:
+            self.dag.add(wrap({
+                "changeset": {"id": _id(name), "diff": None if hunks is None else _hunks(hunks)},
+                "parents": [_id(p) for p in parents],
+                "children": [_id(c) for c in children]
+            }))
+
+    def test_avoid_unknown_merge_parent(self):
+        cost, steps = self.dag.plan(_id("x2"), _id("t"))
+        self.assertEqual(cost, 3 + 1 + 2 + 1 + MERGE_COST + 1)
+        self.assertEqual(steps, [
+            (_id("x2"), _id("x1"), True),
+            (_id("x1"), _id("c1"), True),
+            (_id("c2"), _id("c1"), False),
+            (_id("a"), _id("c2"), False),
+            (_id("m"), _id("a"), False),
+            (_id("t"), _id("m"), False)
+        ])
+
+    def test_through_merge(self):
+        # THE MERGE AGAINST ITS SECOND PARENT IS SMALL
+        self.dag.add_edge(_id("b"), _id("m"), 2)
+        cost, steps = self.dag.plan(_id("x2"), _id("t"))
+        self.assertEqual(cost, 1 + 2 + 1)
+        self.assertEqual(steps, [(_id("b"), _id("x2"), False), (_id("m"), _id("b"), False), (_id("t"), _id("m"), False)])
+
+        # AND BACKWARD
+        cost, steps = self.dag.plan(_id("t"), _id("x2"))
+        self.assertEqual(steps, [(_id("t"), _id("m"), True), (_id("m"), _id("b"), True), (_id("b"), _id("x2"), True)])
+
+    def test_unknown_revision(self):
+        self.assertRaises(Exception, self.dag.plan, _id("x2"), _id("nowhere"))
+
+    def test_diff_cost(self):
+        diff = diff_to_json(
+            "--- a/a.js\n"
+            "+++ b/a.js\n"
+            "@@ -1,4 +1,4 @@\n"
+            " one\n"
+            "-two\n"
+            "-three\n"
+            "+2\n"
+            "+3\n"
+            " four\n"
+            "@@ -10,2 +10,3 @@\n"
+            " ten\n"
+            "+ten and a half\n"
+            " eleven\n"
+        )
+        self.assertEqual(diff_cost(diff), 2)
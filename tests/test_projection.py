@@ -0,0 +1,88 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import random
+
+import numpy as np
+from mo_testing.fuzzytestcase import FuzzyTestCase
+
+from coverage_vectors import RevisionCoverage, union
+from operators import RunMap
+from projection import CoverageMerge
+from tests.util import random_operator
+
+
+class TestProjection(FuzzyTestCase):
+
+    def setUp(self):
+        self.rand = random.Random(42)
+
+    def _random_branch(self, num):
+        """
+        :return: (changesets, LIST OF {path: length} FOR EACH REVISION)
+        """
+        lengths = {"/file" + str(i) + ".cpp": self.rand.randint(0, 200) for i in range(20)}
+        changesets = [("c0", {})]
+        history = [dict(lengths)]
+        for i in range(1, num):
+            operators = {}
+            for path in self.rand.sample(sorted(lengths.keys()), 4):
+                operators[path], lengths[path] = random_operator(lengths[path], self.rand)
+            if i == num // 2:
+                operators["/added.js"] = RunMap([], [], [], 9, 0)
+                lengths["/added.js"] = 9
+            changesets.append(("c" + str(i), operators))
+            history.append(dict(lengths))
+        return changesets, history
+
+    def _random_coverage(self, lengths):
+        return RevisionCoverage.from_files({p: np.array([self.rand.random() < 0.3 for _ in range(l)], dtype=bool) for p, l in lengths.items()})
+
+    def _one_at_a_time(self, changesets, coverage, start, end):
+        """
+        PROJECT coverage FROM REVISION start TO REVISION end, ONE CHANGESET AT A TIME
+        """
+        for p in range(start + 1, end + 1):
+            coverage = coverage.project(changesets[p][1])
+        for p in range(start, end, -1):
+            coverage = coverage.project({path: operator.T for path, operator in changesets[p][1].items()})
+        return coverage
+
+    def test_merge_runs(self):
+        changesets, history = self._random_branch(30)
+        target = 12
+        positions = [3, 25, 12, 0, 29, 7, 18]
+        runs = [("c" + str(p), self._random_coverage(history[p])) for p in positions]
+
+        expected = union(self._one_at_a_time(changesets, coverage, p, target) for p, (_, coverage) in zip(positions, runs))
+
+        merge = CoverageMerge(changesets, "c" + str(target))
+        for revision_id, coverage in runs[:3]:
+            merge.add(revision_id, coverage)
+        result = merge.merge(runs[3:])
+
+        self.assertEqual(merge.runs, len(positions))
+        # FILES ADDED AFTER THE target COME BACK FROM NEWER RUNS WITH NO LINES
+        self.assertEqual(sorted(result.paths), sorted(list(history[target].keys()) + ["/added.js"]))
+        self.assertEqual(len(result["/added.js"]), 0)
+        for path in expected.paths:
+            self.assertEqual(result[path].to_bools().tolist(), expected[path].to_bools().tolist(), path)
+        self.assertEqual(sorted(merge.cache.keys()), sorted(set(positions)))
+
+    def test_union_of_different_files(self):
+        a = RevisionCoverage.from_files({"/a.js": [1, 0, 0], "/b.js": [0, 1]})
+        b = RevisionCoverage.from_files({"/b.js": [1, 0], "/c.js": [0, 0, 1, 1]})
+
+        result = union([a, b])
+        self.assertEqual(result.paths, ["/a.js", "/b.js", "/c.js"])
+        self.assertEqual(result.to_bools().tolist(), [True, False, False, True, True, False, False, True, True])
+        self.assertRaises(Exception, union, [a, RevisionCoverage.from_files({"/a.js": [1]})])
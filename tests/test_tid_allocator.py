@@ -0,0 +1,81 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from mo_testing.fuzzytestcase import FuzzyTestCase
+
+from tid_allocator import BlockAllocator
+
+WORKER_TIMEOUT = 60  # SECONDS
+
+# EACH WORKER IS A FRESH PYTHON PROCESS, SO NOTHING IS FORKED FROM A PROCESS RUNNING mo_threads
+WORKER = """
+import sys
+from tid_allocator import BlockAllocator
+allocator = BlockAllocator(sys.argv[1], block_size=100)
+for n in (30, 90, 250, 1):
+    print("\\n".join(str(t) for t in allocator.allocate(n)))
+"""
+
+
+class TestTidAllocator(FuzzyTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, "high_water_mark.txt")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_blocks(self):
+        allocator = BlockAllocator(self.filename, block_size=100)
+        self.assertEqual(allocator.allocate(3).tolist(), [1, 2, 3])
+        self.assertEqual(allocator.allocate(98).tolist(), list(range(4, 102)))
+        self.assertEqual(allocator.leases, 2)
+
+        # A RESTART STARTS AFTER EVERYTHING LEASED
+        restarted = BlockAllocator(self.filename, block_size=100)
+        self.assertEqual(restarted.allocate(1).tolist(), [201])
+
+    def test_advance(self):
+        allocator = BlockAllocator(self.filename, block_size=100)
+        allocator.allocate(1)
+        allocator.advance(500)
+        self.assertEqual(allocator.allocate(2).tolist(), [500, 501])
+
+    def test_processes_never_share(self):
+        project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        workers = [
+            subprocess.Popen(
+                [sys.executable, "-c", WORKER, self.filename],
+                cwd=project_dir,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE
+            )
+            for _ in range(8)
+        ]
+        tids = []
+        for w in workers:
+            try:
+                stdout, stderr = w.communicate(timeout=WORKER_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                w.kill()
+                raise
+            self.assertEqual(w.returncode, 0, stderr)
+            tids.extend(int(t) for t in stdout.split())
+        self.assertEqual(len(tids), 8 * 371)
+        self.assertEqual(len(set(tids)), len(tids))
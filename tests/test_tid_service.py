@@ -0,0 +1,142 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import shutil
+import tempfile
+
+import numpy as np
+from mo_dots import Data, wrap
+from mo_json import json2value, value2json
+from mo_testing.fuzzytestcase import FuzzyTestCase
+
+from operators import RunMap
+from tid_service import TidService, ColumnCache, make_app
+from tid_store import TidStore
+
+
+class Hg(object):
+    """
+    ANSWERS FROM MEMORY, INSTEAD OF hg.mozilla.org
+    """
+
+    def __init__(self):
+        self.parents = {}  # MAP FROM REVISION TO ITS PARENTS
+        self.lengths = {}  # MAP FROM PATH TO NUMBER OF LINES
+        self.requested = []  # REVISIONS ASKED FOR
+        self.measured = []  # FILES ASKED FOR
+
+    def get_revision(self, revision):
+        changeset_id = revision.changeset.id
+        self.requested.append(changeset_id)
+        return wrap({"changeset": {"id": changeset_id}, "parents": self.parents[changeset_id]})
+
+    def get_file_lengths(self, revision, paths):
+        self.measured.extend(paths)
+        return {p: self.lengths[p] for p in paths}
+
+
+class TestTidService(FuzzyTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.branch = Data(name="mozilla-central")
+        store = TidStore(self.directory, self.branch)
+        store.seed("r0", store.engine.seed({"/a.js": 3, "/b.js": 4}))
+        store.append("r1", {"/a.js": RunMap([0], [0], [3], 4, 3)})
+        self.hg = Hg()
+        self.changesets = {}  # MAP FROM CHANGESET TO ITS OPERATORS
+        self.service = TidService(self.hg, store, self.branch, parse=lambda branch, changeset_id: self.changesets[changeset_id])
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_get_tids(self):
+        self.assertEqual(self.service.get_tids("r1", "/a.js").tolist(), [1, 2, 3, 8])
+        self.assertEqual(self.service.get_tids("r1", "/a.js", [3, 0]).tolist(), [8, 1])
+        self.assertEqual(self.service.cache.hits, 1)
+        self.assertEqual(self.service.stats().latency.count, 2)
+
+    def test_cached_column_is_read_only(self):
+        tids = self.service.get_tids("r1", "/a.js")
+        with self.assertRaises(Exception):
+            tids[0] = 42
+        self.assertEqual(self.service.get_tids("r1", "/a.js").tolist(), [1, 2, 3, 8])
+
+    def test_bulk(self):
+        result = self.service.bulk([
+            {"revision": "r0", "path": "/b.js", "lines": [1]},
+            {"revision": "r1", "path": "/a.js"},
+            {"revision": "r1", "path": "/missing.js"}
+        ])
+        self.assertEqual(result, [
+            {"revision": "r0", "path": "/b.js", "tids": [5]},
+            {"revision": "r1", "path": "/a.js", "tids": [1, 2, 3, 8]},
+            {"revision": "r1", "path": "/missing.js"}
+        ])
+        self.assertIn("/missing.js not in revision r1", result[2]["error"])
+
+    def test_cache_is_bounded(self):
+        cache = ColumnCache(max_bytes=3 * 80)
+        for i in range(5):
+            cache.set(i, np.zeros(10, dtype=np.int64))
+        self.assertEqual(sorted(cache.columns.keys()), [2, 3, 4])
+        self.assertEqual(cache.bytes, 240)
+
+    def test_http(self):
+        client = make_app(self.service).test_client()
+
+        response = client.get("/tids/r1/a.js?lines=0,3")
+        self.assertEqual(json2value(response.get_data().decode("utf8")), {"path": "/a.js", "tids": [1, 8]})
+
+        response = client.get("/tids/r1/a.js?lines=abc")
+        self.assertEqual(response.status_code, 400)
+
+        response = client.get("/tids/r1/missing.js")
+        self.assertEqual(response.status_code, 404)
+        self.assertIn("/missing.js not in revision r1", json2value(response.get_data().decode("utf8")).error)
+
+        response = client.post("/tids", data=value2json([{"revision": "r0", "path": "/a.js"}]))
+        self.assertEqual(json2value(response.get_data().decode("utf8")), [{"tids": [1, 2, 3]}])
+
+    def test_ingest_walks_first_parents(self):
+        self.hg.parents = {"r3": ["r2", "other"], "r2": ["r1"]}
+        self.hg.lengths = {"/c.js": 2}
+        self.changesets = {
+            "r2": {"/a.js": RunMap([0], [0], [4], 5, 4)},
+            "r3": {"/b.js": RunMap([0], [0], [4], 5, 4), "/c.js": RunMap([0], [0], [2], 3, 2)}
+        }
+        self.assertEqual(self.service.get_tids("r3", "/b.js").tolist(), [4, 5, 6, 7, 10])
+        self.assertEqual(self.hg.requested, ["r3", "r2"])  # NEVER "other", NOR r1 (ALREADY IN THE STORE)
+        self.assertEqual(self.hg.measured, ["/c.js"])  # MODIFIED BY r3, BUT NOT IN THE STORE
+        self.assertEqual(self.service.get_tids("r2", "/a.js").tolist(), [1, 2, 3, 8, 9])
+        self.assertEqual(len(self.service.get_tids("r3", "/c.js")), 3)
+        self.assertEqual(self.service.store.revisions, ["r0", "r1", "r2", "r3"])
+
+    def test_ingest_from_old_revision(self):
+        self.hg.parents = {"r2": ["r0"]}
+        self.assertRaises(Exception, self.service.get_tids, "r2", "/a.js")
+        self.assertEqual(self.service.store.revisions, ["r0", "r1"])
+
+    def test_file_not_modified_since_seed(self):
+        self.hg.lengths = {"/d.js": 2}
+        self.assertEqual(self.service.get_tids("r1", "/d.js").tolist(), [9, 10])
+        self.assertEqual(self.service.get_tids("r0", "/d.js").tolist(), [9, 10])
+        self.assertEqual(self.hg.measured, ["/d.js"])
+
+        self.hg.parents = {"r2": ["r1"]}
+        self.changesets = {"r2": {"/d.js": RunMap([0], [0], [2], 3, 2)}}
+        self.assertEqual(self.service.get_tids("r2", "/d.js").tolist(), [9, 10, 11])
+        self.assertEqual(self.hg.measured, ["/d.js"])  # ITS LENGTH IS ALREADY KNOWN
+
+        reader = TidStore(self.directory, self.branch)
+        self.assertEqual(reader.get("r1", "/d.js").tolist(), [9, 10])
+        self.assertEqual(reader.get("r2", "/d.js").tolist(), [9, 10, 11])
@@ -0,0 +1,123 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import random
+import shutil
+import tempfile
+
+from mo_dots import Data
+from mo_testing.fuzzytestcase import FuzzyTestCase
+
+from operators import RunMap
+from tests.util import random_operator
+from tid_store import TidStore
+from tids import TidEngine, TidCounter
+
+
+class TestTidStore(FuzzyTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.branch = Data(name="mozilla-central")
+        self.rand = random.Random(42)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _random_changeset(self, revision):
+        operators = {}
+        for path in self.rand.sample(revision.paths, 3):
+            operators[path], _ = random_operator(len(revision[path]), self.rand)
+        return operators
+
+    def test_reconstruct(self):
+        store = TidStore(self.directory, self.branch, checkpoint_every=4)
+        revision = store.engine.seed({"/file" + str(i) + ".cpp": self.rand.randint(0, 100) for i in range(10)})
+        store.seed("r0", revision)
+
+        expected = {"r0": revision}
+        for i in range(1, 11):
+            operators = self._random_changeset(revision)
+            if i == 5:
+                operators["/new_file.js"] = RunMap([], [], [], 12, 0)
+            revision = store.append("r" + str(i), operators)
+            expected["r" + str(i)] = revision
+
+        # REOPEN, AS ANOTHER PROCESS WOULD
+        reader = TidStore(self.directory, self.branch, checkpoint_every=4)
+        for revision_id, revision in expected.items():
+            for path in revision.paths:
+                self.assertEqual(reader.get(revision_id, path).tolist(), revision[path].tolist())
+            self.assertEqual(reader.revision(revision_id).tids.tolist(), revision.tids.tolist())
+        self.assertEqual(reader.get("r4", "/new_file.js"), None)
+        self.assertEqual(reader.lookup("r7", "/new_file.js", [0, 11]).tolist(), expected["r7"]["/new_file.js"][[0, 11]].tolist())
+
+    def test_append_after_reopen(self):
+        store = TidStore(self.directory, self.branch, checkpoint_every=4)
+        store.seed("r0", store.engine.seed({"/a.js": 10, "/b.js": 20}))
+        store.append("r1", {"/a.js": RunMap([0], [0], [10], 12, 10)})
+
+        reader = TidStore(self.directory, self.branch, checkpoint_every=4, engine=TidEngine(TidCounter(100)))
+        revision = reader.append("r2", {"/b.js": RunMap([0], [0], [20], 21, 20)})
+        self.assertEqual(reader.get("r2", "/a.js").tolist(), list(range(1, 11)) + [31, 32])
+        self.assertEqual(revision["/b.js"].tolist()[-1], 100)
+
+    def test_files_new_to_the_store(self):
+        store = TidStore(self.directory, self.branch)
+        store.seed("r0", store.engine.seed({"/a.js": 2}))
+
+        revision = store.append("r1", {
+            "/b.js": RunMap([0], [0], [4], 5, 4),  # MODIFIED, WITH KNOWN LENGTH
+            "/README.md": RunMap([0], [0], [3], 5, 4)  # MODIFIED, UNKNOWN
+        }, old_lengths={"/b.js": 4})
+        self.assertEqual(revision.paths, ["/a.js", "/b.js"])
+        self.assertEqual(len(set(revision["/b.js"].tolist()) | set(revision["/a.js"].tolist())), 7)
+
+        store.append("r2", {"/b.js": RunMap([0], [1], [4], 4, 5)})
+        reader = TidStore(self.directory, self.branch)
+        self.assertEqual(reader.get("r1", "/b.js").tolist(), revision["/b.js"].tolist())
+        self.assertEqual(reader.get("r2", "/b.js").tolist(), revision["/b.js"].tolist()[1:])
+        self.assertEqual(reader.revision("r2").tids.tolist(), store.revision("r2").tids.tolist())
+        self.assertEqual(reader.get("r2", "/README.md"), None)
+
+    def test_reopen_never_reuses_tids(self):
+        store = TidStore(self.directory, self.branch)
+        store.seed("r0", store.engine.seed({"/a.js": 3}))
+
+        seen = {1, 2, 3}
+        for revision_id in ("r1", "r2"):
+            reopened = TidStore(self.directory, self.branch)
+            revision = reopened.append(revision_id, {"/a.js": RunMap([0], [0], [len(seen)], len(seen) + 1, len(seen))})
+            tids = revision["/a.js"].tolist()
+            self.assertEqual(tids[:-1], sorted(seen))
+            self.assertNotIn(tids[-1], seen)
+            seen.add(tids[-1])
+
+    def test_adopt(self):
+        store = TidStore(self.directory, self.branch, checkpoint_every=2)
+        store.seed("r0", store.engine.seed({"/a.js": 2}))
+        store.append("r1", {"/a.js": RunMap([0], [0], [2], 3, 2)})
+        store.adopt("/b.js", 3)
+        self.assertEqual(store.get("r0", "/b.js").tolist(), [4, 5, 6])
+        self.assertEqual(store.unknown_files({"/b.js": RunMap([0], [0], [3], 4, 3)}), [])
+
+        for i in range(2, 6):
+            revision = store.append("r" + str(i), {"/b.js": RunMap([0], [0], [i + 1], i + 2, i + 1)})
+        self.assertEqual(revision["/b.js"].tolist(), [4, 5, 6, 7, 8, 9, 10])
+
+        reader = TidStore(self.directory, self.branch, checkpoint_every=2)
+        self.assertEqual(reader.get("r1", "/b.js").tolist(), [4, 5, 6])
+        self.assertEqual(reader.get("r3", "/b.js").tolist(), [4, 5, 6, 7, 8])
+        for i in range(1, 6):
+            self.assertEqual(reader.revision("r" + str(i)).tids.tolist(), store.revision("r" + str(i)).tids.tolist())
+        self.assertEqual(reader.revision("r5").tids.tolist(), revision.tids.tolist())
+        self.assertRaises(Exception, reader.adopt, "/a.js", 3)
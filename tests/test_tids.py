@@ -0,0 +1,62 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import random
+
+import numpy as np
+from mo_testing.fuzzytestcase import FuzzyTestCase
+
+from operators import NO_LINE
+from tests.util import random_operator
+from tids import TidEngine
+
+
+class TestTids(FuzzyTestCase):
+
+    def setUp(self):
+        self.rand = random.Random(42)
+
+    def test_seed(self):
+        engine = TidEngine()
+        revision = engine.seed({"/b.js": 3, "/a.js": 2})
+
+        self.assertEqual(revision["/a.js"].tolist(), [1, 2])
+        self.assertEqual(revision["/b.js"].tolist(), [3, 4, 5])
+        self.assertEqual(revision.lookup("/b.js", [2, 0]).tolist(), [5, 3])
+
+    def test_propagate(self):
+        engine = TidEngine()
+        lengths = {"/file" + str(i) + ".cpp": self.rand.randint(0, 100) for i in range(20)}
+        revision = engine.seed(lengths)
+        seen = set(revision.tids.tolist())
+
+        for _ in range(10):
+            operators = {}
+            for path in self.rand.sample(revision.paths, 5):
+                operators[path], _ = random_operator(len(revision[path]), self.rand)
+            next_revision = engine.propagate(revision, operators)
+
+            for path in revision.paths:
+                operator = operators.get(path)
+                if operator is None:
+                    self.assertEqual(next_revision[path].tolist(), revision[path].tolist())
+                    continue
+                new_to_old = operator.to_line_map(old_length=len(revision[path])).new_to_old
+                for new_line, old_line in enumerate(new_to_old):
+                    tid = int(next_revision[path][new_line])
+                    if old_line == NO_LINE:
+                        self.assertNotIn(tid, seen, "net-new lines get new tids")
+                        seen.add(tid)
+                    else:
+                        self.assertEqual(tid, revision[path][old_line])
+            self.assertEqual(len(np.unique(next_revision.tids)), next_revision.length)
+            revision = next_revision
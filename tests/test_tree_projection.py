@@ -0,0 +1,49 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import random
+
+import numpy as np
+from mo_testing.fuzzytestcase import FuzzyTestCase
+
+from coverage_vectors import RevisionCoverage
+from operators import RunMap
+from tests.util import random_operator
+from tree_projection import TreeProjector
+
+
+class TestTreeProjection(FuzzyTestCase):
+
+    def setUp(self):
+        self.rand = random.Random(42)
+        files = {}
+        for i in range(200):
+            length = self.rand.randint(0, 300)
+            files["/file" + str(i) + ".cpp"] = np.array([self.rand.random() < 0.3 for _ in range(length)], dtype=bool)
+        self.coverage = RevisionCoverage.from_files(files)
+        self.operators = {}
+        for path in self.rand.sample(sorted(files.keys()), 40):
+            self.operators[path], _ = random_operator(len(files[path]), self.rand)
+        self.operators["/new_file.js"] = RunMap([], [], [], 7, 0)
+
+    def _check(self, projector):
+        expected = self.coverage.project(self.operators)
+        result = projector.project(self.coverage, self.operators)
+        self.assertTrue(result.same_layout(expected))
+        self.assertEqual(result.to_bools().tolist(), expected.to_bools().tolist())
+        self.assertEqual(projector.stats.lines, self.coverage.length)
+
+    def test_one_process(self):
+        self._check(TreeProjector(processes=1))
+
+    def test_process_pool(self):
+        self._check(TreeProjector(processes=2))
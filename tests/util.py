@@ -0,0 +1,34 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+from operators import RunBuilder
+
+
+def random_operator(old_length, rand):
+    """
+    :return: (RunMap, new_length) FOR A RANDOM EDIT OF A FILE WITH old_length LINES
+    """
+    runs = RunBuilder()
+    n, o = 0, 0
+    while o < old_length:
+        action = rand.random()
+        if action < 0.05:
+            n += rand.randint(1, 4)  # ADD LINES
+        elif action < 0.1:
+            o += 1  # REMOVE LINE
+        else:
+            runs.add(n, o, 1)
+            n += 1
+            o += 1
+    if rand.random() < 0.5:
+        n += rand.randint(1, 4)  # ADD LINES AT END OF FILE
+    return runs.build(n, o), n
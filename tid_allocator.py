@@ -0,0 +1,129 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+from __future__ import division
+from __future__ import unicode_literals
+
+import os
+
+import numpy as np
+from mo_logs import Log
+from mo_threads import Lock
+
+from tids import TID_TYPE
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+DEFAULT_BLOCK_SIZE = 1000000
+FIRST_TID = 1
+
+
+class BlockAllocator(object):
+    """
+    HAND OUT TIDS FROM BLOCKS LEASED FROM A SHARED HIGH-WATER MARK FILE
+
+    ANY NUMBER OF PROCESSES MAY USE THE SAME FILE; EACH LEASES block_size TIDS
+    AT A TIME, UNDER A FILE LOCK, AND THEN ALLOCATES FROM ITS BLOCK WITHOUT
+    TALKING TO ANYONE.  THE MARK IS WRITTEN BEFORE THE BLOCK IS USED, SO A
+    RESTART NEVER REUSES A TID (THE UNUSED END OF A BLOCK IS SIMPLY LOST)
+    """
+
+    def __init__(self, filename, block_size=DEFAULT_BLOCK_SIZE):
+        """
+        :param filename: FILE HOLDING THE HIGH-WATER MARK (CREATED IF MISSING)
+        :param block_size: NUMBER OF TIDS TO LEASE AT ONCE
+        """
+        self.filename = filename
+        self.block_size = block_size
+        self.locker = Lock()
+        self.next_tid = 0
+        self.end = 0  # END OF THE CURRENT LEASE
+        self.leases = 0
+
+    def allocate(self, count):
+        """
+        :return: ARRAY OF count NEW TIDS
+        """
+        with self.locker:
+            output = []
+            while count > 0:
+                if self.next_tid == self.end:
+                    self.next_tid, self.end = self.lease(max(self.block_size, count))
+                size = min(count, self.end - self.next_tid)
+                output.append(np.arange(self.next_tid, self.next_tid + size, dtype=TID_TYPE))
+                self.next_tid += size
+                count -= size
+            if len(output) == 1:
+                return output[0]
+            return np.concatenate(output) if output else np.zeros(0, dtype=TID_TYPE)
+
+    def advance(self, next_tid):
+        """
+        NEVER HAND OUT A TID BELOW next_tid (eg TIDS FOUND IN A STORE WRITTEN BEFORE THIS FILE)
+        """
+        with self.locker:
+            if self.next_tid >= next_tid:
+                return
+            self.next_tid = self.end = 0  # DROP ANY LEASE BELOW next_tid
+            self._move_mark(lambda mark: max(mark, next_tid))
+
+    def lease(self, size):
+        """
+        MOVE THE HIGH-WATER MARK UP BY size
+        :return: (start, end) OF THE LEASED TIDS
+        """
+        start, end = self._move_mark(lambda mark: mark + size)
+        self.leases += 1
+        return start, end
+
+    def _move_mark(self, move):
+        """
+        :param move: FUNCTION FROM CURRENT MARK TO NEW MARK
+        :return: (OLD MARK, NEW MARK)
+        """
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        fd = os.open(self.filename, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            _lock(fd)
+            try:
+                content = os.read(fd, 64).strip()
+                start = int(content) if content else FIRST_TID
+                end = move(start)
+                os.lseek(fd, 0, os.SEEK_SET)
+                os.ftruncate(fd, 0)
+                os.write(fd, str(end).encode("ascii"))
+                os.fsync(fd)
+            finally:
+                _unlock(fd)
+        except Exception as e:
+            Log.error("Can not move tid mark in {{filename}}", filename=self.filename, cause=e)
+        finally:
+            os.close(fd)
+        return start, end
+
+
+def _lock(fd):
+    if fcntl:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+    else:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+
+
+def _unlock(fd):
+    if fcntl:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    else:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
@@ -0,0 +1,315 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+# RUN THE HTTP SERVICE WITH
+#
+#     python tid_service.py --settings=config.json
+#
+from __future__ import division
+from __future__ import unicode_literals
+
+from collections import OrderedDict, deque
+from timeit import default_timer
+
+import numpy as np
+from mo_dots import listwrap, wrap, coalesce
+from mo_files import File
+from mo_json import value2json, json2value
+from mo_logs import Log, startup, constants
+from mo_threads import Lock
+
+from mo_hg.hg_mozilla_org import HgMozillaOrg
+from mo_hg.repos.changesets import Changeset
+from mo_hg.repos.revisions import Revision
+from parse import parse_to_map
+from tid_allocator import BlockAllocator, DEFAULT_BLOCK_SIZE
+from tid_store import TidStore, DEFAULT_CHECKPOINT_EVERY, HIGH_WATER_MARK
+from tids import TidEngine
+
+DEFAULT_CACHE_BYTES = 256 * 1024 * 1024
+DEFAULT_PORT = 5000
+MAX_WALK = 1000  # MOST CHANGESETS WE WILL INGEST TO ANSWER ONE REQUEST
+LATENCY_SAMPLES = 10000
+LATENCY_TARGETS = {"p50": 0.005, "p99": 0.050}  # SECONDS
+
+
+class ColumnCache(object):
+    """
+    LEAST-RECENTLY-USED TID COLUMNS, BOUNDED BY TOTAL BYTES
+    """
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.columns = OrderedDict()
+        self.locker = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.locker:
+            column = self.columns.pop(key, None)
+            if column is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.columns[key] = column
+            return column
+
+    def set(self, key, column):
+        with self.locker:
+            old = self.columns.pop(key, None)
+            if old is not None:
+                self.bytes -= old.nbytes
+            if column.nbytes > self.max_bytes:
+                return
+            self.columns[key] = column
+            self.bytes += column.nbytes
+            while self.bytes > self.max_bytes:
+                _, evicted = self.columns.popitem(last=False)
+                self.bytes -= evicted.nbytes
+
+
+class Latency(object):
+    """
+    KEEP THE MOST RECENT REQUEST DURATIONS, FOR PERCENTILES
+    """
+
+    def __init__(self, samples=LATENCY_SAMPLES):
+        self.durations = deque(maxlen=samples)
+        self.locker = Lock()
+
+    def add(self, duration):
+        with self.locker:
+            self.durations.append(duration)
+
+    def stats(self, targets=LATENCY_TARGETS):
+        with self.locker:
+            durations = np.array(self.durations)
+        output = {"count": len(durations)}
+        if len(durations):
+            for name, percentile in (("p50", 50), ("p99", 99)):
+                output[name] = float(np.percentile(durations, percentile))
+                output[name + "_target"] = targets[name]
+                output[name + "_ok"] = output[name] <= targets[name]
+        return output
+
+
+class TidService(object):
+    """
+    ANSWER (revision, file) WITH THE TIDS OF ALL LINES, AND (revision, file, lines)
+    WITH THE TIDS OF JUST THOSE LINES.  REVISIONS NOT YET IN THE STORE ARE
+    INGESTED BY WALKING hg PARENTS BACK TO THE STORE, AND APPLYING EACH PARSED
+    CHANGESET.  A FILE NO CHANGESET IN THE STORE HAS MODIFIED GETS ITS TIDS THE
+    FIRST TIME IT IS ASKED FOR.  LINE NUMBERS ARE ZERO-BASED.
+    """
+
+    def __init__(self, hg, store, branch, cache_bytes=DEFAULT_CACHE_BYTES, max_walk=MAX_WALK, parse=parse_to_map):
+        """
+        :param hg: HgMozillaOrg, FOR REVISIONS NOT IN THE store, AND FILE LENGTHS
+        :param store: TidStore OF THE branch
+        :param branch: THE BRANCH ({"name", "url"})
+        :param parse: FUNCTION(branch, changeset_id) RETURNING MAP FROM PATH TO RunMap
+        """
+        self.hg = hg
+        self.parse = parse
+        self.store = store
+        self.branch = branch
+        self.max_walk = max_walk
+        self.cache = ColumnCache(cache_bytes)
+        self.latency = Latency()
+        self.ingest_locker = Lock()
+
+    def get_tids(self, revision_id, path, lines=None):
+        """
+        :param revision_id: THE REVISION
+        :param path: FULL PATH OF FILE, WITH LEADING SLASH
+        :param lines: OPTIONAL LIST OF ZERO-BASED LINE NUMBERS (DEFAULT ALL)
+        :return: ARRAY OF TIDS (READ-ONLY)
+        """
+        start = default_timer()
+        try:
+            tids = self._column(revision_id, path)
+            if lines is None:
+                return tids
+            lines = np.asarray(lines, dtype=np.int64)
+            if len(lines) and (lines.min() < 0 or lines.max() >= len(tids)):
+                Log.error("lines out of range for {{path}} ({{length}} lines)", path=path, length=len(tids))
+            return tids[lines]
+        finally:
+            self.latency.add(default_timer() - start)
+
+    def bulk(self, requests):
+        """
+        :param requests: LIST OF {"revision", "path", "lines"} ("lines" IS OPTIONAL)
+        :return: LIST OF {"revision", "path", "tids"} OR {"revision", "path", "error"}, IN SAME ORDER
+        """
+        output = []
+        for r in listwrap(requests):
+            try:
+                lines = None if r.lines == None else list(r.lines)
+                tids = self.get_tids(r.revision, r.path, lines)
+                output.append({"revision": r.revision, "path": r.path, "tids": tids.tolist()})
+            except Exception as e:
+                output.append({"revision": r.revision, "path": r.path, "error": str(e)})
+        return output
+
+    def stats(self):
+        return wrap({
+            "latency": self.latency.stats(),
+            "cache": {
+                "bytes": self.cache.bytes,
+                "columns": len(self.cache.columns),
+                "hits": self.cache.hits,
+                "misses": self.cache.misses
+            },
+            "revisions": len(self.store.revisions)
+        })
+
+    def _column(self, revision_id, path):
+        key = (revision_id[:12], path)
+        tids = self.cache.get(key)
+        if tids is not None:
+            return tids
+
+        if revision_id[:12] not in self.store.index:
+            self._ingest(revision_id)
+        tids = self.store.get(revision_id, path)
+        if tids is None:
+            self._adopt(revision_id, path)
+            tids = self.store.get(revision_id, path)
+        tids = np.array(tids)  # COPY OUT OF THE MEMORY MAP, SO THE CACHE SIZE IS HONEST
+        tids.setflags(write=False)  # CALLERS SHARE THE CACHED COLUMN
+        self.cache.set(key, tids)
+        return tids
+
+    def _adopt(self, revision_id, path):
+        """
+        GIVE path ITS TIDS; NO CHANGESET SINCE THE SEED HAS MODIFIED IT
+        """
+        revision = Revision(branch=self.branch, changeset=Changeset(id=self.store.revisions[self.store.index[revision_id[:12]]]))
+        try:
+            length = self.hg.get_file_lengths(revision, [path])[path]
+            self.store.adopt(path, length)
+        except Exception as e:
+            Log.error("{{path}} not in revision {{revision|left(12)}}", path=path, revision=revision_id, cause=e)
+
+    def _ingest(self, revision_id):
+        """
+        BRING revision_id INTO THE STORE, WITH EVERY CHANGESET SINCE THE STORE'S TIP
+        """
+        with self.ingest_locker:
+            todo = []
+            changeset_id = revision_id
+            while changeset_id[:12] not in self.store.index:
+                if len(todo) >= self.max_walk:
+                    Log.error("revision {{revision|left(12)}} is too far from the tid store", revision=revision_id)
+                revision = self.hg.get_revision(Revision(branch=self.branch, changeset=Changeset(id=changeset_id)))
+                todo.append(revision.changeset.id)
+                parents = listwrap(revision.parents)
+                if not parents:
+                    Log.error("revision {{revision|left(12)}} has no ancestor in the tid store", revision=revision_id)
+                changeset_id = parents[0]
+
+            tip = self.store.revisions[-1]
+            if changeset_id[:12] != tip[:12]:
+                Log.error(
+                    "revision {{revision|left(12)}} branches from {{parent|left(12)}}, not the tid store tip {{tip|left(12)}}",
+                    revision=revision_id,
+                    parent=changeset_id,
+                    tip=tip
+                )
+            parent_id = tip
+            for changeset_id in reversed(todo):
+                operators = self.parse(self.branch, changeset_id)
+                old_lengths = None
+                unknown = self.store.unknown_files(operators)
+                if unknown:
+                    # FIRST TIME WE SEE THESE FILES; THEIR LINES BEFORE THIS CHANGESET GET NEW TIDS TOO
+                    parent = Revision(branch=self.branch, changeset=Changeset(id=parent_id))
+                    old_lengths = self.hg.get_file_lengths(parent, unknown)
+                self.store.append(changeset_id, operators, old_lengths)
+                parent_id = changeset_id
+
+
+def make_app(service):
+    """
+    :return: FLASK APP SERVING service
+    """
+    from flask import Flask, Response, request
+
+    app = Flask(__name__)
+
+    def _json(value, status=200):
+        return Response(value2json(value), status=status, mimetype="application/json")
+
+    @app.route("/tids/<revision>/<path:path>", methods=["GET"])
+    def get_tids(revision, path):
+        lines = request.args.get("lines")
+        if lines:
+            try:
+                lines = [int(l) for l in lines.split(",")]
+            except ValueError:
+                return _json({"revision": revision, "path": "/" + path, "error": "expecting comma-separated line numbers"}, status=400)
+        try:
+            tids = service.get_tids(revision, "/" + path, lines)
+        except Exception as e:
+            return _json({"revision": revision, "path": "/" + path, "error": str(e)}, status=404)
+        return _json({"revision": revision, "path": "/" + path, "tids": tids.tolist()})
+
+    @app.route("/tids", methods=["POST"])
+    def bulk():
+        requests = json2value(request.get_data().decode("utf8"), leaves=False)
+        return _json(service.bulk(requests))
+
+    @app.route("/stats", methods=["GET"])
+    def stats():
+        return _json(service.stats())
+
+    return app
+
+
+def main():
+    hg = None
+    try:
+        config = startup.read_settings()
+        constants.set(config.constants)
+        Log.start(config.debug)
+
+        settings = config.tid_service
+        branch_name = coalesce(settings.branch, "mozilla-central")
+        branch = wrap({"name": branch_name, "url": config.hg.url + "/" + branch_name})
+        # EVERY PROCESS ASSIGNING TIDS MUST SHARE THIS FILE
+        allocator = BlockAllocator(
+            coalesce(settings.allocator, File.new_instance(settings.directory, HIGH_WATER_MARK).os_path),
+            block_size=coalesce(settings.block_size, DEFAULT_BLOCK_SIZE)
+        )
+        store = TidStore(
+            settings.directory,
+            branch,
+            checkpoint_every=coalesce(settings.checkpoint_every, DEFAULT_CHECKPOINT_EVERY),
+            engine=TidEngine(allocator)
+        )
+        if not store.revisions:
+            # START FROM AN EMPTY REVISION; FILES ARE ADDED AS CHANGESETS TOUCH THEM, OR WHEN FIRST ASKED FOR
+            if not settings.seed:
+                Log.error("expecting tid_service.seed, the revision to start an empty tid store from")
+            store.seed(settings.seed, store.engine.seed({}))
+        hg = HgMozillaOrg(config)
+        service = TidService(hg, store, branch, cache_bytes=coalesce(settings.cache_bytes, DEFAULT_CACHE_BYTES))
+        make_app(service).run(host="0.0.0.0", port=coalesce(settings.port, DEFAULT_PORT), threaded=True)
+    except Exception as e:
+        Log.error("Problem with tid service", e)
+    finally:
+        if hg is not None:
+            hg.stop()
+        Log.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,332 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+from __future__ import division
+from __future__ import unicode_literals
+
+from bisect import bisect_right
+
+import numpy as np
+from mo_dots import coalesce
+from mo_files import File
+from mo_json import value2json, json2value
+from mo_logs import Log
+from mo_threads import Lock
+
+from coverage_vectors import Layout, adds_file
+from operators import operator_to_json, json_to_operator
+from tid_allocator import BlockAllocator
+from tids import TID_TYPE, NO_TID, RevisionTids, TidEngine
+
+DEFAULT_CHECKPOINT_EVERY = 100
+HIGH_WATER_MARK = "high_water_mark.txt"
+
+
+class TidStore(object):
+    """
+    TIDS FOR EVERY REVISION OF ONE BRANCH, ON DISK
+
+    THE FULL TID COLUMN OF A REVISION IS WRITTEN EVERY checkpoint_every
+    REVISIONS. THE REVISIONS BETWEEN ONLY RECORD THEIR CHANGESET OPERATORS, AND
+    THE TIDS GIVEN TO THEIR NET-NEW LINES; THEY ARE REBUILT BY APPLYING THOSE
+    OPERATORS TO THE CHECKPOINT BEFORE THEM.
+
+    THE SEGMENT IS READ THROUGH A MEMORY MAP, SO CHECKPOINT LOOKUPS ARE
+    ZERO-COPY, AND PROCESSES READING THE SAME STORE SHARE PAGES
+
+    directory/
+        high_water_mark.txt  - THE DEFAULT TID ALLOCATOR, SHARED BY ALL BRANCHES IN directory
+    directory/branch/
+        tids.bin     - APPEND-ONLY int64 SEGMENT: CHECKPOINT COLUMNS AND NET-NEW TIDS
+        index.json   - ONE RECORD PER LINE, PER REVISION, IN BRANCH ORDER
+                       {"revision": id, "checkpoint": {"start", "paths", "offsets"}}
+                       {"revision": id, "fresh": [start, end], "operators": [{"path", "runs", "tail", "fresh", "old_length"}, ...]}
+                       ("old_length" ONLY FOR FILES THE STORE DID NOT HAVE BEFORE THIS CHANGESET MODIFIED THEM)
+                       {"adopt": {"path", "fresh": [start, end]}}
+                       (THE TIDS OF A FILE NOT MODIFIED SINCE THE SEED, GIVEN WHEN FIRST ASKED FOR;
+                       THEY ARE THE FILE'S TIDS IN EVERY REVISION UNTIL A CHANGESET MODIFIES IT)
+                       EVERY RECORD ALSO HAS "next_tid", ABOVE EVERY TID WRITTEN SO FAR
+    """
+
+    def __init__(self, directory, branch, checkpoint_every=DEFAULT_CHECKPOINT_EVERY, engine=None):
+        self.directory = File.new_instance(directory, branch.name)
+        self.checkpoint_every = checkpoint_every
+        self.engine = engine or TidEngine(BlockAllocator(File.new_instance(directory, HIGH_WATER_MARK).os_path))
+        self.locker = Lock()
+
+        self.revisions = []  # REVISION IDS, IN BRANCH ORDER
+        self.index = {}  # MAP FROM REVISION ID TO POSITION
+        self.checkpoints = {}  # MAP FROM POSITION TO (SEGMENT START, Layout)
+        self.checkpoint_positions = []  # SORTED
+        self.deltas = []  # FOR EACH POSITION, MAP FROM PATH TO (RunMap, FRESH START, FRESH END, old_length)
+        self.fresh = []  # FOR EACH POSITION, THE (start, end) OF ALL ITS NET-NEW TIDS
+        self.adopted = {}  # MAP FROM PATH TO (start, end) OF ITS TIDS, FOR FILES UNCHANGED SINCE THE SEED
+        self.tracked = set()  # PATHS IN ANY CHECKPOINT OR CHANGESET
+        self.num_records = 0  # LINES OF index.json READ
+        self.tip = None  # RevisionTids OF THE LAST REVISION, ONLY WHILE WRITING
+        self.next_tid = 0  # ABOVE EVERY TID IN THE STORE
+        self._segment = None
+        self.refresh()
+
+    def refresh(self):
+        """
+        READ INDEX RECORDS WRITTEN (BY ANY PROCESS) SINCE WE LAST LOOKED
+        """
+        with self.locker:
+            index_file = self._index_file()
+            if not index_file.exists:
+                return
+            lines = [l for l in index_file.read().split("\n") if l.strip()]
+            for line in lines[self.num_records:]:
+                self._add_record(json2value(line, leaves=False))
+            self._segment = None
+            self.engine.allocator.advance(self.next_tid)
+
+    def seed(self, revision_id, tids):
+        """
+        START THE BRANCH WITH A FULL REVISION
+        :param revision_id: THE REVISION
+        :param tids: RevisionTids OF THAT REVISION
+        """
+        with self.locker:
+            if self.revisions:
+                Log.error("tid store already seeded")
+            self._write(revision_id, tids, None, None)
+
+    def append(self, revision_id, operators, old_lengths=None):
+        """
+        ADD NEXT REVISION OF THE BRANCH, GIVING ITS NET-NEW LINES NEW TIDS
+        :param revision_id: REVISION THE CHANGESET CREATES
+        :param operators: MAP FROM PATH TO RunMap, FOR THE FILES THE CHANGESET TOUCHES
+        :param old_lengths: MAP FROM PATH TO old LENGTH, FOR MODIFIED FILES THE STORE DOES NOT HAVE YET
+                            (MODIFIED FILES NOT IN THE STORE, AND NOT IN old_lengths, ARE IGNORED)
+        :return: RevisionTids OF THE NEW REVISION
+        """
+        with self.locker:
+            if not self.revisions:
+                Log.error("tid store must be seeded before append")
+            if revision_id[:12] in self.index:
+                Log.error("revision {{revision|left(12)}} already in tid store", revision=revision_id)
+            if self.tip is None:
+                self.tip = self._revision(len(self.revisions) - 1)
+            self.engine.allocator.advance(self.next_tid)
+            tip = self._with_adopted(self.tip, operators)
+            old_lengths = {p: l for p, l in (old_lengths or {}).items() if p not in tip.index}
+            tids, net_new = self.engine.propagate_with_net_new(tip, operators, old_lengths)
+            self._write(revision_id, tids, operators, np.flatnonzero(net_new), old_lengths)
+            return tids
+
+    def unknown_files(self, operators):
+        """
+        :param operators: MAP FROM PATH TO RunMap, FOR THE NEXT CHANGESET
+        :return: PATHS THE CHANGESET MODIFIES THAT THE STORE DOES NOT HAVE YET
+        """
+        with self.locker:
+            if not self.revisions:
+                Log.error("tid store must be seeded first")
+            if self.tip is None:
+                self.tip = self._revision(len(self.revisions) - 1)
+            return sorted(p for p, o in operators.items() if p not in self.tip.index and p not in self.adopted and not adds_file(o))
+
+    def adopt(self, path, length):
+        """
+        GIVE NEW TIDS TO A FILE NO CHANGESET IN THE STORE HAS MODIFIED; THE
+        SAME TIDS ARE ITS TIDS IN EVERY REVISION, UNTIL A CHANGESET MODIFIES IT
+        :param path: FULL PATH OF THE FILE
+        :param length: NUMBER OF LINES IN THE FILE
+        """
+        with self.locker:
+            if path in self.adopted:
+                return
+            if path in self.tracked:
+                Log.error("{{path}} is already in the tid store", path=path)
+            self.engine.allocator.advance(self.next_tid)
+            tids = self.engine.allocator.allocate(length)
+            start = self._segment_length()
+            record = {
+                "adopt": {"path": path, "fresh": [start, start + length]},
+                "next_tid": max(self.next_tid, int(tids.max()) + 1 if length else 0)
+            }
+            with open(self._segment_file().os_path, "ab") as f:
+                f.write(np.ascontiguousarray(tids, dtype=TID_TYPE).tobytes())
+            self._index_file().append(value2json(record))
+            self._add_record(json2value(value2json(record), leaves=False))
+            self._segment = None
+
+    def get(self, revision_id, path):
+        """
+        :param revision_id: THE REVISION
+        :param path: FULL PATH OF THE FILE
+        :return: TIDS OF ALL LINES OF path, OR None IF path IS NOT IN THE REVISION
+        """
+        position = self._position(revision_id)
+        checkpoint = self.checkpoint_positions[bisect_right(self.checkpoint_positions, position) - 1]
+        segment = self._get_segment()
+
+        start, layout = self.checkpoints[checkpoint]
+        span = layout.span(path)
+        tids = None if span is None else segment[start + span[0]:start + span[1]]
+        for p in range(checkpoint + 1, position + 1):
+            delta = self.deltas[p].get(path)
+            if delta is None:
+                continue
+            operator, fresh_start, fresh_end, old_length = delta
+            if tids is None:
+                if path in self.adopted and not adds_file(operator):
+                    tids = segment[slice(*self.adopted[path])]
+                else:
+                    tids = np.zeros(coalesce(old_length, 0), dtype=TID_TYPE)
+            tids = operator.apply(tids)
+            tids[tids == NO_TID] = segment[fresh_start:fresh_end]
+        if tids is None and path in self.adopted:
+            tids = segment[slice(*self.adopted[path])]
+        return tids
+
+    def lookup(self, revision_id, path, lines):
+        """
+        :param lines: ZERO-BASED LINE NUMBERS
+        :return: TIDS FOR JUST THE GIVEN lines
+        """
+        tids = self.get(revision_id, path)
+        if tids is None:
+            Log.error("{{path}} not in revision {{revision|left(12)}}", path=path, revision=revision_id)
+        return tids[np.asarray(lines, dtype=np.int64)]
+
+    def revision(self, revision_id):
+        """
+        :return: RevisionTids OF THE WHOLE REVISION
+        """
+        return self._revision(self._position(revision_id))
+
+    def _revision(self, position):
+        checkpoint = self.checkpoint_positions[bisect_right(self.checkpoint_positions, position) - 1]
+        segment = self._get_segment()
+        start, layout = self.checkpoints[checkpoint]
+        output = RevisionTids(layout.paths, layout.offsets, segment[start:start + layout.length])
+        for p in range(checkpoint + 1, position + 1):
+            deltas = self.deltas[p]
+            output = self._with_adopted(output, {path: d[0] for path, d in deltas.items()})
+            operator, layout = output.changeset_operator(
+                {path: d[0] for path, d in deltas.items()},
+                {path: d[3] for path, d in deltas.items() if d[3] is not None}
+            )
+            tids = operator.apply(output.tids)
+            fresh_start, fresh_end = self.fresh[p]
+            tids[tids == NO_TID] = segment[fresh_start:fresh_end]
+            output = RevisionTids(layout.paths, layout.offsets, tids)
+        return output
+
+    def _with_adopted(self, revision, operators):
+        """
+        :return: revision, WITH THE ADOPTED FILES THE operators MODIFY FOR THE FIRST TIME
+        """
+        paths = sorted(p for p, o in operators.items() if p in self.adopted and p not in revision.index and not adds_file(o))
+        if not paths:
+            return revision
+        segment = self._get_segment()
+        columns = [segment[slice(*self.adopted[p])] for p in paths]
+        layout = Layout.from_lengths(revision.paths + paths, np.diff(revision.offsets).tolist() + [len(c) for c in columns])
+        return RevisionTids(layout.paths, layout.offsets, np.concatenate([revision.tids] + columns))
+
+    def _write(self, revision_id, tids, operators, net_new_positions, old_lengths=None):
+        """
+        APPEND ONE REVISION TO SEGMENT AND INDEX
+        """
+        position = len(self.revisions)
+        start = self._segment_length()
+        record = {"revision": revision_id}
+        columns = []
+
+        if operators is not None:
+            fresh = tids.tids[net_new_positions]
+            columns.append(fresh)
+            record["fresh"] = [start, start + len(fresh)]
+            record["operators"] = []
+            for path, operator in operators.items():
+                span = tids.span(path)
+                if span is None:
+                    continue  # A FILE THE STORE DOES NOT TRACK
+                span_start, span_end = span
+                lo, hi = np.searchsorted(net_new_positions, [span_start, span_end]).tolist()
+                value = operator_to_json(operator)
+                value["path"] = path
+                value["fresh"] = [start + lo, start + hi]
+                if old_lengths and path in old_lengths:
+                    value["old_length"] = old_lengths[path]
+                record["operators"].append(value)
+            start += len(fresh)
+
+        if operators is None or position % self.checkpoint_every == 0:
+            columns.append(tids.tids)
+            record["checkpoint"] = {"start": start, "paths": tids.paths, "offsets": tids.offsets.tolist()}
+
+        record["next_tid"] = max([self.next_tid] + [int(column.max()) + 1 for column in columns if len(column)])
+
+        with open(self._segment_file().os_path, "ab") as f:
+            for column in columns:
+                f.write(np.ascontiguousarray(column, dtype=TID_TYPE).tobytes())
+        self._index_file().append(value2json(record))
+        self._add_record(json2value(value2json(record), leaves=False))
+        self._segment = None
+        self.tip = tids
+
+    def _add_record(self, record):
+        self.num_records += 1
+        self.next_tid = max(self.next_tid, record["next_tid"] or 0)
+        adopt = record["adopt"]
+        if adopt:
+            self.adopted.setdefault(adopt["path"], tuple(adopt["fresh"]))  # THE FIRST, IF TWO PROCESSES ADOPT IT
+            return
+
+        position = len(self.revisions)
+        self.revisions.append(record["revision"])
+        self.index[record["revision"][:12]] = position
+
+        deltas = {}
+        for value in record["operators"] or []:
+            old_length = None if value["old_length"] == None else value["old_length"]
+            deltas[value["path"]] = (json_to_operator(value), value["fresh"][0], value["fresh"][1], old_length)
+            self.tracked.add(value["path"])
+        self.deltas.append(deltas)
+        self.fresh.append(tuple(record["fresh"]) if record["fresh"] else (0, 0))
+
+        checkpoint = record["checkpoint"]
+        if checkpoint:
+            layout = Layout(list(checkpoint["paths"]), np.array(list(checkpoint["offsets"]), dtype=np.int64))
+            self.checkpoints[position] = (checkpoint["start"], layout)
+            self.tracked.update(layout.paths)
+            self.checkpoint_positions.append(position)
+
+    def _position(self, revision_id):
+        position = self.index.get(revision_id[:12])
+        if position is None:
+            Log.error("revision {{revision|left(12)}} not in tid store", revision=revision_id)
+        return position
+
+    def _get_segment(self):
+        segment = self._segment
+        if segment is None:
+            if self._segment_length():
+                segment = np.memmap(self._segment_file().os_path, dtype=TID_TYPE, mode="r")
+            else:
+                segment = np.zeros(0, dtype=TID_TYPE)
+            self._segment = segment
+        return segment
+
+    def _segment_length(self):
+        segment_file = self._segment_file()
+        if not segment_file.exists:
+            segment_file.write_bytes(b"")
+            return 0
+        return segment_file.size // np.dtype(TID_TYPE).itemsize
+
+    def _segment_file(self):
+        return File.new_instance(self.directory, "tids.bin")
+
+    def _index_file(self):
+        return File.new_instance(self.directory, "index.json")
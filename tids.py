@@ -0,0 +1,134 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+from __future__ import division
+from __future__ import unicode_literals
+
+import numpy as np
+from mo_logs import Log
+
+from coverage_vectors import Layout
+
+TID_TYPE = np.int64
+NO_TID = 0  # TIDS START AT ONE, SO ZERO MARKS A LINE THAT HAS NO TID YET
+
+
+class TidCounter(object):
+    """
+    HAND OUT TIDS FROM MEMORY; GOOD FOR ONE PROCESS THAT OWNS ALL TIDS
+    """
+
+    def __init__(self, next_tid=1):
+        self.next_tid = next_tid
+
+    def allocate(self, count):
+        """
+        :return: ARRAY OF count NEW TIDS
+        """
+        start = self.next_tid
+        self.next_tid += count
+        return np.arange(start, start + count, dtype=TID_TYPE)
+
+    def advance(self, next_tid):
+        """
+        NEVER HAND OUT A TID BELOW next_tid
+        """
+        self.next_tid = max(self.next_tid, next_tid)
+
+
+class RevisionTids(Layout):
+    """
+    THE TID OF EVERY LINE, OF EVERY FILE, IN ONE REVISION
+    STORED AS ONE int64 COLUMN; EACH FILE IS A SLICE OF IT
+    """
+
+    __slots__ = ["tids"]
+
+    def __init__(self, paths, offsets, tids):
+        Layout.__init__(self, paths, offsets)
+        if len(tids) != self.length:
+            Log.error("expecting {{expected}} tids, not {{actual}}", expected=self.length, actual=len(tids))
+        self.tids = tids
+
+    def __getitem__(self, path):
+        """
+        :return: TIDS OF ALL LINES IN path (A VIEW, DO NOT MODIFY), OR None
+        """
+        span = self.span(path)
+        if span is None:
+            return None
+        start, end = span
+        return self.tids[start:end]
+
+    def lookup(self, path, lines):
+        """
+        :param lines: ZERO-BASED LINE NUMBERS
+        :return: TIDS FOR JUST THE GIVEN lines
+        """
+        span = self.span(path)
+        if span is None:
+            Log.error("{{path}} not in revision", path=path)
+        start, end = span
+        lines = np.asarray(lines, dtype=np.int64)
+        if len(lines) and (lines.min() < 0 or lines.max() >= end - start):
+            Log.error("lines out of range for {{path}} ({{length}} lines)", path=path, length=end - start)
+        return self.tids[start + lines]
+
+
+class TidEngine(object):
+    """
+    GIVE EVERY (revision, file, line) A TID: SEED ONE REVISION, THEN CARRY
+    THE TIDS THROUGH EACH CHANGESET; ONLY NET-NEW LINES GET NEW TIDS
+    """
+
+    def __init__(self, allocator=None):
+        """
+        :param allocator: ANYTHING WITH allocate(count) RETURNING AN ARRAY OF count UNUSED TIDS,
+                          AND advance(next_tid) TO SKIP PAST TIDS ALREADY IN USE
+        """
+        self.allocator = allocator or TidCounter()
+
+    def seed(self, lengths):
+        """
+        :param lengths: MAP FROM PATH TO NUMBER OF LINES, FOR THE SEED REVISION
+        :return: RevisionTids WITH ALL NEW TIDS
+        """
+        paths = sorted(lengths.keys())
+        layout = Layout.from_lengths(paths, [lengths[p] for p in paths])
+        return RevisionTids(layout.paths, layout.offsets, self.allocator.allocate(layout.length))
+
+    def propagate(self, revision, operators):
+        """
+        :param revision: RevisionTids OF THE CHANGESET'S old REVISION
+        :param operators: MAP FROM PATH TO RunMap, FOR ONE CHANGESET
+        :return: RevisionTids OF THE CHANGESET'S new REVISION
+        """
+        return self.propagate_with_net_new(revision, operators)[0]
+
+    def propagate_with_net_new(self, revision, operators, old_lengths=None):
+        """
+        SAME AS propagate(), BUT ALSO SAY WHICH LINES GOT NEW TIDS
+        :param old_lengths: MAP FROM PATH TO old LENGTH, FOR FILES THE CHANGESET MODIFIES
+                            THAT revision DOES NOT HAVE YET; ALL THEIR LINES GET NEW TIDS
+        :return: (RevisionTids, BOOLEAN VECTOR OF NET-NEW LINES OVER THE WHOLE REVISION)
+        """
+        operator, layout = revision.changeset_operator(operators, old_lengths)
+        tids = operator.apply(revision.tids)
+        net_new = tids == NO_TID
+        tids[net_new] = self.allocator.allocate(int(np.count_nonzero(net_new)))
+        return RevisionTids(layout.paths, layout.offsets, tids), net_new
+
+    def propagate_all(self, revision, changesets):
+        """
+        :param revision: RevisionTids TO START FROM
+        :param changesets: ITERABLE OF (changeset_id, {path: RunMap}) IN BRANCH ORDER
+        :return: GENERATOR OF (changeset_id, RevisionTids OF ITS new REVISION)
+        """
+        for changeset_id, operators in changesets:
+            revision = self.propagate(revision, operators)
+            yield changeset_id, revision
@@ -0,0 +1,217 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+# PROJECT A WHOLE REVISION OF COVERAGE WITH
+#
+#     python tree_projection.py --settings=config.json
+#
+from __future__ import division
+from __future__ import unicode_literals
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+from timeit import default_timer
+
+import numpy as np
+from mo_dots import coalesce, wrap
+from mo_logs import Log, startup, constants
+
+from coverage_vectors import RevisionCoverage
+from operators import RunMap
+
+CHUNKS_PER_PROCESS = 4  # SMALLER CHUNKS, SO ONE SLOW CHUNK DOES NOT HOLD UP THE REST
+TIMEOUT = 3600  # SECONDS TO WAIT FOR THE WORKERS
+
+
+class TreeProjector(object):
+    """
+    PROJECT THE COVERAGE OF EVERY FILE IN A REVISION THROUGH A CHANGESET
+    RANGE, SPLIT OVER A POOL OF PROCESSES
+
+    THE COVERAGE, THE OPERATOR RUNS, AND THE RESULT ARE .npy FILES THAT EVERY
+    WORKER MEMORY-MAPS; A WORKER IS ONLY SENT ITS RANGE OF FILES. WORKERS ARE
+    SPAWNED, NOT FORKED, SO THEY DO NOT INHERIT THIS PROCESS'S THREADS
+    """
+
+    def __init__(self, processes=None, directory=None):
+        """
+        :param processes: NUMBER OF WORKERS (DEFAULT ONE PER CORE); 1 RUNS IN THIS PROCESS
+        :param directory: WHERE TO PUT THE SHARED FILES (DEFAULT A NEW TEMP DIRECTORY)
+        """
+        self.processes = coalesce(processes, multiprocessing.cpu_count())
+        self.directory = directory
+        self.stats = None
+
+    def project(self, coverage, operators, backward=False):
+        """
+        :param coverage: RevisionCoverage
+        :param operators: MAP FROM PATH TO RunMap, FOR THE WHOLE RANGE (eg FROM CoverageMerge.operators())
+        :param backward: True IF coverage IS ON THE new REVISION OF THE operators
+        :return: RevisionCoverage ON THE new REVISION (old REVISION IF backward)
+        """
+        start = default_timer()
+        _, layout = coverage.changeset_operator(operators, backward=backward)
+        directory = self.directory or tempfile.mkdtemp()
+        try:
+            _write_shared(directory, coverage, layout, operators, backward)
+            chunks = _chunks(coverage.offsets, self.processes * CHUNKS_PER_PROCESS)
+            tasks = [(directory, first, last) for first, last in chunks]
+            if self.processes == 1 or len(tasks) <= 1:
+                lines = sum(_project_files(t) for t in tasks)
+            else:
+                pool = _context().Pool(self.processes)
+                try:
+                    lines = sum(pool.map_async(_project_files, tasks).get(TIMEOUT))
+                finally:
+                    pool.terminate()
+                    pool.join()
+            projected = np.load(os.path.join(directory, "projected.npy"))
+        finally:
+            if not self.directory:
+                shutil.rmtree(directory, ignore_errors=True)
+
+        duration = default_timer() - start
+        self.stats = wrap({
+            "lines": lines,
+            "files": len(coverage.paths),
+            "seconds": duration,
+            "processes": self.processes,
+            "lines_per_second_per_core": lines / duration / self.processes if duration else None
+        })
+        return RevisionCoverage(layout.paths, layout.offsets, np.packbits(projected))
+
+
+def _context():
+    if hasattr(multiprocessing, "get_context"):
+        return multiprocessing.get_context("spawn")
+    return multiprocessing
+
+
+def _chunks(offsets, num):
+    """
+    :return: LIST OF (first, last) FILE RANGES, OF ABOUT THE SAME NUMBER OF LINES
+    """
+    num_files = len(offsets) - 1
+    if not num_files:
+        return []
+    bounds = np.searchsorted(offsets, np.linspace(0, offsets[-1], num + 1), side="left")
+    bounds[0], bounds[-1] = 0, num_files
+    bounds = np.unique(np.clip(bounds, 0, num_files))
+    return [(int(a), int(b)) for a, b in zip(bounds[:-1], bounds[1:])]
+
+
+def _write_shared(directory, coverage, layout, operators, backward):
+    """
+    WRITE EVERYTHING THE WORKERS NEED, AS .npy FILES
+    THE RUNS ARE WRITTEN IN THE DIRECTION WE PROJECT, SO THE WORKERS ONLY GO FORWARD
+    """
+    num_files = len(coverage.paths)
+    run_offsets = np.zeros(num_files + 1, dtype=np.int64)  # FILE i HAS runs[run_offsets[i]:run_offsets[i+1]]
+    tails = np.zeros((num_files, 2), dtype=np.int64)
+    touched = np.zeros(num_files, dtype=bool)
+    runs = []
+    for i, path in enumerate(coverage.paths):
+        operator = operators.get(path)
+        if operator is not None:
+            to_start, from_start, length, to_tail, from_tail = operator.directed(backward)
+            touched[i] = True
+            tails[i] = to_tail, from_tail
+            runs.append(np.stack((to_start, from_start, length), axis=1).astype(np.int64))
+            run_offsets[i + 1] = operator.num_runs
+    run_offsets = np.cumsum(run_offsets)
+    runs = np.concatenate(runs) if runs else np.zeros((0, 3), dtype=np.int64)
+
+    for name, value in [
+        ("bits", coverage.bits),
+        ("old_offsets", np.asarray(coverage.offsets, dtype=np.int64)),
+        ("new_offsets", np.asarray(layout.offsets, dtype=np.int64)),
+        ("run_offsets", run_offsets),
+        ("runs", runs),
+        ("tails", tails),
+        ("touched", touched)
+    ]:
+        np.save(os.path.join(directory, name + ".npy"), value)
+    projected = np.lib.format.open_memmap(os.path.join(directory, "projected.npy"), mode="w+", dtype=bool, shape=(layout.length,))
+    projected.flush()
+    del projected
+
+
+def _project_files(task):
+    """
+    WORKER: PROJECT FILES first .. last-1 INTO THE SHARED RESULT
+    :return: NUMBER OF LINES PROJECTED
+    """
+    directory, first, last = task
+
+    def load(name):
+        return np.load(os.path.join(directory, name + ".npy"), mmap_mode="r")
+
+    old_offsets, new_offsets = load("old_offsets"), load("new_offsets")
+    run_offsets, runs, tails, touched = load("run_offsets"), load("runs"), load("tails"), load("touched")
+    projected = np.load(os.path.join(directory, "projected.npy"), mmap_mode="r+")
+
+    # UNPACK THE WHOLE CHUNK AT ONCE
+    start, end = int(old_offsets[first]), int(old_offsets[last])
+    first_byte = start // 8
+    covered = np.unpackbits(load("bits")[first_byte:(end + 7) // 8])[start - first_byte * 8:end - first_byte * 8].astype(bool)
+
+    for i in range(first, last):
+        old = covered[int(old_offsets[i]) - start:int(old_offsets[i + 1]) - start]
+        if touched[i]:
+            file_runs = runs[run_offsets[i]:run_offsets[i + 1]]
+            old = RunMap(file_runs[:, 0], file_runs[:, 1], file_runs[:, 2], tails[i, 0], tails[i, 1]).apply(old)
+        projected[int(new_offsets[i]):int(new_offsets[i + 1])] = old
+    projected.flush()
+    return end - start
+
+
+def main():
+    """
+    settings.tree_projection = {
+        "coverage": FILE FROM ingest.write_coverage(),
+        "changesets": LIST OF CHANGESET IDS, IN BRANCH ORDER, AFTER THE COVERAGE REVISION, ENDING AT THE TARGET
+        "output": FILE FOR THE PROJECTED COVERAGE,
+        "processes": NUMBER OF WORKERS (DEFAULT ONE PER CORE)
+    }
+    """
+    try:
+        config = startup.read_settings()
+        constants.set(config.constants)
+        Log.start(config.debug)
+
+        # LATE IMPORTS, SO THE WORKERS DO NOT NEED THEM
+        from ingest import read_coverage, write_coverage
+        from operators import compose_changesets
+        from parse import parse_to_map
+
+        settings = config.tree_projection
+        branch = wrap({"name": settings.branch, "url": config.hg.url + "/" + settings.branch})
+        operators = {}
+        for changeset_id in settings.changesets:
+            operators = compose_changesets(operators, parse_to_map(branch, changeset_id))
+
+        projector = TreeProjector(settings.processes)
+        write_coverage(projector.project(read_coverage(settings.coverage), operators), settings.output)
+        Log.note(
+            "projected {{lines|comma}} lines of {{files|comma}} files in {{seconds|round(places=2)}} seconds: {{rate|comma}} lines per second per core ({{processes}} processes)",
+            lines=projector.stats.lines,
+            files=projector.stats.files,
+            seconds=projector.stats.seconds,
+            rate=int(projector.stats.lines_per_second_per_core),
+            processes=projector.stats.processes
+        )
+    except Exception as e:
+        Log.error("Problem with tree projection", e)
+    finally:
+        Log.stop()
+
+
+if __name__ == "__main__":
+    main()